@@ -0,0 +1,42 @@
+"""
+Per item cost of reprojecting an acquisition footprint to EPSG:4326.
+
+    python benchmarks/geometry_benchmark.py [iterations]
+
+Compares the former GeoSeries round trip through GeoJSON text with
+reproject_geometry and the batch reproject_footprints.
+"""
+import json
+import sys
+import timeit
+
+from geopandas import GeoSeries
+from rasterio.crs import CRS
+from shapely.geometry import box
+
+from sac_stac.domain.geometry import reproject_footprints, reproject_geometry
+
+
+def create_geom_geopandas(geometry, crs):
+    poly = GeoSeries([geometry.exterior], crs=crs).to_crs(4326).to_json()
+    geom = json.loads(poly).get('features')[0].get('geometry')
+    geom['type'] = 'Polygon'
+    geom['coordinates'] = [geom['coordinates']]
+    return geom
+
+
+def main(iterations: int):
+    crs = CRS.from_epsg(32630)
+    footprints = [(box(400000 + i, 5600000, 500000 + i, 5700000), crs) for i in range(iterations)]
+
+    results = {
+        'geopandas': timeit.timeit(lambda: [create_geom_geopandas(g, c) for g, c in footprints], number=1),
+        'reproject_geometry': timeit.timeit(lambda: [reproject_geometry(g, c) for g, c in footprints], number=1),
+        'reproject_footprints': timeit.timeit(lambda: reproject_footprints(footprints), number=1),
+    }
+    for name, seconds in results.items():
+        print(f"{name:<22} {seconds / iterations * 1e6:10.1f} us/item")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
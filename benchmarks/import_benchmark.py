@@ -0,0 +1,53 @@
+"""
+Import time of the sac_stac modules, each measured in a fresh interpreter.
+
+    python benchmarks/import_benchmark.py [repeats]
+
+Reports the best cumulative import time of every module and the heavy
+dependencies it loads, the entrypoints first.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+HEAVY_MODULES = ['rasterio', 'pyproj', 'shapely', 'numpy', 'geopandas', 'pystac', 'boto3', 'nats']
+MODULES = [
+    'sac_stac.entrypoints.nats_eventconsumer',
+    'sac_stac.service_layer.services',
+    'sac_stac.service_layer.collection_buffer',
+    'sac_stac.service_layer.message_dispatcher',
+    'sac_stac.adapters.repository',
+    'sac_stac.domain.operations',
+    'sac_stac.domain.geometry',
+    'sac_stac.domain.probe_cache',
+    'sac_stac.domain.model',
+    'sac_stac.domain.s3',
+    'sac_stac.load_config',
+]
+
+
+def import_time(module: str) -> tuple:
+    """Return the cumulative import time of the module in seconds and the heavy modules it loaded."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC), os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times[module], [m for m in HEAVY_MODULES if m in times]
+
+
+def main(repeats: int):
+    for module in MODULES:
+        runs = [import_time(module) for _ in range(repeats)]
+        seconds = min(run[0] for run in runs)
+        print(f"{module:<45} {seconds * 1000:8.1f} ms  {', '.join(runs[0][1])}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
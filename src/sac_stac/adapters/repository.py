@@ -1,45 +1,71 @@
+import copy
 import json
-from typing import List
+import logging
+import random
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Iterator, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
 import botocore
 from pystac import STAC_IO
-from sac_stac.domain.s3 import S3, NoObjectError
-from sac_stac.load_config import get_s3_configuration
+from sac_stac.domain.manifest import AcquisitionManifest
+from sac_stac.domain.s3 import S3, NoObjectError, ObjectRecord, PreconditionFailedError, WriteFailedError
+from sac_stac.load_config import get_s3_configuration, get_s3_write_configuration
 from sac_stac.util import parse_s3_url
 
-S3_ENDPOINT = get_s3_configuration()["endpoint"]
 S3_BUCKET = get_s3_configuration()["bucket"]
-import logging
-from sac_stac.load_config import config, LOG_LEVEL, LOG_FORMAT, get_s3_configuration
 
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+PRESIGNED_URL_EXPIRY = 3600
+PRESIGNED_URL_MARGIN = 300
+PRESIGNED_URL_CACHE_SIZE = 4096
+UPDATE_RETRIES = 10
+UPDATE_BACKOFF = 0.05
+VERIFY_SETTLE_SECONDS = 0.1
+
+
 class S3Repository:
 
     def __init__(self, s3: S3):
         self.s3 = s3
+        self._signed_urls = OrderedDict()
+        self._signed_urls_lock = Lock()
 
     def get_acquisition_keys(self, bucket: str, acquisition_prefix: str) -> List[str]:
         return self.s3.list_common_prefixes(bucket_name=bucket, prefix=acquisition_prefix)
 
+    def get_acquisition_manifest(self, bucket: str, acquisition_prefix: str) -> AcquisitionManifest:
+        records = self.s3.list_object_records(bucket_name=bucket, prefix=acquisition_prefix)
+        if not records:
+            raise NoObjectError(f'Nothing found with {acquisition_prefix} in {bucket} bucket')
+        return AcquisitionManifest(prefix=acquisition_prefix, records=records)
+
     def get_product_keys(self, bucket: str, products_prefix: str) -> List[str]:
-        product_objs = self.s3.list_objects(bucket_name=bucket, prefix=products_prefix, suffix='.tif')
-        return [p.key for p in product_objs]
+        return self.get_acquisition_manifest(bucket=bucket, acquisition_prefix=products_prefix).product_keys
 
     def get_smallest_product_key(self, bucket: str, products_prefix: str) -> str:
         try:
-            product_objs = self.s3.list_objects(bucket_name=bucket, prefix=products_prefix, suffix='.tif')
-            product_objs_size = {p.size: p.key for p in product_objs if p.size > 1}
-            product_min_size = min(list(product_objs_size.keys()))
-            return product_objs_size.get(product_min_size)
+            manifest = self.get_acquisition_manifest(bucket=bucket, acquisition_prefix=products_prefix)
+            return manifest.smallest_product_key()
         except NoObjectError:
             raise
 
+    def get_item_keys(self, bucket: str, collection_prefix: str) -> Set[str]:
+        records = self.s3.iter_objects(bucket_name=bucket, prefix=collection_prefix, suffix='.json')
+        return {r.key for r in records if not r.key.endswith('/collection.json')}
+
+    def get_object_records(self, bucket: str, prefix: str, suffix: str = None) -> Iterator[ObjectRecord]:
+        return self.s3.iter_objects(bucket_name=bucket, prefix=prefix, suffix=suffix)
+
     def get_product_raster(self, bucket: str, product_key: str) -> bytes:
         return self.s3.get_object_body(bucket_name=bucket, object_name=product_key)
 
+    def get_product_range(self, bucket: str, product_key: str, start: int, end: int) -> bytes:
+        return self.s3.get_object_range(bucket_name=bucket, object_name=product_key, start=start, end=end)
+
     def get_dict(self, bucket: str, key: str) -> dict:
         try:
             catalog_body = self.s3.get_object_body(bucket_name=bucket, object_name=key)
@@ -47,6 +73,84 @@ class S3Repository:
         except NoObjectError:
             raise
 
+    def get_dict_with_etag(self, bucket: str, key: str) -> Tuple[dict, str]:
+        body, etag = self.s3.get_object_with_etag(bucket_name=bucket, object_name=key)
+        return json.loads(body.decode('utf-8')), etag
+
+    def put_dict(self, bucket: str, key: str, stac_dict: dict, if_match: str = None,
+                 if_none_match: str = None) -> Optional[str]:
+        """
+        Write the dict as JSON, only if the stored object matches the given conditions.
+
+        :raises PreconditionFailedError: when the stored object does not match
+        :return: ETag of the written object or None when it could not be written.
+        """
+        response = self.s3.put_object(
+            bucket_name=bucket,
+            key=key,
+            body=json.dumps(stac_dict),
+            if_match=if_match,
+            if_none_match=if_none_match
+        )
+        return response.get('ETag', '').strip('"') if response else None
+
+    def update_dict(self, bucket: str, key: str, update: Callable[[Optional[dict]], dict],
+                    retries: int = UPDATE_RETRIES, verify: bool = None) -> dict:
+        """
+        Read-modify-write a JSON document without losing concurrent updates.
+
+        The document is written only if its ETag is still the one read. On a
+        conflict the document is read again and `update` re-applied to it.
+
+        :param update: function returning the new document from the stored one, or from None when it does not exist
+        :param retries: conflicts tolerated before giving up
+        :param verify: also detect conflicts on stores ignoring If-Match, defaults to STAC_S3_VERIFY_WRITES
+
+        :raises PreconditionFailedError: when the document keeps changing
+        :raises WriteFailedError: when the document could not be written
+        :return: the written document.
+        """
+        verify = get_s3_write_configuration()["verify"] if verify is None else verify
+        for attempt in range(retries + 1):
+            try:
+                stored, etag = self.get_dict_with_etag(bucket=bucket, key=key)
+            except NoObjectError:
+                stored, etag = None, None
+
+            new_dict = update(stored)
+            try:
+                if verify:
+                    # Stores ignoring If-Match are still checked against the current ETag
+                    if self.s3.get_object_etag(bucket_name=bucket, object_name=key) != etag:
+                        raise PreconditionFailedError(f'{key} in {bucket} bucket changed')
+                if etag:
+                    written_etag = self.put_dict(bucket=bucket, key=key, stac_dict=new_dict, if_match=etag)
+                else:
+                    written_etag = self.put_dict(bucket=bucket, key=key, stac_dict=new_dict, if_none_match='*')
+                if written_etag is None:
+                    raise WriteFailedError(f'Could not write {key} in {bucket} bucket')
+                if verify:
+                    self._verify_update(bucket, key, update, written_etag)
+                return new_dict
+            except PreconditionFailedError:
+                logger.info(f"{key} changed while updating it, retrying ({attempt + 1}/{retries})")
+                time.sleep(random.uniform(0, UPDATE_BACKOFF * 2 ** attempt))
+
+        raise PreconditionFailedError(f'{key} in {bucket} bucket kept changing after {retries} retries')
+
+    def _verify_update(self, bucket: str, key: str, update: Callable[[Optional[dict]], dict], written_etag: str):
+        """
+        Check that a write racing with ours did not drop our update: the stored document
+        is either the one written or one the update leaves unchanged.
+        """
+        time.sleep(VERIFY_SETTLE_SECONDS)
+        stored, etag = self.get_dict_with_etag(bucket=bucket, key=key)
+        if etag != written_etag and update(copy.deepcopy(stored)) != stored:
+            raise PreconditionFailedError(f'{key} in {bucket} bucket was overwritten')
+
+    def delete_object(self, bucket: str, key: str):
+        self.s3.delete_object(bucket_name=bucket, key=key)
+
     def add_json_from_dict(self, bucket: str, key: str, stac_dict: dict):
         response = self.s3.put_object(
             bucket_name=bucket,
@@ -68,4 +172,21 @@ class S3Repository:
                 raise
 
     def sign_file(self, bucket: str, key: str):
-        return self.s3.create_presigned_url(bucket, key)
\ No newline at end of file
+        """
+        Return a presigned url for the key. Urls are reused until they are about
+        to expire so GDAL sees the same url, and can use its cache, for a given key.
+        """
+        now = time.monotonic()
+        with self._signed_urls_lock:
+            signed = self._signed_urls.get((bucket, key))
+            if signed and signed[1] - now > PRESIGNED_URL_MARGIN:
+                self._signed_urls.move_to_end((bucket, key))
+                return signed[0]
+
+        url = self.s3.create_presigned_url(bucket, key, expires_in=PRESIGNED_URL_EXPIRY)
+        if url:
+            with self._signed_urls_lock:
+                self._signed_urls[(bucket, key)] = (url, now + PRESIGNED_URL_EXPIRY)
+                if len(self._signed_urls) > PRESIGNED_URL_CACHE_SIZE:
+                    self._signed_urls.popitem(last=False)
+        return url
@@ -0,0 +1,74 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from sac_stac.load_config import get_s3_configuration, get_gdal_configuration
+
+if TYPE_CHECKING:
+    import rasterio
+
+
+def get_gdal_options() -> dict:
+    """
+    GDAL configuration shared by every COG open: keep-alive and multiplexed
+    HTTP connections, no directory listing on open and a sized VSI cache.
+    """
+    gdal_config = get_gdal_configuration()
+    options = dict(
+        GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR',
+        CPL_VSIL_CURL_ALLOWED_EXTENSIONS='.tif,.tiff',
+        GDAL_HTTP_MULTIPLEX='YES',
+        GDAL_HTTP_VERSION='2',
+        GDAL_HTTP_TCP_KEEPALIVE='YES',
+        GDAL_HTTP_MERGE_CONSECUTIVE_RANGES='YES',
+        VSI_CACHE='TRUE',
+        VSI_CACHE_SIZE=gdal_config["vsi_cache_size"],
+    )
+    if gdal_config["vsis3"]:
+        endpoint = urlparse(get_s3_configuration()["endpoint"])
+        if endpoint.hostname:
+            options.update(
+                AWS_HTTPS='NO' if endpoint.scheme == 'http' else 'YES',
+                AWS_VIRTUAL_HOSTING='FALSE',
+            )
+    return options
+
+
+def get_gdal_session():
+    from rasterio.session import AWSSession
+
+    if not get_gdal_configuration()["vsis3"]:
+        return None
+    s3_config = get_s3_configuration()
+    return AWSSession(
+        aws_access_key_id=s3_config["key_id"],
+        aws_secret_access_key=s3_config["access_key"],
+        region_name=s3_config["region"],
+        endpoint_url=urlparse(s3_config["endpoint"]).netloc or None,
+    )
+
+
+def get_gdal_env() -> 'rasterio.Env':
+    """
+    Return a rasterio environment to enter around a COG open. Its session and
+    options are built once and shared by every thread, while GDAL keeps its
+    connections and header cache between the environments.
+    """
+    import rasterio
+
+    return rasterio.Env(**_get_gdal_env_options())
+
+
+@lru_cache(maxsize=None)
+def _get_gdal_env_options() -> dict:
+    return dict(session=get_gdal_session(), **get_gdal_options())
+
+
+def get_cog_path(bucket: str, key: str, s3_repository) -> str:
+    """
+    Return the path GDAL opens the COG stored under the given key with: a /vsis3
+    path when STAC_GDAL_VSIS3 is enabled, a presigned url otherwise.
+    """
+    if get_gdal_configuration()["vsis3"]:
+        return f"/vsis3/{bucket}/{key}"
+    return s3_repository.sign_file(bucket=bucket, key=key)
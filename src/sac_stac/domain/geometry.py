@@ -0,0 +1,92 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, List, Tuple
+
+if TYPE_CHECKING:
+    from pyproj import Transformer
+    from rasterio.crs import CRS
+    from shapely.geometry.base import BaseGeometry
+
+GENERIC_EPSG = 4326
+TRANSFORMER_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def _get_transformer(source_crs: str, target_epsg: int) -> 'Transformer':
+    from pyproj import Transformer
+
+    return Transformer.from_crs(source_crs, f"EPSG:{target_epsg}", always_xy=True)
+
+
+def get_transformer(crs: 'CRS', target_epsg: int = GENERIC_EPSG) -> 'Transformer':
+    """
+    Return the transformer from the given CRS to target_epsg, built once per CRS.
+
+    :param crs: source CRS
+    :param target_epsg: EPSG code of the target CRS
+
+    :return: A pyproj Transformer taking and returning x, y ordered coordinates.
+    """
+    return _get_transformer(crs.to_string() or crs.to_wkt(), target_epsg)
+
+
+def reproject_geometry(geometry: 'BaseGeometry', crs: 'CRS', target_epsg: int = GENERIC_EPSG) -> dict:
+    """
+    Reproject a footprint to target_epsg as a GeoJSON geometry.
+
+    Polygons are reprojected as their exterior ring.
+
+    :param geometry: footprint in the given CRS
+    :param crs: CRS of the footprint
+    :param target_epsg: EPSG code of the target CRS
+
+    :return: A GeoJSON geometry dict.
+    """
+    return reproject_footprints([(geometry, crs)], target_epsg=target_epsg)[0]
+
+
+def reproject_footprints(footprints: Iterable[Tuple['BaseGeometry', 'CRS']],
+                         target_epsg: int = GENERIC_EPSG) -> List[dict]:
+    """
+    Reproject many footprints to target_epsg as GeoJSON geometries, with one
+    transformation of the polygon rings of each CRS.
+
+    :param footprints: (geometry, crs) pairs
+    :param target_epsg: EPSG code of the target CRS
+
+    :return: GeoJSON geometry dicts, in the order of the footprints.
+    """
+    import numpy as np
+    from shapely.geometry import Polygon, mapping
+    from shapely.ops import transform
+
+    footprints = list(footprints)
+    geometries = [None] * len(footprints)
+
+    rings_by_crs = {}
+    for i, (geometry, crs) in enumerate(footprints):
+        if isinstance(geometry, Polygon) and not geometry.is_empty:
+            rings_by_crs.setdefault(crs.to_string() or crs.to_wkt(), (crs, []))[1].append(
+                (i, np.asarray(geometry.exterior.coords)[:, :2]))
+        else:
+            transformer = get_transformer(crs, target_epsg)
+            geometries[i] = _to_lists(mapping(transform(transformer.transform, geometry)))
+
+    for crs, rings in rings_by_crs.values():
+        coords = np.concatenate([ring for _, ring in rings])
+        x, y = get_transformer(crs, target_epsg).transform(coords[:, 0], coords[:, 1])
+        reprojected = np.column_stack([x, y]).tolist()
+        start = 0
+        for i, ring in rings:
+            geometries[i] = dict(type='Polygon', coordinates=[reprojected[start:start + len(ring)]])
+            start += len(ring)
+
+    return geometries
+
+
+def _to_lists(value):
+    # GeoJSON coordinates as lists, like the documents read back from JSON
+    if isinstance(value, dict):
+        return {k: _to_lists(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_lists(v) for v in value]
+    return value
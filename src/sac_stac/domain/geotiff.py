@@ -0,0 +1,291 @@
+"""
+Minimal GeoTIFF header reader.
+
+Only the tags needed to describe a COG footprint are decoded: size, pixel type,
+nodata, georeferencing and the overview IFDs. Anything else (GCPs, user defined
+CRSs, rotated tie points...) raises UnsupportedTiffError so callers can fall
+back to GDAL.
+"""
+import struct
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+HEADER_SIZE = 16384
+# IFDs followed from the first one, well above the overviews and masks of a COG
+MAX_IFDS = 64
+
+# TIFF tags
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+
+# GeoKeys
+GT_MODEL_TYPE = 1024
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+
+MODEL_TYPE_PROJECTED = 1
+MODEL_TYPE_GEOGRAPHIC = 2
+RASTER_PIXEL_IS_POINT = 2
+USER_DEFINED = 32767
+
+# Field type: (struct format, size in bytes)
+FIELD_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+
+# (SampleFormat, BitsPerSample): dtype
+DTYPES = {
+    (1, 8): 'uint8', (2, 8): 'int8', (1, 16): 'uint16', (2, 16): 'int16', (1, 32): 'uint32', (2, 32): 'int32',
+    (1, 64): 'uint64', (2, 64): 'int64', (3, 32): 'float32', (3, 64): 'float64',
+}
+
+
+class UnsupportedTiffError(ValueError):
+    pass
+
+
+class TruncatedHeaderError(ValueError):
+    """The header continues past the bytes read so far."""
+
+    def __init__(self, required_size: int):
+        super().__init__(f"GeoTIFF header needs {required_size} bytes")
+        self.required_size = required_size
+
+
+class GeoTiffHeader(NamedTuple):
+    bounds: tuple
+    epsg: int
+    shape: list
+    transform: list
+    dtype: str
+    nodata: Optional[float]
+    overviews: list
+
+
+class _Reader:
+    """Decodes TIFF structures straight out of a memoryview."""
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        if len(self.buffer) < 16:
+            raise TruncatedHeaderError(16)
+
+        byte_order = bytes(self.buffer[:2])
+        if byte_order == b'II':
+            self.endian = '<'
+        elif byte_order == b'MM':
+            self.endian = '>'
+        else:
+            raise UnsupportedTiffError('Not a TIFF file')
+
+        version = self.unpack('H', 2)[0]
+        if version == 42:
+            self.bigtiff = False
+            self.first_ifd = self.unpack('I', 4)[0]
+        elif version == 43:
+            self.bigtiff = True
+            self.first_ifd = self.unpack('Q', 8)[0]
+        else:
+            raise UnsupportedTiffError(f'Unknown TIFF version {version}')
+
+    def unpack(self, fmt: str, offset: int, count: int = 1) -> tuple:
+        fmt = f"{self.endian}{count * fmt}"
+        end = offset + struct.calcsize(fmt)
+        if end > len(self.buffer):
+            raise TruncatedHeaderError(end)
+        return struct.unpack_from(fmt, self.buffer, offset)
+
+    def read_ifd(self, offset: int) -> Tuple[Dict[int, tuple], int]:
+        """Return the entries of the IFD at offset, as tag: (type, count, value offset), and the next IFD offset."""
+        if self.bigtiff:
+            count_fmt, entry_size, value_size, next_fmt = 'Q', 20, 8, 'Q'
+        else:
+            count_fmt, entry_size, value_size, next_fmt = 'H', 12, 4, 'I'
+
+        count_size = struct.calcsize(count_fmt)
+        entry_count = self.unpack(count_fmt, offset)[0]
+        entries = {}
+        for i in range(entry_count):
+            entry = offset + count_size + i * entry_size
+            tag, field_type = self.unpack('HH', entry)
+            value_count = self.unpack(count_fmt if self.bigtiff else 'I', entry + 4)[0]
+            if field_type not in FIELD_TYPES:
+                continue
+            value_offset = entry + 4 + (8 if self.bigtiff else 4)
+            if value_count * FIELD_TYPES[field_type][1] > value_size:
+                value_offset = self.unpack('Q' if self.bigtiff else 'I', value_offset)[0]
+            entries[tag] = (field_type, value_count, value_offset)
+
+        next_ifd = self.unpack(next_fmt, offset + count_size + entry_count * entry_size)[0]
+        return entries, next_ifd
+
+    def values(self, entries: Dict[int, tuple], tag: int, default=None):
+        if tag not in entries:
+            return default
+        field_type, count, offset = entries[tag]
+        fmt, size = FIELD_TYPES[field_type]
+        if field_type == 2:
+            end = offset + count
+            if end > len(self.buffer):
+                raise TruncatedHeaderError(end)
+            return bytes(self.buffer[offset:end]).split(b'\0')[0].decode('ascii')
+        if field_type in (5, 10):
+            pairs = self.unpack(fmt[0], offset, count * 2)
+            return tuple(n / d if d else 0.0 for n, d in zip(pairs[::2], pairs[1::2]))
+        return self.unpack(fmt, offset, count)
+
+
+def parse_geotiff_header(buffer) -> GeoTiffHeader:
+    """
+    Parse the georeferencing of a GeoTIFF from the first bytes of the file.
+
+    :param buffer: bytes-like object holding the start of the file, it is not copied
+
+    :raises TruncatedHeaderError: when the header continues past the buffer
+    :raises UnsupportedTiffError: when the file cannot be described without GDAL, or its header is malformed
+
+    :return: GeoTiffHeader with the same values rasterio reports.
+    """
+    reader = _Reader(buffer)
+    try:
+        return _parse_header(reader)
+    except (TypeError, IndexError, ArithmeticError, struct.error) as e:
+        # Missing tags, or values of the wrong type or count
+        raise UnsupportedTiffError(f'Malformed header: {e!r}') from e
+
+
+def _parse_header(reader: _Reader) -> GeoTiffHeader:
+    entries, next_ifd = reader.read_ifd(reader.first_ifd)
+
+    width = reader.values(entries, IMAGE_WIDTH)[0]
+    height = reader.values(entries, IMAGE_LENGTH)[0]
+    bits = reader.values(entries, BITS_PER_SAMPLE, (1,))[0]
+    sample_format = reader.values(entries, SAMPLE_FORMAT, (1,))[0]
+    dtype = DTYPES.get((sample_format, bits))
+    if not dtype:
+        raise UnsupportedTiffError(f'Unsupported pixel type {sample_format}/{bits}')
+
+    nodata = reader.values(entries, GDAL_NODATA)
+    nodata = float(nodata) if nodata else None
+
+    geo_keys = _read_geo_keys(reader, entries)
+    epsg = _get_epsg(geo_keys)
+    transform = _get_transform(reader, entries, geo_keys.get(GT_RASTER_TYPE) == RASTER_PIXEL_IS_POINT)
+    overviews = _get_overviews(reader, next_ifd, width, visited={reader.first_ifd})
+
+    return GeoTiffHeader(
+        bounds=_get_bounds(transform, width, height),
+        epsg=epsg,
+        shape=[height, width],
+        transform=transform,
+        dtype=dtype,
+        nodata=nodata,
+        overviews=overviews
+    )
+
+
+def read_geotiff_header(read_range: Callable[[int, int], bytes], header_size: int = HEADER_SIZE,
+                        max_header_size: int = 1024 * 1024) -> GeoTiffHeader:
+    """
+    Read and parse a GeoTIFF header with range requests. A single request
+    is enough for COGs, whose IFDs are packed at the start of the file;
+    otherwise the range read is grown until the header fits.
+
+    :param read_range: function returning the bytes between two inclusive offsets
+    :param header_size: bytes read by the first request
+    :param max_header_size: largest header read before giving up
+    """
+    size = header_size
+    while True:
+        buffer = read_range(0, size - 1)
+        try:
+            return parse_geotiff_header(buffer)
+        except TruncatedHeaderError as e:
+            if len(buffer) < size:
+                raise UnsupportedTiffError('File shorter than its header')
+            if e.required_size > max_header_size:
+                raise UnsupportedTiffError(f'Header larger than {max_header_size} bytes')
+            # The IFDs that follow are usually close by, read past the one that was cut
+            size = min(max(e.required_size, 2 * size) + header_size, max_header_size)
+
+
+def _read_geo_keys(reader: _Reader, entries: dict) -> Dict[int, int]:
+    directory = reader.values(entries, GEO_KEY_DIRECTORY)
+    if not directory:
+        raise UnsupportedTiffError('No GeoKeyDirectory')
+
+    geo_keys = {}
+    for i in range(directory[3]):
+        key_id, location, count, value = directory[4 + i * 4:8 + i * 4]
+        # Only SHORT keys stored inline are needed
+        if location == 0 and count == 1:
+            geo_keys[key_id] = value
+    return geo_keys
+
+
+def _get_epsg(geo_keys: Dict[int, int]) -> int:
+    model_type = geo_keys.get(GT_MODEL_TYPE)
+    if model_type == MODEL_TYPE_PROJECTED:
+        epsg = geo_keys.get(PROJECTED_CS_TYPE)
+    elif model_type == MODEL_TYPE_GEOGRAPHIC:
+        epsg = geo_keys.get(GEOGRAPHIC_TYPE)
+    else:
+        raise UnsupportedTiffError(f'Unsupported model type {model_type}')
+
+    if not epsg or epsg == USER_DEFINED:
+        raise UnsupportedTiffError('User defined CRS')
+    return epsg
+
+
+def _get_transform(reader: _Reader, entries: dict, pixel_is_point: bool) -> List[float]:
+    matrix = reader.values(entries, MODEL_TRANSFORMATION)
+    if matrix:
+        a, b, c, d, e, f = matrix[0], matrix[1], matrix[3], matrix[4], matrix[5], matrix[7]
+    else:
+        scale = reader.values(entries, MODEL_PIXEL_SCALE)
+        tiepoint = reader.values(entries, MODEL_TIEPOINT)
+        if not scale or not tiepoint or len(tiepoint) != 6:
+            raise UnsupportedTiffError('No affine georeferencing')
+        i, j, _, x, y, _ = tiepoint
+        a, b, d, e = scale[0], 0.0, 0.0, -scale[1]
+        c, f = x - i * a, y - j * e
+
+    # GDAL moves point referenced rasters to the pixel corner
+    if pixel_is_point:
+        c -= 0.5 * a + 0.5 * b
+        f -= 0.5 * d + 0.5 * e
+    return [a, b, c, d, e, f, 0.0, 0.0, 1.0]
+
+
+def _get_bounds(transform: List[float], width: int, height: int) -> tuple:
+    a, b, c, d, e, f = transform[:6]
+    if b == d == 0:
+        return c, f + e * height, c + a * width, f
+    xs = [c, c + a * width, c + b * height, c + a * width + b * height]
+    ys = [f, f + d * width, f + e * height, f + d * width + e * height]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _get_overviews(reader: _Reader, offset: int, width: int, visited: set) -> List[int]:
+    overviews = []
+    while offset:
+        if offset in visited:
+            raise UnsupportedTiffError(f'IFD chain loops back to {offset}')
+        if len(visited) >= MAX_IFDS:
+            raise UnsupportedTiffError(f'More than {MAX_IFDS} IFDs')
+        visited.add(offset)
+        entries, offset = reader.read_ifd(offset)
+        subfile_type = reader.values(entries, NEW_SUBFILE_TYPE, (0,))[0]
+        # Reduced resolution images that are not masks
+        if subfile_type & 1 and not subfile_type & 4:
+            overviews.append(int(round(width / reader.values(entries, IMAGE_WIDTH)[0])))
+    return overviews
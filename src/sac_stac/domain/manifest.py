@@ -0,0 +1,71 @@
+import hashlib
+from typing import Dict, List, Optional, Pattern, Sequence
+
+from sac_stac.domain.s3 import ObjectRecord, NoObjectError
+
+PRODUCT_SUFFIX = '.tif'
+
+
+class AcquisitionManifest:
+    """
+    Objects stored under an acquisition prefix, taken from a single listing.
+    """
+
+    def __init__(self, prefix: str, records: List[ObjectRecord]):
+        self.prefix = prefix
+        self.records = records
+        self.products = [r for r in records if r.key.endswith(PRODUCT_SUFFIX)]
+        self._by_key: Dict[str, ObjectRecord] = {r.key: r for r in records}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._by_key
+
+    def get(self, key: str) -> Optional[ObjectRecord]:
+        return self._by_key.get(key)
+
+    @property
+    def product_keys(self) -> List[str]:
+        return [p.key for p in self.products]
+
+    def smallest_product_key(self) -> str:
+        """
+        Return the smallest non-empty product, the cheapest one to open.
+
+        :raises NoObjectError: when the acquisition holds no products
+        """
+        product_sizes = {p.size: p.key for p in self.products if p.size > 1}
+        if not product_sizes:
+            raise NoObjectError(f'Nothing found with {self.prefix}*{PRODUCT_SUFFIX}')
+        return product_sizes.get(min(product_sizes.keys()))
+
+    def assign_bands(self, band_pattern: Pattern, band_names: Sequence[str]) -> Dict[str, str]:
+        """
+        Return the first product matching each band, with one match per product key.
+
+        :param band_pattern: pattern built by compile_band_pattern from the band names
+        :param band_names: band name regular expressions, in the order of the pattern
+
+        :return: product key by band name, for the bands matched by some product.
+        """
+        assigned = {}
+        for key in self.product_keys:
+            for group, matched in band_pattern.match(key).groupdict().items():
+                if matched is not None:
+                    assigned.setdefault(band_names[int(group[len('band'):])], key)
+            if len(assigned) == len(band_names):
+                break
+        return assigned
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of the product keys, sizes and ETags, it changes whenever a product does."""
+        digest = hashlib.sha1()
+        for p in sorted(self.products):
+            digest.update(f"{p.key}\0{p.size}\0{p.etag}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def has_changed(self, fingerprint: str) -> bool:
+        return fingerprint != self.fingerprint
@@ -1,8 +1,60 @@
-from pystac import Collection, Item, Provider, STAC_EXTENSIONS
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pystac import Collection, Extent, Item, Provider, SpatialExtent, TemporalExtent, STAC_EXTENSIONS
 
 from sac_stac.domain.extensions import register_product_definition_extension, register_odc_extension
 
 
+EMPTY_BBOX = [0, 0, 0, 0]
+
+
+def compute_extent(bboxes: List[list], datetimes: List[Optional[datetime]]) -> Optional[Extent]:
+    """
+    Return the extent covering all the given bboxes and datetimes.
+    The bboxes are reduced with a single vectorised min/max.
+
+    :param bboxes: [xmin, ymin, xmax, ymax] lists, None values are ignored
+    :param datetimes: datetimes, naive ones are taken as UTC and None values are ignored
+
+    :return: Extent or None when there is nothing to cover.
+    """
+    bboxes = [b for b in bboxes if b]
+    datetimes = [d if d.tzinfo else d.replace(tzinfo=timezone.utc) for d in datetimes if d]
+    if not bboxes and not datetimes:
+        return None
+
+    if bboxes:
+        import numpy as np
+
+        bounds = np.asarray(bboxes, dtype=float)
+        bbox = [*bounds[:, :2].min(axis=0).tolist(), *bounds[:, 2:].max(axis=0).tolist()]
+    else:
+        bbox = EMPTY_BBOX
+
+    interval = [min(datetimes), max(datetimes)] if datetimes else [None, None]
+    return Extent(SpatialExtent([bbox]), TemporalExtent([interval]))
+
+
+def extend_extent(collection: Collection, items: List[Item]):
+    """
+    Union the bbox and datetime of the given items into the collection extent
+    without resolving the items already linked to the collection.
+    """
+    bboxes = [item.bbox for item in items]
+    datetimes = [item.datetime for item in items]
+
+    # The placeholder extent of a new collection covers nothing
+    current_bbox = collection.extent.spatial.bboxes[0]
+    if current_bbox and list(current_bbox) != EMPTY_BBOX:
+        bboxes.append(current_bbox)
+    datetimes.extend(collection.extent.temporal.intervals[0])
+
+    extent = compute_extent(bboxes, datetimes)
+    if extent:
+        collection.extent = extent
+
+
 class SacCollection(Collection):
     def add_providers(self, collection_config: dict):
         providers = []
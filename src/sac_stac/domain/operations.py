@@ -3,30 +3,33 @@ import os
 import re
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional, Pattern, Tuple, Union
 from sac_stac.adapters.repository import S3Repository
-import rasterio
-from rasterio import RasterioIOError
-from rasterio.crs import CRS
-from shapely.geometry import box, Polygon
+from botocore.exceptions import ClientError
 
-from sac_stac.load_config import LOG_LEVEL, LOG_FORMAT
-from sac_stac.load_config import get_s3_configuration
+from sac_stac.domain.gdal import get_cog_path, get_gdal_env
+from sac_stac.domain.geotiff import read_geotiff_header
+from sac_stac.domain.probe_cache import ProbeCache, get_probe_cache
+from sac_stac.domain.s3 import NoObjectError
+from sac_stac.load_config import get_probe_configuration, get_s3_configuration
 
 from sac_stac.util import extract_common_prefix, parse_s3_url
-S3_BUCKET = get_s3_configuration()["bucket"]
 
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+if TYPE_CHECKING:
+    from rasterio.crs import CRS
+    from shapely.geometry import Polygon
+
+S3_BUCKET = get_s3_configuration()["bucket"]
 
 logger = logging.getLogger(__name__)
 
 
-def obtain_date_from_filename(file: str, regex: str, date_format: str) -> datetime:
+def obtain_date_from_filename(file: str, regex: Union[str, Pattern], date_format: str) -> datetime:
     """
     Return date from given file based on regular expression and date format.
 
     :param file: path to file
-    :param regex: regular expression to search in filename
+    :param regex: regular expression to search in filename, or its compiled pattern
     :param date_format: format used when converting to datetime
 
     :return: datetime object with obtained date.
@@ -41,36 +44,151 @@ def obtain_date_from_filename(file: str, regex: str, date_format: str) -> dateti
     return date
 
 
-def get_geometry_from_cog(cog_url: str = None, cog_key:str = None, s3_repository:S3Repository = None) -> Tuple[Polygon, CRS]:
+class CogProbe(NamedTuple):
+    """Raster metadata read from a COG header."""
+    bounds: tuple
+    crs: 'CRS'
+    shape: list
+    transform: list
+    dtype: str
+    nodata: Optional[float]
+    overviews: list
+
+
+def probe_cog(cog_url: str = None, cog_key: str = None, s3_repository: S3Repository = None,
+              cache: Dict[str, CogProbe] = None, etag: str = None,
+              probe_cache: ProbeCache = None) -> Optional[CogProbe]:
     """
-    Extract geometry information out of the COG file served under
-    the given url.
+    Read the metadata of the COG file served under the given url or key
+    with a single open.
 
     :param cog_url: url to cog file
+    :param cog_key: key of the cog file in the S3 bucket, signed with the repository
+    :param s3_repository: repository used to sign cog_key
+    :param cache: probes already read, keyed by url or key, for the lifetime of an item build
+    :param etag: ETag of cog_key, probes of keys with an ETag are kept in the persistent cache
+    :param probe_cache: persistent cache, defaults to the one set up with STAC_PROBE_CACHE_PATH
 
-    :return: A Polygon and CRS objects.
+    :return: A CogProbe object or None when the file cannot be opened.
+    """
+    cache_key = cog_key or cog_url
+    if cache is not None and cache_key in cache:
+        return cache[cache_key]
+
+    probe_cache = probe_cache or (get_probe_cache() if cog_key and etag else None)
+    probe = None
+    if probe_cache and cog_key and etag:
+        stored = probe_cache.get(bucket=S3_BUCKET, key=cog_key, etag=etag)
+        probe = CogProbe(**stored) if stored else None
+
+    if not probe:
+        probe = read_cog(cog_url=cog_url, cog_key=cog_key, s3_repository=s3_repository)
+        if probe and probe_cache and cog_key and etag:
+            probe_cache.put(bucket=S3_BUCKET, key=cog_key, etag=etag, probe=probe)
+
+    if probe and cache is not None:
+        cache[cache_key] = probe
+    return probe
+
+
+def read_cog(cog_url: str = None, cog_key: str = None, s3_repository: S3Repository = None) -> Optional[CogProbe]:
+    """
+    Read the metadata of a COG from its header, or with GDAL when
+    the header cannot be parsed.
+
+    :return: A CogProbe object or None when the file cannot be opened.
     """
     if os.environ.get("TEST_ENV"):
-        bucket, key = parse_s3_url(cog_url)
-        cog_url = f"tests/data/{key}"
+        key = cog_key or parse_s3_url(cog_url)[1]
+        cog_url, cog_key = f"tests/data/{key}", None
+
+    probe = None
+    if cog_key and get_probe_configuration()["header_parser"]:
+        probe = probe_cog_header(cog_key=cog_key, s3_repository=s3_repository)
+    if not probe:
+        probe = probe_cog_gdal(cog_url=cog_url, cog_key=cog_key, s3_repository=s3_repository)
+    return probe
+
+
+def probe_cog_header(cog_key: str, s3_repository: S3Repository) -> Optional[CogProbe]:
+    """
+    Read the metadata of a COG by parsing its header from one or two
+    ranged requests, without GDAL.
+
+    :return: A CogProbe object or None when the header is not supported.
+    """
+    from rasterio.crs import CRS
+
+    try:
+        header = read_geotiff_header(
+            read_range=lambda start, end: s3_repository.get_product_range(
+                bucket=S3_BUCKET, product_key=cog_key, start=start, end=end),
+            header_size=get_probe_configuration()["header_size"]
+        )
+        return CogProbe(
+            bounds=header.bounds,
+            crs=CRS.from_epsg(header.epsg),
+            shape=header.shape,
+            transform=header.transform,
+            dtype=header.dtype,
+            nodata=header.nodata,
+            overviews=header.overviews
+        )
+    except (ValueError, NoObjectError, ClientError) as e:
+        logger.debug(f"Could not parse the header of {cog_key}, falling back to GDAL: {e}")
+        return None
+
+
+def probe_cog_gdal(cog_url: str = None, cog_key: str = None, s3_repository: S3Repository = None) -> Optional[CogProbe]:
+    """
+    Read the metadata of a COG by opening it with GDAL.
+
+    :return: A CogProbe object or None when the file cannot be opened.
+    """
+    import rasterio
+    from rasterio import RasterioIOError
+
     try:
-        if not cog_key:
-            with rasterio.open(cog_url) as ds:
-                geom = box(*ds.bounds)
-                crs = ds.crs
-            return geom, crs
-        else:
-            new_cog_url = s3_repository.sign_file(bucket=S3_BUCKET,key=cog_key)
-            with rasterio.open(new_cog_url) as ds:
-                geom = box(*ds.bounds)
-                crs = ds.crs
-            return geom, crs
+        if cog_key:
+            cog_url = get_cog_path(bucket=S3_BUCKET, key=cog_key, s3_repository=s3_repository)
+        with get_gdal_env(), rasterio.open(cog_url) as ds:
+            probe = CogProbe(
+                bounds=tuple(ds.bounds),
+                crs=ds.crs,
+                shape=list(ds.shape),
+                transform=list(ds.transform),
+                dtype=ds.dtypes[0],
+                nodata=ds.nodata,
+                overviews=ds.overviews(1)
+            )
     except RasterioIOError as e:
-        logger.warning(f"Error extracting geometry from {cog_url}: {e}")
+        logger.warning(f"Error reading {cog_key or cog_url}: {e}")
+        return None
+
+    return probe
+
+
+def get_geometry_from_cog(cog_url: str = None, cog_key: str = None, s3_repository: S3Repository = None,
+                          cache: Dict[str, CogProbe] = None, etag: str = None) -> Tuple['Polygon', 'CRS']:
+    """
+    Extract geometry information out of the COG file served under
+    the given url.
+
+    :param cog_url: url to cog file
+
+    :return: A Polygon and CRS objects.
+    """
+    from rasterio.crs import CRS
+    from shapely.geometry import box, Polygon
+
+    probe = probe_cog(cog_url=cog_url, cog_key=cog_key, s3_repository=s3_repository, cache=cache, etag=etag)
+    if not probe:
         return Polygon(), CRS()
+    return box(*probe.bounds), probe.crs
 
 
-def get_projection_from_cog(cog_url: str = None, cog_key:str = None, s3_repository:S3Repository = None) -> Tuple[list, list]:
+def get_projection_from_cog(cog_url: str = None, cog_key: str = None, s3_repository: S3Repository = None,
+                            cache: Dict[str, CogProbe] = None, etag: str = None) -> Tuple[list, list]:
     """
     Extract projection information out of the COG file served under
     the given url.
@@ -79,17 +197,7 @@ def get_projection_from_cog(cog_url: str = None, cog_key:str = None, s3_reposito
 
     :return: A shape and transform lists.
     """
-    if os.environ.get("TEST_ENV"):
-        bucket, key = parse_s3_url(cog_url)
-        cog_url = f"tests/data/{key}"
-    try:
-        if not cog_key:
-            with rasterio.open(cog_url) as ds:
-                return list(ds.shape), list(ds.transform)
-        else:
-            new_cog_url = s3_repository.sign_file(bucket=S3_BUCKET,key=cog_key)
-            with rasterio.open(new_cog_url) as ds:
-                return list(ds.shape), list(ds.transform)
-    except RasterioIOError as e:
-        logger.warning(f"Error extracting projection from {cog_url}: {e}")
+    probe = probe_cog(cog_url=cog_url, cog_key=cog_key, s3_repository=s3_repository, cache=cache, etag=etag)
+    if not probe:
         return [], []
+    return list(probe.shape), list(probe.transform)
@@ -0,0 +1,115 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from sac_stac.load_config import get_probe_cache_configuration
+
+logger = logging.getLogger(__name__)
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+class ProbeCache:
+    """
+    On-disk cache of COG probes keyed by bucket, key and ETag, so a raster
+    is only read again once its object changes.
+
+    Entries are evicted least recently used first once the stored probes
+    take more than `max_size` bytes.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        """
+        :param path: SQLite database file, shared by every process using the cache
+        :param max_size: bytes of probes kept before evicting
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS probes ('
+            'bucket TEXT, key TEXT, etag TEXT, probe TEXT, size INTEGER, accessed REAL, '
+            'PRIMARY KEY (bucket, key))'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS probes_accessed ON probes (accessed)')
+
+    def get(self, bucket: str, key: str, etag: str) -> Optional[dict]:
+        """Return the fields of the probe stored for this version of the object or None."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT probe FROM probes WHERE bucket = ? AND key = ? AND etag = ?', (bucket, key, etag)
+            ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                'UPDATE probes SET accessed = ? WHERE bucket = ? AND key = ?', (time.time(), bucket, key)
+            )
+
+        from rasterio.crs import CRS
+
+        probe = json.loads(row[0])
+        probe['bounds'] = tuple(probe['bounds'])
+        probe['crs'] = CRS.from_user_input(probe['crs'])
+        return probe
+
+    def put(self, bucket: str, key: str, etag: str, probe: NamedTuple):
+        """Store the probe of this version of the object, replacing older versions."""
+        probe_json = json.dumps(dict(probe._asdict(), crs=probe.crs.to_string()))
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)',
+                (bucket, key, etag, probe_json, len(probe_json), time.time())
+            )
+            self._evict()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM probes').fetchone()[0]
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _evict(self):
+        size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM probes').fetchone()[0]
+        if size <= self.max_size:
+            return
+        # Make some room so the next puts do not evict again
+        target = size - int(self.max_size * 0.9)
+        rows = self._connection.execute('SELECT rowid, size FROM probes ORDER BY accessed').fetchall()
+        evicted = []
+        for rowid, row_size in rows:
+            if target <= 0:
+                break
+            evicted.append((rowid,))
+            target -= row_size
+        self._connection.executemany('DELETE FROM probes WHERE rowid = ?', evicted)
+        self.evictions += len(evicted)
+        logger.debug(f"Evicted {len(evicted)} probes from {self.path}")
+
+
+def get_probe_cache() -> Optional[ProbeCache]:
+    """Return the process wide probe cache, or None when STAC_PROBE_CACHE_PATH is not set."""
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            cache_config = get_probe_cache_configuration()
+            if not cache_config["path"]:
+                return None
+            _probe_cache = ProbeCache(path=cache_config["path"], max_size=cache_config["max_size"])
+        return _probe_cache
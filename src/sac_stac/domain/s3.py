@@ -1,13 +1,27 @@
 import logging
+import os
+import threading
+from datetime import datetime
+from typing import Iterator, List, NamedTuple
 
-import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from sac_stac.load_config import LOG_LEVEL, LOG_FORMAT
 
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+from sac_stac.load_config import get_s3_client_configuration
 
 logger = logging.getLogger(__name__)
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class ObjectRecord(NamedTuple):
+    """Object metadata as returned in a listing page."""
+    key: str
+    size: int
+    etag: str
+    last_modified: datetime = None
+
 
 class S3:
     """Class to handle S3 operations."""
@@ -21,16 +35,68 @@ class S3:
             s3_endpoint   (str): S3 endpoint URL
             region_name   (str): Region Name
         """
-        self.s3_resource = boto3.resource(
-            "s3",
-            endpoint_url=s3_endpoint,
-            aws_access_key_id=key,
-            aws_secret_access_key=secret,
-            region_name=region_name,
-        )
+        self._credentials = dict(key=key, secret=secret, s3_endpoint=s3_endpoint, region_name=region_name)
+        self.client = get_s3_client(**self._credentials)
+        self.conditional_writes = supports_conditional_writes(self.client)
+        self._local = threading.local()
         self.buckets_exist = []
 
-    def list_objects(self, bucket_name, *, prefix=None, suffix=None, limit=None):
+    @property
+    def s3_resource(self):
+        """
+        Resource API on the same credentials. Resources are not thread-safe,
+        each thread gets its own.
+        """
+        resource = getattr(self._local, 's3_resource', None)
+        if resource is None:
+            import boto3
+
+            resource = self._local.s3_resource = boto3.session.Session().resource(
+                "s3",
+                endpoint_url=self._credentials["s3_endpoint"] or None,
+                aws_access_key_id=self._credentials["key"],
+                aws_secret_access_key=self._credentials["secret"],
+                region_name=self._credentials["region_name"],
+            )
+        return resource
+
+    def iter_objects(self, bucket_name, *, prefix=None, suffix=None, limit=None,
+                     page_size=None) -> Iterator[ObjectRecord]:
+        """
+        Stream the objects stored in a bucket, one listing page at a time.
+        Params:
+            bucket_name      (str): Bucket name
+        Keyword arguments (opt):
+            prefix           (str): Filter only objects with specific prefix
+                                    default None
+            suffix           (str): Filter only objects with specific suffix
+                                    default None
+            limit            (int): Stop once this number of objects is yielded,
+                                    without requesting the next pages
+                                    default None
+            page_size        (int): Keys requested per listing page
+                                    default None, 1000 for S3
+        Returns:
+            An iterator of ObjectRecord, with the metadata carried by the listing pages
+        """
+        if limit is not None and limit <= 0:
+            return
+        pagination = dict(PageSize=page_size) if page_size else {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix or '', PaginationConfig=pagination)
+
+        count = 0
+        for page in pages:
+            for item in page.get('Contents', []):
+                if suffix and not item['Key'].endswith(suffix):
+                    continue
+                yield ObjectRecord(key=item['Key'], size=item['Size'], etag=item['ETag'].strip('"'),
+                                   last_modified=item.get('LastModified'))
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def list_objects(self, bucket_name, *, prefix=None, suffix=None, limit=None) -> List[ObjectRecord]:
         """
         List objects stored in a bucket.
         Params:
@@ -43,20 +109,26 @@ class S3:
             limit            (int): Limit the number of objects returned
                                     default None
         Returns:
-            An iterable of ObjectSummary resources
+            A list of ObjectRecord
         """
-        paginator = self.s3_resource.meta.client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
-        
-        objects = [self.s3_resource.ObjectSummary(bucket_name, item['Key']) for page in pages for item in page['Contents']]
+        objects = list(self.iter_objects(bucket_name, prefix=prefix, suffix=suffix, limit=limit))
 
         if not objects:
             raise NoObjectError(f'Nothing found with {prefix}*{suffix} in {bucket_name} bucket')
+        return objects
 
-        if suffix:
-            return [obj for obj in objects if obj.key.endswith(suffix)]
-        else:
-            return objects
+    def list_object_records(self, bucket_name, *, prefix=None) -> List[ObjectRecord]:
+        """
+        List objects stored in a bucket with the metadata carried by the listing pages.
+        Params:
+            bucket_name      (str): Bucket name
+        Keyword arguments (opt):
+            prefix           (str): Filter only objects with specific prefix
+                                    default None
+        Returns:
+            A list of ObjectRecord
+        """
+        return list(self.iter_objects(bucket_name, prefix=prefix))
 
     def get_object_body(self, bucket_name, object_name):
         """
@@ -66,20 +138,94 @@ class S3:
             object_name            (str): Object name
         """
         try:
-            obj = self.s3_resource.Object(bucket_name=bucket_name, key=object_name).get()
+            obj = self.client.get_object(Bucket=bucket_name, Key=object_name)
+            return obj.get('Body').read()
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'NoSuchKey':
+                raise NoObjectError(f'Nothing found with {object_name} in {bucket_name} bucket')
+
+    def get_object_range(self, bucket_name, object_name, start, end):
+        """
+        Download a byte range of an object from S3.
+        Params:
+            bucket_name            (str): Bucket name
+            object_name            (str): Object name
+            start                  (int): First byte of the range
+            end                    (int): Last byte of the range, inclusive
+        """
+        try:
+            obj = self.client.get_object(Bucket=bucket_name, Key=object_name,
+                                         Range=f'bytes={start}-{end}')
             return obj.get('Body').read()
         except ClientError as ex:
             if ex.response['Error']['Code'] == 'NoSuchKey':
                 raise NoObjectError(f'Nothing found with {object_name} in {bucket_name} bucket')
+            raise
 
-    def put_object(self, bucket_name, key, body):
+    def get_object_with_etag(self, bucket_name, object_name):
+        """
+        Download an object from S3 and return its body and ETag.
+        Params:
+            bucket_name            (str): Bucket name
+            object_name            (str): Object name
+        """
+        try:
+            obj = self.client.get_object(Bucket=bucket_name, Key=object_name)
+            return obj.get('Body').read(), obj.get('ETag', '').strip('"')
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'NoSuchKey':
+                raise NoObjectError(f'Nothing found with {object_name} in {bucket_name} bucket')
+            raise
+
+    def get_object_etag(self, bucket_name, object_name):
+        """
+        Return the ETag of an object, or None when it does not exist.
+        Params:
+            bucket_name            (str): Bucket name
+            object_name            (str): Object name
+        """
+        try:
+            head = self.client.head_object(Bucket=bucket_name, Key=object_name)
+            return head.get('ETag', '').strip('"')
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def put_object(self, bucket_name, key, body, if_match=None, if_none_match=None):
+        """
+        Upload an object to S3.
+        Params:
+            bucket_name            (str): Bucket name
+            key                    (str): Object name
+            body                   (str): Object body
+            if_match               (str): Only replace the object if its ETag matches
+            if_none_match          (str): '*' to only create the object if it does not exist
+
+        With a botocore release not modelling conditional writes, the conditions
+        are checked against the stored ETag before an unconditional put, and the
+        callers' read back detects the writes racing with it.
+        """
+        conditions = {}
+        if if_match:
+            conditions['IfMatch'] = f'"{if_match}"'
+        if if_none_match:
+            conditions['IfNoneMatch'] = if_none_match
+        if conditions and not self.conditional_writes:
+            check_conditions(key, bucket_name, self.get_object_etag(bucket_name, key), if_match, if_none_match)
+            conditions = {}
         try:
-            response = self.s3_resource.Object(bucket_name=bucket_name, key=key).put(Body=body)
+            response = self.client.put_object(Bucket=bucket_name, Key=key, Body=body, **conditions)
             return response
         except ClientError as ex:
+            if ex.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise PreconditionFailedError(f'{key} in {bucket_name} bucket changed: {ex}')
             logger.warning(f"Could not put {key} in {bucket_name} bucket: {ex}")
             return None
 
+    def delete_object(self, bucket_name, key):
+        self.client.delete_object(Bucket=bucket_name, Key=key)
+
     def list_common_prefixes(self, bucket_name, prefix):
         """
         List all common prefixes with the given prefix delimited by '/'.
@@ -88,7 +234,7 @@ class S3:
             prefix                 (str): Prefix
         """
         common_prefixes = []
-        paginator = self.s3_resource.meta.client.get_paginator('list_objects_v2')
+        paginator = self.client.get_paginator('list_objects_v2')
         pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/')
         for page in pages:
             if page.get('CommonPrefixes'):
@@ -97,14 +243,76 @@ class S3:
 
         return common_prefixes
 
-    def create_presigned_url(self, bucket_name,key:str):
+    def create_presigned_url(self, bucket_name, key: str, expires_in: int = 3600):
         try:
-            response = self.s3_resource.meta.client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=3600)
+            response = self.client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=expires_in)
             return response
         except ClientError as ex:
             logger.warning(f"Could not create presigned URL for {key}: {ex}")
             return None
 
+
+def get_s3_client(key, secret, s3_endpoint, region_name):
+    """
+    Return the low-level S3 client of this process for the given credentials.
+
+    Clients are thread-safe, so one is shared by every worker thread. Its
+    connection pool is sized with STAC_S3_MAX_POOL_CONNECTIONS and throttled
+    requests are retried with the STAC_S3_RETRY_MODE retry mode. A forked
+    process builds its own client instead of sharing the parent's sockets.
+    """
+    cache_key = (os.getpid(), key, secret, s3_endpoint or None, region_name)
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            import boto3
+
+            client_config = get_s3_client_configuration()
+            options = dict(
+                max_pool_connections=client_config["max_pool_connections"],
+                retries=dict(mode=client_config["retry_mode"], max_attempts=client_config["max_attempts"]),
+            )
+            # Not known to the older botocore releases
+            if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+                options['tcp_keepalive'] = client_config["tcp_keepalive"]
+            # Sessions are not thread-safe, each client is built from its own
+            client = _clients[cache_key] = boto3.session.Session().client(
+                "s3",
+                endpoint_url=s3_endpoint or None,
+                aws_access_key_id=key,
+                aws_secret_access_key=secret,
+                region_name=region_name,
+                config=Config(**options),
+            )
+        return client
+
+
+def supports_conditional_writes(client) -> bool:
+    """Return whether the botocore release of the client models If-Match and If-None-Match on PutObject."""
+    members = client.meta.service_model.operation_model('PutObject').input_shape.members
+    return 'IfMatch' in members and 'IfNoneMatch' in members
+
+
+def check_conditions(key, bucket_name, etag, if_match=None, if_none_match=None):
+    """
+    Check the conditions of a put against the ETag of the stored object, None when it does not exist.
+
+    :raises PreconditionFailedError: when the stored object does not match
+    """
+    if if_none_match and etag is not None:
+        raise PreconditionFailedError(f'{key} already exists in {bucket_name} bucket')
+    if if_match and etag != if_match:
+        raise PreconditionFailedError(f'{key} in {bucket_name} bucket changed')
+
+
 class NoObjectError(Exception):
     pass
 
+
+class PreconditionFailedError(Exception):
+    pass
+
+
+class WriteFailedError(Exception):
+    pass
+
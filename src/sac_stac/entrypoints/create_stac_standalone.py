@@ -1,4 +1,7 @@
+import argparse
+import json
 import logging
+import signal
 
 # So that we can run as a standalone script
 import sys
@@ -6,16 +9,17 @@ sys.path.append('../../')
 
 from sac_stac.adapters import repository
 from sac_stac.domain.s3 import S3
-from sac_stac.service_layer.services import add_stac_collection
-from sac_stac.load_config import LOG_LEVEL, LOG_FORMAT, get_s3_configuration
-from sac_stac.domain.model import SacCollection
+from sac_stac.service_layer.backfill import backfill
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.journal import BackfillJournal
+from sac_stac.service_layer.planner import plan_run
+from sac_stac.service_layer.services import add_stac_collection, replay_collection_commits
+from sac_stac.service_layer.sync import sync
+from sac_stac.load_config import LOG_LEVEL, LOG_FORMAT, get_backfill_configuration, get_s3_configuration
 
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-import boto3
-
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 s3_config = get_s3_configuration()
@@ -29,46 +33,78 @@ S3_STAC_PATH = s3_config["stac_path"]
 S3_IMAGERY_PATH = s3_config["imagery_path"]
 S3_HREF = f"{S3_ENDPOINT}/{S3_BUCKET}"
 
-s3 = S3(key=S3_ACCESS_KEY_ID, secret=S3_SECRET_ACCESS_KEY,
-        s3_endpoint=S3_ENDPOINT, region_name=S3_REGION)
+s3_credentials = dict(key=S3_ACCESS_KEY_ID, secret=S3_SECRET_ACCESS_KEY,
+                      s3_endpoint=S3_ENDPOINT, region_name=S3_REGION)
+s3 = S3(**s3_credentials)
 repo = repository.S3Repository(s3)
 
-# Allows for extra functionality - list_objects_v2
-s3_resource = boto3.resource(
-    "s3",
-    endpoint_url=S3_ENDPOINT,
-    region_name=S3_REGION,
-    aws_access_key_id=S3_ACCESS_KEY_ID,
-    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-)
-
-
-def main():
-    # Lists all platforms in the S3 'Directory'
-    platforms = s3_resource.meta.client.list_objects_v2(Bucket=S3_BUCKET, Prefix=S3_IMAGERY_PATH, Delimiter='/')
-    
-    # Loops through each platform
-    for platform in platforms.get('CommonPrefixes', []):
-        try:
-            sensor_name = platform['Prefix'].split('/')[-2]
-            add_stac_collection(repo=repo, sensor_key=platform['Prefix'], update_collection_on_item=False)
-
-            # Update Collection
-            collection_key = f"{S3_STAC_PATH}/{sensor_name}/collection.json"
-            collection_dict = repo.get_dict(bucket=S3_BUCKET, key=collection_key)
-            collection = SacCollection.from_dict(collection_dict)
-            collection.update_extent_from_items()
-            collection.normalize_hrefs(f"{S3_HREF}/{S3_STAC_PATH}/{collection.id}")
-            
-            repo.add_json_from_dict(
-                bucket=S3_BUCKET,
-                key=collection_key,
-                stac_dict=collection.to_dict()
-            )
-
-        except Exception as e:
-            logger.error(f"Error adding collection for {platform['Prefix']} :: {e}")
+
+def terminate(signum, frame):
+    # Unwind through the services so buffered collection updates are flushed
+    raise SystemExit(128 + signum)
+
+
+def parse_args(args=None):
+    backfill_config = get_backfill_configuration()
+    parser = argparse.ArgumentParser(description="Create the STAC catalog of the imagery stored in S3.")
+    parser.add_argument("command", nargs="?", choices=["backfill", "sync"], default="backfill",
+                        help="backfill: add every acquisition missing from the catalog, "
+                             "sync: add and rebuild only the acquisitions changed since the last sync")
+    parser.add_argument("--prune", action="store_true",
+                        help="sync: also remove the items of the acquisitions deleted since the last sync")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only list the imagery and the catalog, and print the load the run would generate")
+    parser.add_argument("--processes", type=int, default=backfill_config["processes"],
+                        help="processes building the items, more than 1 shards the acquisitions across them")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="shards the acquisitions are split into, defaults to STAC_BACKFILL_SHARDS")
+    parser.add_argument("--journal", default=backfill_config["journal_path"],
+                        help="local journal of the finished work, defaults to STAC_BACKFILL_JOURNAL")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the work the journal records as finished and write its pending collection links")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    signal.signal(signal.SIGTERM, terminate)
+
+    if args.dry_run:
+        print(json.dumps(plan_run(repo=repo, command=args.command, prune=args.prune), indent=2))
+        return
+
+    if args.command == "sync":
+        sync(repo=repo, prune=args.prune)
+        return
+
+    journal = BackfillJournal(args.journal, resume=args.resume,
+                              fsync_interval=get_backfill_configuration()["journal_fsync_interval"])
+    try:
+        if args.resume:
+            # Link the items written by the previous run before its collection writes
+            with CollectionBuffer(repo, bucket=S3_BUCKET, on_flush=journal.collection_committed) as buffer:
+                replay_collection_commits(repo, journal, collection_buffer=buffer)
+
+        # Lists all platforms in the S3 'Directory'
+        platforms = s3.list_common_prefixes(bucket_name=S3_BUCKET, prefix=S3_IMAGERY_PATH)
+
+        if args.processes > 1:
+            backfill(repo=repo, s3_credentials=s3_credentials, sensor_keys=platforms,
+                     processes=args.processes, shards=args.shards, journal=journal)
+            return
+
+        # Loops through each platform
+        for platform in platforms:
+            try:
+                # The collection extent is extended as the buffered items are flushed
+                add_stac_collection(repo=repo, sensor_key=platform, update_collection_on_item=True,
+                                    journal=journal)
+            except Exception as e:
+                logger.error(f"Error adding collection for {platform} :: {e}")
+    finally:
+        journal.close()
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
     main()
\ No newline at end of file
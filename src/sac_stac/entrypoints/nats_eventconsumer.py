@@ -1,79 +1,191 @@
 import asyncio
 import logging
 import signal
+from functools import partial
+from typing import List
 
 from nats.aio.client import Client as NATS
+from nats.errors import TimeoutError as FetchTimeoutError
+from nats.js.api import ConsumerConfig
+from nats.js.errors import BadRequestError
 from sac_stac.adapters import repository
 from sac_stac.domain.s3 import S3
-from sac_stac.service_layer.services import add_stac_collection, add_stac_item
-from sac_stac.load_config import get_nats_uri, LOG_LEVEL, LOG_FORMAT, get_s3_configuration
-
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.message_dispatcher import MessageDispatcher
+from sac_stac.service_layer.services import add_stac_collection, add_stac_item, add_stac_item_batch, S3_BUCKET
+from sac_stac.load_config import get_nats_uri, LOG_LEVEL, LOG_FORMAT, get_s3_configuration, \
+    get_consumer_configuration, get_jetstream_configuration
 
 logger = logging.getLogger(__name__)
 
-S3_ACCESS_KEY_ID = get_s3_configuration()["key_id"]
-S3_SECRET_ACCESS_KEY = get_s3_configuration()["access_key"]
-S3_REGION = get_s3_configuration()["region"]
-S3_ENDPOINT = get_s3_configuration()["endpoint"]
+s3_config = get_s3_configuration()
+S3_ACCESS_KEY_ID = s3_config["key_id"]
+S3_SECRET_ACCESS_KEY = s3_config["access_key"]
+S3_REGION = s3_config["region"]
+S3_ENDPOINT = s3_config["endpoint"]
+
+SUBJECT = "stac_creator.*"
+FETCH_TIMEOUT = 5
+FETCH_ERROR_DELAYS = [1, 2, 5, 10, 30]
 
 
 async def run(nc, repo, loop):
 
     async def closed_cb():
         logger.info("Connection to NATS is closed.")
-        await asyncio.sleep(0.1, loop=loop)
+        await asyncio.sleep(0.1)
         loop.stop()
 
     options = {
         "servers": [get_nats_uri()],
-        "loop": loop,
         "closed_cb": closed_cb
     }
 
     await nc.connect(**options)
     logger.info(f"Connected to NATS at {nc.connected_url.netloc}...")
 
-    async def message_handler(msg):
-        subject = msg.subject
-        data = msg.data.decode()
-        logger.info(f"Received a message on '{subject}': {data}")
-        r = {
-            'collection': add_stac_collection,
-            'item': add_stac_item
-        }
-        logger.info(f"Handling message - 1")
-        message_type = subject.split('.')[1]
-        logger.info(f"message_type {message_type}")
-        if message_type in r.keys():
-            logger.info(f"Processing {message_type} message")
-            for k, v in r.items():
-                logger.info(f"Processing {k} message")
-                if k in subject:
-                    logger.info(f"Handling message - 2")
-                    logger.info(f"Calling function {v}")
-                    stac_type, key = v(repo, data)
-                    logger.info(f"Added {stac_type} {key} to repository")
-                    if key:
-                        subj = f'stac_indexer.{stac_type}'
-                        msg = key.encode()
-                        logger.info(f"Publishing {subj} {msg}")
-                        await nc.publish(subj, msg)
-                        logger.info(f"Published a message on '{subj}': {msg.decode()}")
-
-    await nc.subscribe("stac_creator.*", cb=message_handler)
+    jetstream_config = get_jetstream_configuration()
+    collection_buffer = CollectionBuffer(repo, bucket=S3_BUCKET).start()
+    dispatcher = MessageDispatcher(
+        handlers={
+            'collection': partial(add_stac_collection, repo, collection_buffer=collection_buffer),
+            # Messages are acknowledged once processed, so the item link has to be written by then
+            'item': partial(add_stac_item, repo, collection_buffer=collection_buffer,
+                            flush_collection=jetstream_config["enabled"])
+        },
+        # Item messages of a collection arriving together are written to collection.json at once
+        batch_handlers={
+            'item': partial(add_stac_item_batch, repo, collection_buffer=collection_buffer)
+        },
+        batch_key=get_sensor_name,
+        publish=nc.publish
+    )
+
+    if jetstream_config["enabled"]:
+        subscription = await subscribe_jetstream(nc, jetstream_config)
+        consumer = loop.create_task(pull_messages(subscription, dispatcher, jetstream_config["backoff"],
+                                                  heartbeat=jetstream_config["ack_wait"] / 2))
+    else:
+        async def message_handler(msg):
+            subject = msg.subject
+            data = msg.data.decode()
+            logger.info(f"Received a message on '{subject}': {data}")
+            # Waits while the dispatcher is full, holding back the next messages
+            await dispatcher.dispatch(subject, data)
+
+        # Replicas in the same queue group share the messages
+        subscription = await nc.subscribe(SUBJECT, queue=get_consumer_configuration()["queue"], cb=message_handler)
+        consumer = None
+
+    async def shutdown():
+        if consumer:
+            consumer.cancel()
+        await subscription.unsubscribe()
+        logger.info("Waiting for the messages being processed...")
+        await dispatcher.close()
+        logger.info("Flushing pending collection updates...")
+        collection_buffer.close()
+        logger.info("Disconnecting...")
+        await nc.close()
 
     def signal_handler():
         if nc.is_closed:
             return
-        logger.info("Disconnecting...")
-        loop.create_task(nc.close())
+        loop.create_task(shutdown())
 
     for sig in ('SIGINT', 'SIGTERM'):
         loop.add_signal_handler(getattr(signal, sig), signal_handler)
 
 
+def get_sensor_name(acquisition_key: str) -> str:
+    parts = acquisition_key.split('/')
+    return parts[2] if len(parts) > 2 else ''
+
+
+async def subscribe_jetstream(nc, jetstream_config: dict):
+    """
+    Create the stream capturing the stac_creator messages, if needed, and
+    bind to its durable pull consumer shared by every replica.
+    """
+    js = nc.jetstream()
+    try:
+        await js.add_stream(name=jetstream_config["stream"], subjects=[SUBJECT])
+    except BadRequestError as e:
+        # Already created with another configuration, use it as it is
+        logger.info(f"Using existing stream {jetstream_config['stream']}: {e}")
+
+    consumer_config = ConsumerConfig(
+        ack_wait=jetstream_config["ack_wait"],
+        max_deliver=jetstream_config["max_deliver"],
+        max_ack_pending=jetstream_config["max_in_flight"],
+    )
+    logger.info(f"Pulling from {jetstream_config['stream']} stream as {jetstream_config['durable']}...")
+    return await js.pull_subscribe(SUBJECT, durable=jetstream_config["durable"],
+                                   stream=jetstream_config["stream"], config=consumer_config)
+
+
+async def pull_messages(subscription, dispatcher: MessageDispatcher, backoff: List[float], heartbeat: float = None):
+    """
+    Fetch messages as processing slots free up. Messages are acknowledged once
+    processed and redelivered after a backoff delay otherwise.
+
+    While a message is processed, it is marked in progress every `heartbeat`
+    seconds so a collection taking longer than ack_wait is not redelivered.
+
+    A failed fetch, as while NATS reconnects, is logged and retried after
+    an increasing delay, so the consumer never stops pulling.
+    """
+    heartbeats = set()
+
+    async def settle(msg, processed: bool):
+        if processed:
+            await msg.ack()
+        else:
+            attempt = msg.metadata.num_delivered if msg.metadata else 1
+            delay = backoff[min(attempt, len(backoff)) - 1] if backoff else None
+            logger.info(f"Redelivering {msg.data.decode()} in {delay}s")
+            await msg.nak(delay=delay)
+
+    async def keep_in_progress(msg, processed: asyncio.Future):
+        while True:
+            done, _ = await asyncio.wait({processed}, timeout=heartbeat)
+            if done:
+                return
+            try:
+                await msg.in_progress()
+            except Exception as e:
+                logger.warning(f"Could not mark {msg.data.decode()} in progress: {e}")
+
+    errors = 0
+    while True:
+        try:
+            msgs = await subscription.fetch(batch=max(dispatcher.free_slots, 1), timeout=FETCH_TIMEOUT)
+        except FetchTimeoutError:
+            errors = 0
+            continue
+        except Exception as e:
+            delay = FETCH_ERROR_DELAYS[min(errors, len(FETCH_ERROR_DELAYS) - 1)]
+            errors += 1
+            logger.error(f"Could not fetch messages, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            continue
+        errors = 0
+
+        for msg in msgs:
+            data = msg.data.decode()
+            logger.info(f"Received a message on '{msg.subject}': {data}")
+            processed = await dispatcher.dispatch(msg.subject, data, on_result=partial(settle, msg))
+            if not processed:
+                # Nothing handles it, redelivering would not help
+                await msg.ack()
+            elif heartbeat and not processed.done():
+                task = asyncio.ensure_future(keep_in_progress(msg, processed))
+                heartbeats.add(task)
+                task.add_done_callback(heartbeats.discard)
+
+
 if __name__ == '__main__':
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 
     s3 = S3(key=S3_ACCESS_KEY_ID, secret=S3_SECRET_ACCESS_KEY,
             s3_endpoint=S3_ENDPOINT, region_name=S3_REGION)
@@ -1,7 +1,10 @@
 import json
 import os
 import logging
+import re
 from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Pattern, Tuple
 
 LOG_FORMAT = '%(asctime)s - %(levelname)6s - %(message)s'
 LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO"))
@@ -12,6 +15,49 @@ with open(Path(__file__).parent / "config.json") as json_data_file:
 config = config_file
 
 
+class SensorConfig(NamedTuple):
+    """Sensor entry of the configuration with its regular expressions compiled."""
+    id: str
+    config: dict
+    date_regex: Pattern
+    date_format: str
+    bands: Tuple[Tuple[str, str], ...]
+    band_pattern: Pattern
+
+
+def compile_band_pattern(band_names: Tuple[str, ...]) -> Pattern:
+    """
+    Combine the band name regular expressions into one pattern matched at the start
+    of a key, with a lookahead per band, so a single match tells every band the key
+    matches anywhere (a `band10` key also matches `band1`).
+    """
+    lookaheads = [f"(?:(?=.*?(?P<band{i}>{name})))?" for i, name in enumerate(band_names)]
+    return re.compile(''.join(lookaheads), re.IGNORECASE | re.DOTALL)
+
+
+def build_sensor_index(sensors: list) -> Mapping[str, SensorConfig]:
+    index = {}
+    for sensor in sensors:
+        date_config = sensor.get('formatting').get('date')
+        bands = tuple((b.get('name'), b.get('common_name')) for b in sensor.get('extensions').get('eo').get('bands'))
+        index[sensor.get('id')] = SensorConfig(
+            id=sensor.get('id'),
+            config=sensor,
+            date_regex=re.compile(date_config.get('regex')),
+            date_format=date_config.get('format'),
+            bands=bands,
+            band_pattern=compile_band_pattern(tuple(name for name, _ in bands))
+        )
+    return MappingProxyType(index)
+
+
+sensor_index = build_sensor_index(config.get('sensors'))
+
+
+def get_sensor_config(sensor_id: str) -> Optional[SensorConfig]:
+    return sensor_index.get(sensor_id)
+
+
 def get_nats_uri():
     host = os.environ.get("NATS_HOST", "127.0.0.1")
     port = os.environ.get("NATS_PORT", "4222")
@@ -28,3 +74,84 @@ def get_s3_configuration():
     stac_path = os.environ.get("S3_STAC_PATH", '')
     return dict(key_id=key_id, access_key=access_key, region=region,
                 endpoint=endpoint, bucket=bucket, stac_path=stac_path, imagery_path=imagery_path)
+
+
+def get_max_workers():
+    return int(os.environ.get("STAC_MAX_WORKERS", "8"))
+
+
+def get_collection_buffer_configuration():
+    max_items = int(os.environ.get("STAC_COLLECTION_FLUSH_ITEMS", "100"))
+    max_age = float(os.environ.get("STAC_COLLECTION_FLUSH_SECONDS", "30"))
+    return dict(max_items=max_items, max_age=max_age)
+
+
+def get_gdal_configuration():
+    vsis3 = os.environ.get("STAC_GDAL_VSIS3", "false").lower() in ("1", "true", "yes")
+    vsi_cache_size = int(os.environ.get("STAC_GDAL_VSI_CACHE_SIZE", str(64 * 1024 * 1024)))
+    return dict(vsis3=vsis3, vsi_cache_size=vsi_cache_size)
+
+
+def get_probe_configuration():
+    header_parser = os.environ.get("STAC_COG_HEADER_PARSER", "true").lower() in ("1", "true", "yes")
+    header_size = int(os.environ.get("STAC_COG_HEADER_SIZE", "16384"))
+    return dict(header_parser=header_parser, header_size=header_size)
+
+
+def get_probe_cache_configuration():
+    path = os.environ.get("STAC_PROBE_CACHE_PATH", "")
+    max_size = int(os.environ.get("STAC_PROBE_CACHE_SIZE", str(256 * 1024 * 1024)))
+    return dict(path=path, max_size=max_size)
+
+
+def get_backfill_configuration():
+    processes = int(os.environ.get("STAC_BACKFILL_PROCESSES", "1"))
+    shards = int(os.environ.get("STAC_BACKFILL_SHARDS", "0")) or processes * 4
+    journal_path = os.environ.get("STAC_BACKFILL_JOURNAL", "stac_backfill.journal")
+    journal_fsync_interval = float(os.environ.get("STAC_BACKFILL_JOURNAL_FSYNC_SECONDS", "5"))
+    return dict(processes=processes, shards=shards, journal_path=journal_path,
+                journal_fsync_interval=journal_fsync_interval)
+
+
+def get_consumer_configuration():
+    max_concurrency = int(os.environ.get("STAC_CONSUMER_CONCURRENCY", "32"))
+    queue = os.environ.get("STAC_CONSUMER_QUEUE", "stac_creator")
+    batch_window = float(os.environ.get("STAC_CONSUMER_BATCH_WINDOW", "0.25"))
+    batch_size = int(os.environ.get("STAC_CONSUMER_BATCH_SIZE", "32"))
+    dedupe_ttl = float(os.environ.get("STAC_CONSUMER_DEDUPE_TTL", "300"))
+    dedupe_size = int(os.environ.get("STAC_CONSUMER_DEDUPE_SIZE", "10000"))
+    return dict(max_concurrency=max_concurrency, queue=queue, batch_window=batch_window, batch_size=batch_size,
+                dedupe_ttl=dedupe_ttl, dedupe_size=dedupe_size)
+
+
+def get_jetstream_configuration():
+    enabled = os.environ.get("STAC_JETSTREAM", "false").lower() in ("1", "true", "yes")
+    stream = os.environ.get("STAC_JETSTREAM_STREAM", "STAC_CREATOR")
+    durable = os.environ.get("STAC_JETSTREAM_DURABLE", "stac_creator")
+    max_in_flight = int(os.environ.get("STAC_JETSTREAM_MAX_IN_FLIGHT", "64"))
+    ack_wait = float(os.environ.get("STAC_JETSTREAM_ACK_WAIT", "600"))
+    max_deliver = int(os.environ.get("STAC_JETSTREAM_MAX_DELIVER", "5"))
+    backoff = [float(b) for b in os.environ.get("STAC_JETSTREAM_BACKOFF", "10,60,300").split(",") if b]
+    return dict(enabled=enabled, stream=stream, durable=durable, max_in_flight=max_in_flight,
+                ack_wait=ack_wait, max_deliver=max_deliver, backoff=backoff)
+
+
+def get_collection_lease_configuration():
+    enabled = os.environ.get("STAC_COLLECTION_LEASE", "true").lower() in ("1", "true", "yes")
+    ttl = float(os.environ.get("STAC_COLLECTION_LEASE_TTL", "60"))
+    timeout = float(os.environ.get("STAC_COLLECTION_LEASE_TIMEOUT", "30"))
+    return dict(enabled=enabled, ttl=ttl, timeout=timeout)
+
+
+def get_s3_client_configuration():
+    max_pool_connections = int(os.environ.get("STAC_S3_MAX_POOL_CONNECTIONS", "64"))
+    max_attempts = int(os.environ.get("STAC_S3_MAX_ATTEMPTS", "10"))
+    retry_mode = os.environ.get("STAC_S3_RETRY_MODE", "adaptive")
+    tcp_keepalive = os.environ.get("STAC_S3_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+    return dict(max_pool_connections=max_pool_connections, max_attempts=max_attempts, retry_mode=retry_mode,
+                tcp_keepalive=tcp_keepalive)
+
+
+def get_s3_write_configuration():
+    verify = os.environ.get("STAC_S3_VERIFY_WRITES", "true").lower() in ("1", "true", "yes")
+    return dict(verify=verify)
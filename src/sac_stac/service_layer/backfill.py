@@ -0,0 +1,166 @@
+import logging
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from pystac import Item, STAC_IO
+
+from sac_stac.adapters.repository import S3Repository
+from sac_stac.domain.geometry import reproject_footprints
+from sac_stac.domain.s3 import S3
+from sac_stac.load_config import get_backfill_configuration, get_max_workers, get_sensor_config
+from sac_stac.service_layer import services
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.item_index import ItemIndex
+from sac_stac.service_layer.journal import BackfillJournal
+
+logger = logging.getLogger(__name__)
+
+# Repository of a worker process, built once by its initializer
+_worker_repo: Optional[S3Repository] = None
+
+
+def get_shard(acquisition_key: str, shards: int) -> Tuple[str, int]:
+    """Return the shard of an acquisition: its sensor and a stable hash of its prefix."""
+    sensor_name = acquisition_key.split('/')[2]
+    return sensor_name, zlib.crc32(acquisition_key.encode('utf-8')) % shards
+
+
+def shard_acquisitions(acquisition_keys: List[str], shards: int) -> Dict[Tuple[str, int], List[str]]:
+    sharded = {}
+    for acquisition_key in acquisition_keys:
+        sharded.setdefault(get_shard(acquisition_key, shards), []).append(acquisition_key)
+    return sharded
+
+
+def build_item_dicts(acquisition_keys: List[str], max_workers: int) -> List[Tuple[str, Optional[dict]]]:
+    """
+    Build the items of a shard in a worker process. Nothing is written, the
+    items are returned as dicts to be committed by the parent process.
+
+    The footprints of the shard are reprojected together once its items are built.
+
+    :return: (acquisition_key, item dict) pairs, the dict being None when the item could not be built.
+    """
+    def build(acquisition_key: str) -> Optional[Tuple[Item, tuple]]:
+        try:
+            sensor = get_sensor_config(acquisition_key.split('/')[2])
+            return services.build_stac_item_with_footprint(_worker_repo, acquisition_key, sensor=sensor)
+        except Exception as e:
+            logger.warning(f"Could not build {acquisition_key}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        built = list(executor.map(build, acquisition_keys))
+
+    geometries = iter(reproject_footprints([footprint for _, footprint in filter(None, built)],
+                                           target_epsg=services.GENERIC_EPSG))
+    item_dicts = []
+    for acquisition_key, result in zip(acquisition_keys, built):
+        item = result[0] if result else None
+        if item:
+            item.geometry = next(geometries)
+        item_dicts.append((acquisition_key, item.to_dict() if item else None))
+    return item_dicts
+
+
+def backfill(repo: S3Repository, s3_credentials: dict, sensor_keys: List[str], processes: int = None,
+             shards: int = None, max_workers: int = None, journal: BackfillJournal = None) -> dict:
+    """
+    Add the acquisitions of the given sensors missing from their collections,
+    building the items in a pool of processes.
+
+    Acquisitions are sharded by sensor and prefix hash. Workers return item
+    dicts and this process, the only writer of the collections, commits them.
+
+    :param repo: S3 repository of this process
+    :param s3_credentials: S3 arguments (key, secret, s3_endpoint, region_name) the workers connect with
+    :param sensor_keys: sensor prefixes of the imagery
+    :param processes: worker processes, defaults to STAC_BACKFILL_PROCESSES
+    :param shards: shards the acquisitions are split into, defaults to STAC_BACKFILL_SHARDS
+    :param max_workers: threads of each worker and of the writer, defaults to STAC_MAX_WORKERS
+    :param journal: journal recording the added acquisitions, those it records as done are skipped
+
+    :return: dict with the 'added' and 'failed' acquisition keys.
+    """
+    backfill_config = get_backfill_configuration()
+    processes = processes or backfill_config["processes"]
+    shards = shards or backfill_config["shards"]
+    max_workers = max_workers or get_max_workers()
+    summary = {'added': [], 'failed': []}
+    STAC_IO.read_text_method = repo.stac_read_method
+
+    collection_keys, item_indexes, acquisition_keys = {}, {}, []
+    for sensor_key in sensor_keys:
+        sensor_name = sensor_key.split('/')[-2]
+        sensor = get_sensor_config(sensor_name)
+        if not sensor:
+            logger.warning(f"No config found for {sensor_name} sensor")
+            continue
+        if journal and journal.is_sensor_done(sensor_key):
+            logger.info(f"{sensor_name} collection was completed by a previous run")
+            continue
+        collection_keys[sensor_name] = services.create_stac_collection(repo, sensor)
+        item_indexes[sensor_name] = ItemIndex(repo, bucket=services.S3_BUCKET,
+                                              prefix=f"{services.S3_STAC_PATH}/{sensor_name}/")
+        acquisition_keys += [key for key in repo.get_acquisition_keys(bucket=services.S3_BUCKET,
+                                                                      acquisition_prefix=sensor_key)
+                             if not (journal and journal.is_done(key))
+                             and services.get_item_key(key) not in item_indexes[sensor_name]]
+
+    sharded = shard_acquisitions(acquisition_keys, shards)
+    logger.info(f"Building {len(acquisition_keys)} items in {len(sharded)} shards with {processes} processes")
+
+    def commit(acquisition_key: str, item_dict: Optional[dict]) -> bool:
+        if not item_dict:
+            return False
+        sensor_name = acquisition_key.split('/')[2]
+        return services.commit_stac_item(repo, Item.from_dict(item_dict),
+                                         item_key=services.get_item_key(acquisition_key),
+                                         collection_key=collection_keys[sensor_name],
+                                         collection_buffer=buffer, item_index=item_indexes[sensor_name],
+                                         journal=journal)
+
+    # Workers are forked before this process starts any writer or flusher thread
+    processes_pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                         initargs=(s3_credentials,))
+    try:
+        futures = {processes_pool.submit(build_item_dicts, keys, max_workers): keys for keys in sharded.values()}
+        with CollectionBuffer(repo, bucket=services.S3_BUCKET,
+                              on_flush=journal.collection_committed if journal else None) as buffer, \
+                ThreadPoolExecutor(max_workers=max_workers) as writers:
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"Could not build a shard of {len(futures[future])} acquisitions: {e}")
+                    results = [(acquisition_key, None) for acquisition_key in futures[future]]
+
+                commits = {writers.submit(commit, key, item_dict): key for key, item_dict in results}
+                for commit_future in as_completed(commits):
+                    try:
+                        added = commit_future.result()
+                    except Exception as e:
+                        logger.warning(f"Could not add {commits[commit_future]}: {e}")
+                        added = False
+                    summary['added' if added else 'failed'].append(commits[commit_future])
+                    if added and journal:
+                        journal.acquisition_done(commits[commit_future])
+            # Written before leaving, closing the buffer only logs a failure
+            flushed = buffer.flush()
+    finally:
+        processes_pool.shutdown(wait=True, cancel_futures=True)
+
+    if journal and flushed:
+        done_sensors = set(collection_keys) - {key.split('/')[2] for key in summary['failed']}
+        for sensor_key in sensor_keys:
+            if sensor_key.split('/')[-2] in done_sensors:
+                journal.sensor_done(sensor_key)
+
+    logger.info(f"Backfill: {len(summary['added'])} items added, {len(summary['failed'])} failed")
+    return summary
+
+
+def _init_worker(s3_credentials: dict):
+    global _worker_repo
+    _worker_repo = S3Repository(S3(**s3_credentials))
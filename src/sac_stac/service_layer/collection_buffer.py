@@ -0,0 +1,178 @@
+import logging
+import time
+from threading import Lock, Event, Thread
+from typing import Callable, Dict, List
+
+from pystac import Item
+
+from sac_stac.adapters.repository import S3Repository, NoObjectError
+from sac_stac.domain.model import SacCollection, extend_extent
+from sac_stac.load_config import get_collection_buffer_configuration, \
+    get_collection_lease_configuration
+from sac_stac.service_layer.collection_lease import CollectionLease
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionBuffer:
+    """
+    Write-behind buffer for collection.json documents.
+
+    Items are linked against an in-memory copy of their collection and the
+    pending item links are merged into the stored document after `max_items`
+    additions, after `max_age` seconds or when the buffer is closed.
+
+    Each collection has its own lock, held only while its pending items are
+    swapped out, so flushing one collection does not block linking items to
+    the others or to itself.
+    """
+
+    def __init__(self, repo: S3Repository, bucket: str, update_extent: bool = True,
+                 max_items: int = None, max_age: float = None, use_lease: bool = None,
+                 on_flush: Callable[[str, List[Item]], None] = None):
+        """
+        :param repo: S3 repository used to read and write the collections
+        :param bucket: bucket holding the collections
+        :param update_extent: extend the collection extent with the flushed items
+        :param max_items: pending items per collection that trigger a flush
+        :param max_age: seconds a pending item waits at most before being flushed
+        :param use_lease: hold the collection lease while writing, defaults to STAC_COLLECTION_LEASE
+        :param on_flush: called with the collection key and the items once their links are written
+        """
+        buffer_config = get_collection_buffer_configuration()
+        self.repo = repo
+        self.bucket = bucket
+        self.update_extent = update_extent
+        self.max_items = max_items or buffer_config["max_items"]
+        self.max_age = max_age or buffer_config["max_age"]
+        self.use_lease = get_collection_lease_configuration()["enabled"] if use_lease is None else use_lease
+        self.on_flush = on_flush
+
+        self._lock = Lock()
+        self._collection_locks: Dict[str, Lock] = {}
+        self._collections: Dict[str, SacCollection] = {}
+        self._pending: Dict[str, List[Item]] = {}
+        self._pending_since: Dict[str, float] = {}
+        self._stop = Event()
+        self._flusher = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """Start flushing collections older than `max_age` in the background."""
+        with self._lock:
+            if not self._flusher:
+                self._stop.clear()
+                self._flusher = Thread(target=self._flush_periodically, name='collection-buffer', daemon=True)
+                self._flusher.start()
+        return self
+
+    def close(self):
+        """Stop the background flusher and write every pending item link."""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def get_collection(self, collection_key: str) -> SacCollection:
+        """
+        Return the in-memory copy of the collection, reading it on first use.
+
+        :raises NoObjectError: when the collection does not exist
+        """
+        with self._collection_lock(collection_key):
+            if collection_key not in self._collections:
+                collection_dict = self.repo.get_dict(bucket=self.bucket, key=collection_key)
+                self._collections[collection_key] = SacCollection.from_dict(collection_dict)
+            return self._collections[collection_key]
+
+    def add_item(self, collection_key: str, item: Item):
+        """
+        Link the item to its collection and queue the link to be written.
+        The item links (root, parent, self) are set on return.
+        """
+        collection = self.get_collection(collection_key)
+        with self._collection_lock(collection_key):
+            collection.add_item(item)
+            self._pending.setdefault(collection_key, []).append(item)
+            self._pending_since.setdefault(collection_key, time.monotonic())
+            full = len(self._pending[collection_key]) >= self.max_items
+        if full:
+            self._flush_collection(collection_key)
+
+    def pending(self, collection_key: str = None) -> int:
+        if collection_key:
+            return len(self._pending.get(collection_key, []))
+        return sum(len(items) for items in list(self._pending.values()))
+
+    def flush(self, collection_key: str = None) -> bool:
+        """
+        Write the pending item links of one or all collections.
+
+        :return: whether every pending item link was written.
+        """
+        keys = [collection_key] if collection_key else list(self._pending.keys())
+        return all([self._flush_collection(key) for key in keys])
+
+    def _collection_lock(self, collection_key: str) -> Lock:
+        with self._lock:
+            return self._collection_locks.setdefault(collection_key, Lock())
+
+    def _flush_collection(self, collection_key: str) -> bool:
+        with self._collection_lock(collection_key):
+            items = self._pending.pop(collection_key, [])
+            since = self._pending_since.pop(collection_key, None)
+        if not items:
+            return True
+
+        try:
+            if self.use_lease:
+                # Other replicas write the same collection, wait for our turn
+                with CollectionLease(self.repo, bucket=self.bucket, collection_key=collection_key):
+                    self._write_collection(collection_key, items)
+            else:
+                self._write_collection(collection_key, items)
+            logger.info(f"Flushed {len(items)} items to {collection_key}")
+        except Exception as e:
+            # Put the links back ahead of the ones queued meanwhile so the next flush retries them
+            logger.error(f"Could not flush {len(items)} items to {collection_key}: {e}")
+            with self._collection_lock(collection_key):
+                self._pending[collection_key] = items + self._pending.get(collection_key, [])
+                self._pending_since[collection_key] = since
+            return False
+
+        if self.on_flush:
+            self.on_flush(collection_key, items)
+        return True
+
+    def _write_collection(self, collection_key: str, items: List[Item]):
+        def merge_items(collection_dict: dict) -> dict:
+            # Merge into the stored document so links written by others are kept
+            if collection_dict is None:
+                raise NoObjectError(f'Nothing found with {collection_key} in {self.bucket} bucket')
+            collection = SacCollection.from_dict(collection_dict)
+            item_hrefs = {link.get_href() for link in collection.get_links('item')}
+            for item in items:
+                if item.get_self_href() not in item_hrefs:
+                    collection.add_item(item)
+
+            if self.update_extent:
+                extend_extent(collection, items)
+            return collection.to_dict()
+
+        collection_dict = self.repo.update_dict(bucket=self.bucket, key=collection_key, update=merge_items)
+        collection = SacCollection.from_dict(collection_dict)
+        with self._collection_lock(collection_key):
+            self._collections[collection_key] = collection
+
+    def _flush_periodically(self):
+        while not self._stop.wait(min(self.max_age, 1.0)):
+            now = time.monotonic()
+            expired = [key for key, since in list(self._pending_since.items()) if now - since >= self.max_age]
+            for key in expired:
+                self._flush_collection(key)
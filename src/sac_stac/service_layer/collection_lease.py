@@ -0,0 +1,107 @@
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+
+from sac_stac.adapters.repository import S3Repository, NoObjectError, PreconditionFailedError
+from sac_stac.load_config import get_collection_lease_configuration
+
+logger = logging.getLogger(__name__)
+
+OWNER_ID = f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SETTLE_SECONDS = 0.1
+
+
+class LeaseTimeoutError(Exception):
+    pass
+
+
+class CollectionLease:
+    """
+    Lease on a collection shared by every consumer replica through an object
+    stored next to collection.json, so only one replica writes it at a time.
+
+    The lease object is created with a conditional put and expires after `ttl`
+    seconds, so a replica that dies while holding it does not block the others.
+    """
+
+    def __init__(self, repo: S3Repository, bucket: str, collection_key: str, ttl: float = None,
+                 timeout: float = None):
+        """
+        :param repo: S3 repository holding the lease object
+        :param bucket: bucket holding the collection
+        :param collection_key: key of the collection.json the lease protects
+        :param ttl: seconds the lease is held at most
+        :param timeout: seconds to wait for the lease before giving up
+        """
+        lease_config = get_collection_lease_configuration()
+        self.repo = repo
+        self.bucket = bucket
+        self.key = f"{collection_key}.lease"
+        self.ttl = ttl or lease_config["ttl"]
+        self.timeout = timeout or lease_config["timeout"]
+        self.owner = f"{OWNER_ID}-{uuid.uuid4().hex[:8]}"
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self):
+        """
+        Wait until the lease is taken.
+
+        :raises LeaseTimeoutError: when another replica holds it for longer than `timeout`
+        """
+        deadline = time.monotonic() + self.timeout
+        delay = 0.05
+        while True:
+            if self._try_acquire():
+                return
+            if time.monotonic() > deadline:
+                raise LeaseTimeoutError(f"Could not take {self.key} in {self.timeout}s")
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 1.0)
+
+    def release(self):
+        """Delete the lease object if it is still ours."""
+        try:
+            lease, _ = self.repo.get_dict_with_etag(bucket=self.bucket, key=self.key)
+            if lease.get('owner') == self.owner:
+                self.repo.delete_object(bucket=self.bucket, key=self.key)
+        except NoObjectError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not release {self.key}, it expires in {self.ttl}s: {e}")
+
+    def _try_acquire(self) -> bool:
+        lease = dict(owner=self.owner, expires=time.time() + self.ttl)
+        try:
+            current, etag = self.repo.get_dict_with_etag(bucket=self.bucket, key=self.key)
+        except NoObjectError:
+            current, etag = None, None
+
+        if current and current.get('owner') != self.owner and current.get('expires', 0) > time.time():
+            return False
+
+        try:
+            if etag:
+                # Take over an expired lease, unless someone else just did
+                self.repo.put_dict(bucket=self.bucket, key=self.key, stac_dict=lease, if_match=etag)
+            else:
+                self.repo.put_dict(bucket=self.bucket, key=self.key, stac_dict=lease, if_none_match='*')
+        except PreconditionFailedError:
+            return False
+
+        # Stores ignoring the conditions let the last writer win. Read the lease back once
+        # any write racing with ours has landed to find out who did
+        time.sleep(LEASE_SETTLE_SECONDS)
+        try:
+            stored, _ = self.repo.get_dict_with_etag(bucket=self.bucket, key=self.key)
+        except NoObjectError:
+            return False
+        return stored.get('owner') == self.owner
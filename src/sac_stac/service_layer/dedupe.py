@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class RecentKeys:
+    """
+    Bounded set of recently completed keys with their results. Keys expire
+    after `ttl` seconds and the least recently added go first once `max_size`
+    keys are kept.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._keys: Dict[Hashable, tuple] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def add(self, key: Hashable, value: Any = True):
+        with self._lock:
+            self._keys.pop(key, None)
+            self._keys[key] = (value, time.monotonic() + self.ttl)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value of the key, or None when it is unknown or expired."""
+        with self._lock:
+            entry = self._keys.get(key)
+            if not entry:
+                return None
+            if entry[1] < time.monotonic():
+                del self._keys[key]
+                return None
+            return entry[0]
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+class InFlight:
+    """
+    Runs a function once per key at a time: callers asking for a key already
+    being processed by another thread wait for that result instead.
+    """
+
+    def __init__(self):
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._futures
+
+    def run(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._futures[key]
@@ -0,0 +1,55 @@
+import logging
+from threading import Lock
+from typing import Set
+
+from sac_stac.adapters.repository import S3Repository
+
+logger = logging.getLogger(__name__)
+
+
+class ItemIndex:
+    """
+    Set of the item keys stored under a collection prefix.
+
+    The index is built from one listing on first use, so checking whether an
+    item exists does not need to download it.
+    """
+
+    def __init__(self, repo: S3Repository, bucket: str, prefix: str):
+        """
+        :param repo: S3 repository used to list the items
+        :param bucket: bucket holding the items
+        :param prefix: collection prefix the items are stored under
+        """
+        self.repo = repo
+        self.bucket = bucket
+        self.prefix = prefix
+        self._keys: Set[str] = None
+        self._lock = Lock()
+
+    def __contains__(self, item_key: str) -> bool:
+        return item_key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def keys(self) -> Set[str]:
+        with self._lock:
+            if self._keys is None:
+                self._load()
+            return self._keys
+
+    def refresh(self):
+        """Drop the indexed keys and list the collection again."""
+        with self._lock:
+            self._load()
+
+    def add(self, item_key: str):
+        with self._lock:
+            if self._keys is not None:
+                self._keys.add(item_key)
+
+    def _load(self):
+        self._keys = self.repo.get_item_keys(bucket=self.bucket, collection_prefix=self.prefix)
+        logger.info(f"Indexed {len(self._keys)} items under {self.prefix}")
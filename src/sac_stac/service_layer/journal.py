@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+from pystac import Item
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillJournal:
+    """
+    Local append-only journal of a backfill, one JSON record per line:
+
+    - 'item': an item JSON is about to be written and its link queued to its collection
+    - 'commit': the links of these items were written to their collection
+    - 'done': an acquisition is finished, its item exists
+    - 'sensor': every acquisition of a sensor is finished
+
+    Records are flushed to the OS as they are appended and synced to disk
+    every `fsync_interval` seconds, so a crash loses at most a few seconds of
+    work, which is redone on resume.
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 5.0, resume: bool = False):
+        """
+        :param path: journal file
+        :param fsync_interval: seconds between syncs of the journal to disk
+        :param resume: keep and load the records of a previous run, instead of starting a new journal
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._done: Set[str] = set()
+        self._sensors: Set[str] = set()
+        self._items: Dict[Tuple[str, str], str] = {}
+        self._committed: Set[Tuple[str, str]] = set()
+        self._lock = Lock()
+
+        if resume and os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+        self._synced_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def is_done(self, acquisition_key: str) -> bool:
+        with self._lock:
+            return acquisition_key in self._done
+
+    def is_sensor_done(self, sensor_key: str) -> bool:
+        with self._lock:
+            return sensor_key in self._sensors
+
+    def pending_commits(self) -> Dict[str, List[str]]:
+        """Return the item keys started without their collection link, by collection key."""
+        with self._lock:
+            pending = {}
+            for (collection_key, item_id), item_key in self._items.items():
+                if (collection_key, item_id) not in self._committed:
+                    pending.setdefault(collection_key, []).append(item_key)
+            return pending
+
+    def item_started(self, collection_key: str, item_id: str, item_key: str):
+        """Record an item before its JSON is written, so a crash right after the write still links it."""
+        self._append(dict(op='item', collection=collection_key, id=item_id, item=item_key))
+
+    def collection_committed(self, collection_key: str, items: List[Item]):
+        """Record the links written by a collection flush, to be used as the buffer `on_flush`."""
+        self._append(dict(op='commit', collection=collection_key, ids=[item.id for item in items]))
+
+    def acquisition_done(self, acquisition_key: str):
+        self._append(dict(op='done', acquisition=acquisition_key))
+
+    def sensor_done(self, sensor_key: str):
+        self._append(dict(op='sensor', sensor=sensor_key))
+
+    def _append(self, record: dict):
+        with self._lock:
+            self._apply(record)
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced_at = time.monotonic()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _apply(self, record: dict):
+        op = record.get('op')
+        if op == 'item':
+            self._items[(record['collection'], record['id'])] = record['item']
+        elif op == 'commit':
+            self._committed.update((record['collection'], item_id) for item_id in record['ids'])
+        elif op == 'done':
+            self._done.add(record['acquisition'])
+        elif op == 'sensor':
+            self._sensors.add(record['sensor'])
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    # The last record may be cut short by the crash
+                    logger.warning(f"Skipping a truncated record of {self.path}")
+        logger.info(f"Resuming from {self.path}: {len(self._done)} acquisitions and {len(self._sensors)} "
+                    f"sensors done, {sum(map(len, self.pending_commits().values()))} items to link")
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+from sac_stac.load_config import get_consumer_configuration
+from sac_stac.service_layer.dedupe import RecentKeys
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str], Optional[Tuple[str, str]]]
+BatchHandler = Callable[[List[str]], List[Optional[Tuple[str, str]]]]
+Publisher = Callable[[str, bytes], Awaitable]
+ResultCallback = Callable[[bool], Awaitable]
+
+
+class _Batch:
+    def __init__(self, message_type: str, handler: BatchHandler):
+        self.message_type = message_type
+        self.handler = handler
+        self.messages: List[Tuple[str, ResultCallback]] = []
+        self.started = False
+
+
+class MessageDispatcher:
+    """
+    Runs the blocking STAC handlers of incoming messages in a pool of worker
+    threads, so the event loop stays free for NATS heartbeats and publishing.
+
+    At most `max_concurrency` messages are processed at once. `dispatch` waits
+    for a free slot, which pauses the intake of the subscription calling it.
+
+    Messages with a batch handler are collected for `batch_window` seconds, by
+    message type and `batch_key`, and handled together.
+
+    An item message already being processed is not processed again, it gets
+    the result of the one in flight. An item message processed in the last
+    `dedupe_ttl` seconds is acknowledged straight away.
+
+    Messages of the `rescan_types` list the objects under their key, so a
+    duplicate may announce objects the run in flight has already missed. It
+    queues one follow-up run instead, started once the current one is done,
+    which the further duplicates share until it starts.
+    """
+
+    def __init__(self, handlers: Dict[str, Handler], publish: Publisher, max_concurrency: int = None,
+                 batch_handlers: Dict[str, BatchHandler] = None, batch_key: Callable[[str], str] = None,
+                 batch_window: float = None, max_batch: int = None, dedupe_ttl: float = None,
+                 rescan_types: Collection[str] = ('collection',)):
+        """
+        :param handlers: blocking functions by message type, returning (stac_type, key) or None
+        :param publish: coroutine publishing a message on the event loop
+        :param max_concurrency: messages processed at once, defaults to STAC_CONSUMER_CONCURRENCY
+        :param batch_handlers: blocking functions by message type, handling a list of messages at once
+        :param batch_key: function grouping the messages of a batch, by default all of them
+        :param batch_window: seconds a batch collects messages, defaults to STAC_CONSUMER_BATCH_WINDOW
+        :param max_batch: messages that start a batch before its window ends, defaults to STAC_CONSUMER_BATCH_SIZE
+        :param dedupe_ttl: seconds a processed message is remembered, defaults to STAC_CONSUMER_DEDUPE_TTL
+        :param rescan_types: message types run again, rather than deduplicated, when repeated while processed
+        """
+        consumer_config = get_consumer_configuration()
+        self.handlers = handlers
+        self.publish = publish
+        self.max_concurrency = max_concurrency or consumer_config["max_concurrency"]
+        self.batch_handlers = batch_handlers or {}
+        self.batch_key = batch_key or (lambda data: '')
+        self.batch_window = consumer_config["batch_window"] if batch_window is None else batch_window
+        self.max_batch = max_batch or consumer_config["batch_size"]
+        dedupe_ttl = consumer_config["dedupe_ttl"] if dedupe_ttl is None else dedupe_ttl
+        self.recent = RecentKeys(ttl=dedupe_ttl, max_size=consumer_config["dedupe_size"]) if dedupe_ttl > 0 else None
+        self.rescan_types = set(rescan_types)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='stac-message')
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._tasks: Set[asyncio.Future] = set()
+        self._batches: Dict[Tuple[str, str], _Batch] = {}
+        self._processing: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._follow_ups: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Messages being processed."""
+        return self._in_flight
+
+    @property
+    def free_slots(self) -> int:
+        return self.max_concurrency - self._in_flight
+
+    async def dispatch(self, subject: str, data: str, on_result: ResultCallback = None) -> Optional[asyncio.Future]:
+        """
+        Start processing a message once a slot is free.
+
+        :param on_result: coroutine called on the event loop with whether the message was processed
+
+        :return: a future resolved once the message is processed, or None when the subject has no handler.
+        """
+        message_type = subject.split('.')[-1]
+        handler = self.handlers.get(message_type)
+        batch_handler = self.batch_handlers.get(message_type) if self.batch_window > 0 else None
+        if not handler and not batch_handler:
+            logger.warning(f"No handler for '{subject}' messages")
+            return None
+
+        key = (message_type, data)
+        rescan = message_type in self.rescan_types and not batch_handler
+        processed = self._processing.get(key)
+        if processed:
+            if rescan:
+                # The run in flight may have listed already, run once more after it
+                logger.info(f"{message_type} message {data} is being processed, it will run again once done")
+                processed = self._follow_ups.setdefault(key, asyncio.get_event_loop().create_future())
+            else:
+                logger.info(f"{message_type} message {data} is already being processed")
+            if on_result:
+                self._track(self._report_when_done(processed, on_result))
+            return processed
+
+        processed = self._processing[key] = asyncio.get_event_loop().create_future()
+        if self.recent is not None and not rescan and self.recent.get(key):
+            logger.info(f"{message_type} message {data} was recently processed")
+            self._processing.pop(key)
+            processed.set_result(True)
+            if on_result:
+                await on_result(True)
+            return processed
+
+        await self._slots.acquire()
+        self._in_flight += 1
+        if batch_handler:
+            self._add_to_batch(message_type, batch_handler, data, on_result)
+        else:
+            self._track(self._process(message_type, handler, data, on_result))
+        return processed
+
+    async def drain(self):
+        """Start the open batches and wait for the messages being processed."""
+        for key, batch in list(self._batches.items()):
+            self._start_batch(key, batch)
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self):
+        await self.drain()
+        self._executor.shutdown(wait=True)
+
+    def _track(self, coroutine) -> asyncio.Future:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _add_to_batch(self, message_type: str, handler: BatchHandler, data: str, on_result: ResultCallback):
+        key = (message_type, self.batch_key(data))
+        batch = self._batches.get(key)
+        if not batch:
+            batch = self._batches[key] = _Batch(message_type, handler)
+            self._track(self._start_batch_later(key, batch))
+
+        batch.messages.append((data, on_result))
+        if len(batch.messages) >= self.max_batch:
+            self._start_batch(key, batch)
+
+    async def _start_batch_later(self, key: Tuple[str, str], batch: _Batch):
+        await asyncio.sleep(self.batch_window)
+        self._start_batch(key, batch)
+
+    def _start_batch(self, key: Tuple[str, str], batch: _Batch):
+        if batch.started:
+            return
+        batch.started = True
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        self._track(self._process_batch(batch))
+
+    async def _process(self, message_type: str, handler: Handler, data: str, on_result: ResultCallback = None):
+        processed = False
+        try:
+            logger.info(f"Processing {message_type} message: {data}")
+            result = await asyncio.get_event_loop().run_in_executor(self._executor, handler, data)
+            processed = await self._publish_result(message_type, data, result)
+        except Exception as e:
+            logger.exception(f"Error processing {message_type} message {data}: {e}")
+        finally:
+            await self._finish(message_type, data, processed, on_result)
+
+    async def _process_batch(self, batch: _Batch):
+        data = [message[0] for message in batch.messages]
+        try:
+            logger.info(f"Processing {len(data)} {batch.message_type} messages")
+            results = await asyncio.get_event_loop().run_in_executor(self._executor, batch.handler, data)
+        except Exception as e:
+            logger.exception(f"Error processing {len(data)} {batch.message_type} messages: {e}")
+            results = [None] * len(data)
+
+        for (message_data, on_result), result in zip(batch.messages, results):
+            processed = False
+            try:
+                processed = await self._publish_result(batch.message_type, message_data, result)
+            except Exception as e:
+                logger.exception(f"Error processing {batch.message_type} message {message_data}: {e}")
+            finally:
+                await self._finish(batch.message_type, message_data, processed, on_result)
+
+    async def _publish_result(self, message_type: str, data: str, result: Optional[Tuple[str, str]]) -> bool:
+        if not result or not result[1]:
+            logger.warning(f"Could not process {message_type} message: {data}")
+            return False
+
+        stac_type, key = result
+        logger.info(f"Added {stac_type} {key} to repository")
+        subject = f'stac_indexer.{stac_type}'
+        await self.publish(subject, key.encode())
+        logger.info(f"Published a message on '{subject}': {key}")
+        return True
+
+    async def _finish(self, message_type: str, data: str, processed: bool, on_result: ResultCallback):
+        key = (message_type, data)
+        if processed and self.recent is not None and message_type not in self.rescan_types:
+            self.recent.add(key)
+        future = self._processing.pop(key, None)
+        if future and not future.done():
+            future.set_result(processed)
+
+        follow_up = self._follow_ups.pop(key, None)
+        if follow_up:
+            # Keep the slot for the follow-up run, its duplicates are reported through its future
+            self._processing[key] = follow_up
+            self._track(self._process(message_type, self.handlers[message_type], data))
+        else:
+            self._in_flight -= 1
+            self._slots.release()
+        if on_result:
+            try:
+                await on_result(processed)
+            except Exception as e:
+                logger.error(f"Could not report the result of {message_type} message {data}: {e}")
+
+    async def _report_when_done(self, processed: asyncio.Future, on_result: ResultCallback):
+        try:
+            await on_result(await asyncio.shield(processed))
+        except Exception as e:
+            logger.error(f"Could not report the result of a duplicated message: {e}")
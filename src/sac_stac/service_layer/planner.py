@@ -0,0 +1,222 @@
+import json
+import math
+from typing import Dict, List
+
+from sac_stac.adapters.repository import S3Repository
+from sac_stac.domain.manifest import AcquisitionManifest
+from sac_stac.domain.s3 import NoObjectError, ObjectRecord
+from sac_stac.load_config import get_collection_buffer_configuration, get_collection_lease_configuration, \
+    get_probe_configuration, get_s3_write_configuration, get_sensor_config
+from sac_stac.service_layer import services, sync
+from sac_stac.service_layer.sync import SyncPlan
+
+LIST_PAGE_SIZE = 1000
+# Document sizes used when the catalog holds none to measure
+ITEM_SIZE_ESTIMATE = 4096
+COLLECTION_SIZE_ESTIMATE = 2048
+CATALOG_SIZE_ESTIMATE = 1024
+
+
+def plan_run(repo: S3Repository, command: str = 'backfill', imagery_prefix: str = None, prune: bool = False) -> dict:
+    """
+    Estimate the load of a backfill or a sync from the listings of the imagery
+    and the catalog, without running it. Nothing is written.
+
+    :param repo: S3 repository
+    :param command: 'backfill' or 'sync'
+    :param imagery_prefix: prefix the sensor folders are under, defaults to S3_IMAGERY_PATH
+    :param prune: the sync prunes the removed items
+
+    :return: the estimate, see estimate_run.
+    """
+    # A backfill ignores the sync state, its plan needs the two listings only
+    plan = sync.plan_sync(repo, imagery_prefix=imagery_prefix, use_state=command == 'sync')
+    return estimate_run(plan, command=command, prune=prune, conditional_writes=repo.s3.conditional_writes)
+
+
+def estimate_run(plan: SyncPlan, command: str = 'backfill', prune: bool = False,
+                 conditional_writes: bool = True) -> dict:
+    """
+    Estimate the requests and bytes of a run applying the plan.
+
+    A backfill builds the items of the new acquisitions. A sync also rebuilds
+    the changed ones, prunes the removed ones when `prune` is set and lists the catalog instead of
+    each sensor. Uncontended collection writes are assumed, and every product
+    probed is counted as one ranged read of STAC_COG_HEADER_SIZE bytes, so a
+    warm probe cache or collections flushed by age change the figures.
+
+    :param conditional_writes: the S3 client sends If-Match and If-None-Match, otherwise
+        each conditional write is preceded by a HEAD checking the stored ETag
+    :return: dict with the 'command', a report by sensor name in 'sensors' and their 'total'.
+        A report counts the acquisitions 'new' (without an item), 'present', 'changed'
+        and 'removed', the 'requests' by type and the 'bytes' read and written.
+    """
+    syncing = command == 'sync'
+    to_build = plan.added + (plan.changed if syncing else [])
+    sensors: Dict[str, dict] = {}
+
+    def report(sensor_name: str) -> dict:
+        return sensors.setdefault(sensor_name, _new_report())
+
+    for acquisition_key in plan.acquisitions:
+        report(acquisition_key.split('/')[2])['acquisitions'] += 1
+    for acquisition_key in plan.added:
+        report(acquisition_key.split('/')[2])['new'] += 1
+    for acquisition_key in plan.unchanged + plan.changed:
+        report(acquisition_key.split('/')[2])['present'] += 1
+    for acquisition_key in plan.changed:
+        report(acquisition_key.split('/')[2])['changed'] += 1
+    for item_key in plan.removed:
+        report(item_key.split('/')[-3])['removed'] += 1
+
+    header_size = get_probe_configuration()["header_size"]
+    item_sizes = _get_item_sizes(plan.items)
+    added = set(plan.added)
+    built, new_link_sizes, removed_link_sizes = {}, {}, {}
+    for acquisition_key in to_build:
+        sensor_name = acquisition_key.split('/')[2]
+        sensor_report = report(sensor_name)
+        records = plan.acquisitions[acquisition_key]
+        probed = _count_probed_products(acquisition_key, records, sensor_name)
+        # Manifest listing, COG header reads and item JSON
+        _add(sensor_report, list=_pages(len(records)), ranged_get=probed, put=1)
+        sensor_report['bytes']['ranged_read'] += probed * header_size
+        sensor_report['bytes']['json_written'] += item_sizes.get(sensor_name, item_sizes[''])
+        built[sensor_name] = built.get(sensor_name, 0) + 1
+        if acquisition_key in added:
+            new_link_sizes.setdefault(sensor_name, []).append(_get_link_size(services.get_item_key(acquisition_key)))
+    if syncing and prune:
+        for item_key in plan.removed:
+            removed_link_sizes.setdefault(item_key.split('/')[-3], []).append(_get_link_size(item_key))
+
+    for sensor_name, sensor_report in sensors.items():
+        if not syncing:
+            # Acquisitions of the sensor, then its items and collection for the item index
+            items = sum(1 for item_key in plan.items if item_key.split('/')[-3] == sensor_name)
+            _add(sensor_report, list=_pages(sensor_report['acquisitions']) + _pages(items + 1))
+        _estimate_collection(plan, sensor_name, sensor_report, built=built.get(sensor_name, 0),
+                             new_link_sizes=new_link_sizes.get(sensor_name, []),
+                             removed_link_sizes=removed_link_sizes.get(sensor_name, []),
+                             conditional_writes=conditional_writes)
+
+    total = _new_report()
+    for sensor_report in sensors.values():
+        _add_report(total, sensor_report)
+    if syncing:
+        # Imagery and catalog listings, sync state read and written
+        _add(total, list=_pages(sum(map(len, plan.acquisitions.values()))) +
+             _pages(len(plan.items) + len(plan.documents)), get=1, put=1)
+        total['bytes']['json_written'] += len(json.dumps({'acquisitions': plan.fingerprints}))
+
+    return dict(command=command, sensors=sensors, total=total)
+
+
+def _estimate_collection(plan: SyncPlan, sensor_name: str, sensor_report: dict, built: int,
+                         new_link_sizes: List[int], removed_link_sizes: List[int], conditional_writes: bool):
+    if not built and not removed_link_sizes:
+        return
+    collection_key = f"{services.S3_STAC_PATH}/{sensor_name}/collection.json"
+    collection = plan.documents.get(collection_key)
+    collection_size = collection.size if collection else COLLECTION_SIZE_ESTIMATE
+
+    if built:
+        # Existence check, then the copy read by the collection buffer
+        _add(sensor_report, get=2)
+        if not collection:
+            # Collection creation and its link in the catalog
+            catalog = plan.documents.get(services.S3_CATALOG_KEY)
+            _add(sensor_report, **_get_update_requests(conditional_writes))
+            _add(sensor_report, **_get_conditional_put_requests(conditional_writes))
+            sensor_report['bytes']['json_written'] += collection_size + \
+                (catalog.size if catalog else CATALOG_SIZE_ESTIMATE) + _get_link_size(collection_key)
+
+    max_items = get_collection_buffer_configuration()["max_items"]
+    new_links_size = sum(new_link_sizes)
+    flushes = math.ceil(built / max_items)
+    for flush in range(flushes):
+        # Every flush rewrites the whole collection with the links so far
+        sensor_report['bytes']['json_written'] += collection_size + \
+            new_links_size * min((flush + 1) * max_items, built) // built
+    if removed_link_sizes:
+        flushes += 1
+        sensor_report['bytes']['json_written'] += max(collection_size + new_links_size - sum(removed_link_sizes), 0)
+        _add(sensor_report, delete=len(removed_link_sizes))
+
+    for _ in range(flushes):
+        _add(sensor_report, **_get_flush_requests(conditional_writes))
+
+
+def _count_probed_products(acquisition_key: str, records: List[ObjectRecord], sensor_name: str) -> int:
+    sensor = get_sensor_config(sensor_name)
+    manifest = AcquisitionManifest(prefix=acquisition_key, records=records)
+    try:
+        sample_key = manifest.smallest_product_key()
+    except NoObjectError:
+        # The item fails before probing anything
+        return 0
+    band_products = manifest.assign_bands(sensor.band_pattern, [name for name, _ in sensor.bands])
+    return len({sample_key} | set(band_products.values()))
+
+
+def _get_item_sizes(items: Dict[str, ObjectRecord]) -> Dict[str, int]:
+    # Mean size of the stored items by sensor name, and of all of them under ''
+    sizes = {}
+    for item_key, record in items.items():
+        sizes.setdefault(item_key.split('/')[-3], []).append(record.size)
+    all_sizes = [size for sensor_sizes in sizes.values() for size in sensor_sizes]
+    mean_sizes = {sensor_name: sum(s) // len(s) for sensor_name, s in sizes.items()}
+    mean_sizes[''] = sum(all_sizes) // len(all_sizes) if all_sizes else ITEM_SIZE_ESTIMATE
+    return mean_sizes
+
+
+def _get_link_size(key: str) -> int:
+    link = dict(rel='item', href=f"{services.S3_HREF}/{key}", type='application/json')
+    return len(json.dumps(link)) + 2
+
+
+def _get_conditional_put_requests(conditional_writes: bool) -> Dict[str, int]:
+    # Without conditional writes, the S3 adapter checks the stored ETag with a HEAD first
+    return dict(put=1, head=0 if conditional_writes else 1)
+
+
+def _get_update_requests(conditional_writes: bool) -> Dict[str, int]:
+    # Read, conditional write, and with verified writes an ETag check before and a read back after
+    verify = get_s3_write_configuration()["verify"]
+    requests = _get_conditional_put_requests(conditional_writes)
+    requests['get'] = 2 if verify else 1
+    requests['head'] += 1 if verify else 0
+    return requests
+
+
+def _get_flush_requests(conditional_writes: bool) -> Dict[str, int]:
+    requests = _get_update_requests(conditional_writes)
+    if get_collection_lease_configuration()["enabled"]:
+        # Lease check, conditional write and read back, then check and delete on release
+        for request, count in _get_conditional_put_requests(conditional_writes).items():
+            requests[request] += count
+        requests['get'] += 3
+        requests['delete'] = 1
+    return requests
+
+
+def _pages(count: int) -> int:
+    return max(math.ceil(count / LIST_PAGE_SIZE), 1)
+
+
+def _new_report() -> dict:
+    return dict(acquisitions=0, new=0, present=0, changed=0, removed=0,
+                requests=dict(list=0, get=0, head=0, put=0, delete=0, ranged_get=0),
+                bytes=dict(json_written=0, ranged_read=0))
+
+
+def _add(report: dict, **requests: int):
+    for request, count in requests.items():
+        report['requests'][request] += count
+
+
+def _add_report(total: dict, report: dict):
+    for key in ('acquisitions', 'new', 'present', 'changed', 'removed'):
+        total[key] += report[key]
+    for group in ('requests', 'bytes'):
+        for key, value in report[group].items():
+            total[group][key] += value
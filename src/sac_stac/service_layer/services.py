@@ -1,56 +1,100 @@
-import json
 import logging
-import re
-from shapely.geometry import Polygon
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
+from typing import List, Optional, Tuple
 
-from geopandas import GeoSeries
 from pystac import Catalog, Extent, SpatialExtent, TemporalExtent, Asset, MediaType, STAC_IO, Item, Collection
 from pystac.extensions.eo import Band
 
-from sac_stac.adapters.repository import S3Repository, NoObjectError
+from sac_stac.adapters.repository import S3Repository, NoObjectError, PreconditionFailedError
 from sac_stac.domain.model import SacCollection, SacItem
 from sac_stac.domain.operations import obtain_date_from_filename, get_geometry_from_cog, \
     get_projection_from_cog
+from sac_stac.domain.geometry import reproject_geometry
+from sac_stac.domain.probe_cache import get_probe_cache
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.dedupe import InFlight
+from sac_stac.service_layer.item_index import ItemIndex
+from sac_stac.service_layer.journal import BackfillJournal
 from sac_stac.service_layer.operations import get_iso
 
-from sac_stac.load_config import config, LOG_LEVEL, LOG_FORMAT, get_s3_configuration
+from sac_stac.load_config import config, get_s3_configuration, get_max_workers, \
+    get_sensor_config, SensorConfig
 
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-S3_ENDPOINT = get_s3_configuration()["endpoint"]
-S3_BUCKET = get_s3_configuration()["bucket"]
-S3_STAC_PATH = get_s3_configuration()["stac_path"]
+s3_config = get_s3_configuration()
+S3_ENDPOINT = s3_config["endpoint"]
+S3_BUCKET = s3_config["bucket"]
+S3_STAC_PATH = s3_config["stac_path"]
 S3_CATALOG_KEY = f"{S3_STAC_PATH}/catalog.json"
 S3_HREF = f"https://{S3_BUCKET}.{S3_ENDPOINT.replace('https://', '')}"
 GENERIC_EPSG = 4326
 
+_items_in_flight = InFlight()
 
-def add_stac_collection(repo: S3Repository, sensor_key: str, update_collection_on_item: bool = True):
-    STAC_IO.read_text_method = repo.stac_read_method
 
-    try:
-        catalog_dict = repo.get_dict(bucket=S3_BUCKET, key=S3_CATALOG_KEY)
-        catalog = Catalog.from_dict(catalog_dict)
-    except Exception:
-        logger.info(f"No catalog found in {S3_CATALOG_KEY}")
-        logger.info("Creating new catalog...")
-        catalog = Catalog(
-            id=config.get('id'),
-            title=config.get('title'),
-            description=config.get('description'),
-            stac_extensions=config.get('stac_extensions')
-        )
+def add_stac_collection(repo: S3Repository, sensor_key: str, update_collection_on_item: bool = True,
+                        max_workers: int = None, collection_buffer: CollectionBuffer = None,
+                        item_index: ItemIndex = None, journal: BackfillJournal = None):
+    STAC_IO.read_text_method = repo.stac_read_method
 
     sensor_name = sensor_key.split('/')[-2]
-    sensor_configs = [s for s in config.get('sensors')]
-    try:
-        sensor_conf = [s for s in sensor_configs if s.get('id') == sensor_name][0]
-    except IndexError:
+    sensor = get_sensor_config(sensor_name)
+    if not sensor:
         logger.warning(f"No config found for {sensor_name} sensor")
         return 'collection', None
 
+    collection_key = create_stac_collection(repo, sensor)
+    if journal and journal.is_sensor_done(sensor_key):
+        logger.info(f"{sensor_name} collection was completed by a previous run")
+        return 'collection', collection_key
+
+    acquisition_keys = repo.get_acquisition_keys(bucket=S3_BUCKET,
+                                                 acquisition_prefix=sensor_key)
+    item_index = item_index or ItemIndex(repo, bucket=S3_BUCKET, prefix=f"{S3_STAC_PATH}/{sensor_name}/")
+    buffer = collection_buffer or CollectionBuffer(repo, bucket=S3_BUCKET,
+                                                   update_extent=update_collection_on_item,
+                                                   on_flush=journal.collection_committed if journal else None)
+    try:
+        summary = add_stac_items(repo=repo, acquisition_keys=acquisition_keys,
+                                 update_collection_on_item=update_collection_on_item,
+                                 max_workers=max_workers, collection_buffer=buffer.start(),
+                                 item_index=item_index, journal=journal)
+    finally:
+        flushed = buffer.flush(collection_key)
+        if not collection_buffer:
+            buffer.close()
+    logger.info(f"{sensor_name} collection: {len(summary['added'])} items added, "
+                f"{len(summary['failed'])} failed")
+    if journal and flushed and not summary['failed']:
+        journal.sensor_done(sensor_key)
+    probe_cache = get_probe_cache()
+    if probe_cache:
+        logger.info(f"Probe cache: {probe_cache.stats()}")
+
+    if not flushed:
+        # The items exist without their links, the message has to be processed again
+        logger.error(f"Could not write the item links of {collection_key}")
+        return 'collection', None
+    return 'collection', collection_key
+
+
+def get_item_key(acquisition_key: str) -> str:
+    """Return the key of the item of an acquisition, stored in the collection of its sensor."""
+    _, _, sensor_name, item_id = acquisition_key.split('/')[:4]
+    return f"{S3_STAC_PATH}/{sensor_name}/{item_id}/{item_id}.json"
+
+
+def create_stac_collection(repo: S3Repository, sensor: SensorConfig) -> str:
+    """
+    Create the collection of the sensor, and link it to the catalog, unless it exists.
+
+    :return: key of the collection.json.
+    """
+    sensor_name = sensor.id
+    sensor_conf = sensor.config
     collection_key = f"{S3_STAC_PATH}/{sensor_name}/collection.json"
     try:
         repo.get_dict(bucket=S3_BUCKET, key=collection_key)
@@ -71,147 +115,204 @@ def add_stac_collection(repo: S3Repository, sensor_key: str, update_collection_o
             bands_metadata=sensor_conf.get('extensions').get('eo').get('bands')
         )
 
-        catalog.add_child(collection)
-        catalog.normalize_hrefs(f"{S3_HREF}/{S3_STAC_PATH}")
+        def add_collection_link(catalog_dict: dict) -> dict:
+            if catalog_dict:
+                catalog = Catalog.from_dict(catalog_dict)
+            else:
+                logger.info(f"No catalog found in {S3_CATALOG_KEY}")
+                logger.info("Creating new catalog...")
+                catalog = Catalog(
+                    id=config.get('id'),
+                    title=config.get('title'),
+                    description=config.get('description'),
+                    stac_extensions=config.get('stac_extensions')
+                )
+            # Attach the collection even when linked meanwhile, so it gets its self, root and parent links
+            catalog.remove_child(collection.id)
+            catalog.add_child(collection)
+            catalog.normalize_hrefs(f"{S3_HREF}/{S3_STAC_PATH}")
+            return catalog.to_dict()
 
         # TODO: Replace STAC_IO.write_text_method
-        repo.add_json_from_dict(
-            bucket=S3_BUCKET,
-            key=S3_CATALOG_KEY,
-            stac_dict=catalog.to_dict()
-        )
+        repo.update_dict(bucket=S3_BUCKET, key=S3_CATALOG_KEY, update=add_collection_link)
 
-        repo.add_json_from_dict(
-            bucket=S3_BUCKET,
-            key=collection_key,
-            stac_dict=collection.to_dict()
-        )
-        logger.info(f"{sensor_name} collection added to {S3_CATALOG_KEY}")
-
-    acquisition_keys = repo.get_acquisition_keys(bucket=S3_BUCKET,
-                                                 acquisition_prefix=sensor_key)
-    for acquisition_key in acquisition_keys:
         try:
-            add_stac_item(repo=repo, acquisition_key=acquisition_key,
-                          update_collection_on_item=update_collection_on_item)
-        except Exception as e:
-            logger.warning(f"could not add {acquisition_key}: {e}")
+            repo.put_dict(
+                bucket=S3_BUCKET,
+                key=collection_key,
+                stac_dict=collection.to_dict(),
+                if_none_match='*'
+            )
+            logger.info(f"{sensor_name} collection added to {S3_CATALOG_KEY}")
+        except PreconditionFailedError:
+            logger.info(f"Collection {sensor_name} was created in {collection_key} meanwhile")
+    return collection_key
+
+
+def add_stac_items(repo: S3Repository, acquisition_keys: list, update_collection_on_item: bool = True,
+                   max_workers: int = None, collection_buffer: CollectionBuffer = None,
+                   item_index: ItemIndex = None, journal: BackfillJournal = None) -> dict:
+    """
+    Add the given acquisitions as STAC items using a pool of worker threads.
+    A failing acquisition is logged and does not stop the others.
+
+    :param repo: S3 repository
+    :param acquisition_keys: acquisition prefixes to add
+    :param update_collection_on_item: update the collection extent on every item
+    :param max_workers: size of the worker pool, defaults to STAC_MAX_WORKERS
+    :param collection_buffer: buffer the item links are written through
+    :param item_index: index of the items already in the collection
+    :param journal: journal recording the added acquisitions, those it records as done are skipped
+
+    :return: dict with the 'added' and 'failed' acquisition keys, and the 'item_keys' by added acquisition.
+    """
+    summary = {'added': [], 'failed': [], 'item_keys': {}}
+    if journal:
+        acquisition_keys = [key for key in acquisition_keys if not journal.is_done(key)]
+    if not acquisition_keys:
+        return summary
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or get_max_workers())
+    try:
+        futures = {
+            executor.submit(add_stac_item, repo=repo, acquisition_key=acquisition_key,
+                            update_collection_on_item=update_collection_on_item,
+                            collection_buffer=collection_buffer, item_index=item_index,
+                            journal=journal): acquisition_key
+            for acquisition_key in acquisition_keys
+        }
+        for future in as_completed(futures):
+            acquisition_key = futures[future]
+            try:
+                _, item_key = future.result()
+            except Exception as e:
+                logger.warning(f"could not add {acquisition_key}: {e}")
+                item_key = None
+            summary['added' if item_key else 'failed'].append(acquisition_key)
+            if item_key:
+                summary['item_keys'][acquisition_key] = item_key
+                if journal:
+                    journal.acquisition_done(acquisition_key)
+    finally:
+        # On shutdown drop the queued acquisitions, only the running ones are finished
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if summary['failed']:
+        logger.warning(f"Could not add {len(summary['failed'])} acquisitions: {summary['failed']}")
+    return summary
+
+
+def add_stac_item_batch(repo: S3Repository, acquisition_keys: List[str], collection_buffer: CollectionBuffer,
+                        item_index: ItemIndex = None) -> List[Optional[Tuple[str, str]]]:
+    """
+    Add a batch of acquisitions and write their item links with one write per collection.
+
+    As with flush_collection, the items are linked before being written, so a
+    message retried after a failed collection write finds its item missing.
+
+    :param repo: S3 repository
+    :param acquisition_keys: acquisition prefixes to add
+    :param collection_buffer: buffer the item links are written through
+    :param item_index: index of the items already in the collection
+
+    :return: ('item', item_key) by acquisition key, in order, or None for the acquisitions not added.
+    """
+    STAC_IO.read_text_method = repo.stac_read_method
+    with ThreadPoolExecutor(max_workers=get_max_workers()) as executor:
+        built = dict(zip(acquisition_keys, executor.map(
+            partial(_build_batch_item, repo, collection_buffer=collection_buffer, item_index=item_index),
+            acquisition_keys
+        )))
+
+        new_items = {key: result for key, result in built.items() if result and result[2]}
+        for _, collection_key, item in new_items.values():
+            collection_buffer.add_item(collection_key, item)
+        flushed = {collection_key: collection_buffer.flush(collection_key)
+                   for collection_key in {result[1] for result in new_items.values()}}
+        for collection_key in [key for key, ok in flushed.items() if not ok]:
+            logger.error(f"Could not write {collection_key}, could not add its items.")
+
+        def write_item(acquisition_key: str) -> bool:
+            item_key, collection_key, item = new_items[acquisition_key]
+            try:
+                repo.add_json_from_dict(bucket=S3_BUCKET, key=item_key, stac_dict=item.to_dict())
+            except Exception as e:
+                logger.error(f"Could not write {item_key}: {e}")
+                return False
+            if item_index is not None:
+                item_index.add(item_key)
+            logger.info(f"{item.id} item added to {collection_key}")
+            return True
 
-    return 'collection', collection_key
+        to_write = [key for key, result in new_items.items() if flushed[result[1]]]
+        written = {key for key, ok in zip(to_write, executor.map(write_item, to_write)) if ok}
+
+    return [('item', built[key][0]) if built[key] and (not built[key][2] or key in written) else None
+            for key in acquisition_keys]
 
 
-def add_stac_item(repo: S3Repository, acquisition_key: str, update_collection_on_item: bool = True):
+def _build_batch_item(repo: S3Repository, acquisition_key: str, collection_buffer: CollectionBuffer,
+                      item_index: ItemIndex = None) -> Optional[Tuple[str, str, Optional[SacItem]]]:
+    # Item key, collection key and item of an acquisition, without an item when it exists already
+    try:
+        collection_key = f"{S3_STAC_PATH}/{acquisition_key.split('/')[2]}/collection.json"
+        collection = collection_buffer.get_collection(collection_key)
+        item_id = acquisition_key.split('/')[3]
+        item_key = f"{S3_STAC_PATH}/{collection.id}/{item_id}/{item_id}.json"
+        if item_exists(repo, item_key, item_index):
+            logger.info(f"Item {item_id} already exists in {item_key}")
+            return item_key, collection_key, None
+        return item_key, collection_key, build_stac_item(repo, acquisition_key,
+                                                         sensor=get_sensor_config(collection.id))
+    except Exception as e:
+        logger.error(f"Could not add {acquisition_key}: {e}")
+        return None
+
+
+def add_stac_item(repo: S3Repository, acquisition_key: str, update_collection_on_item: bool = True,
+                  collection_buffer: CollectionBuffer = None, item_index: ItemIndex = None,
+                  flush_collection: bool = False, journal: BackfillJournal = None):
+    # The same acquisition may come from a collection and an item message at once, build it once
+    result = _items_in_flight.run(acquisition_key, partial(
+        _add_stac_item, repo, acquisition_key, update_collection_on_item=update_collection_on_item,
+        collection_buffer=collection_buffer, item_index=item_index, flush_collection=flush_collection,
+        journal=journal
+    ))
+    if flush_collection and collection_buffer and result and result[1]:
+        # Built by another caller that may not have written the collection yet
+        if not collection_buffer.flush(f"{S3_STAC_PATH}/{acquisition_key.split('/')[2]}/collection.json"):
+            return 'item', None
+    return result
+
+
+def _add_stac_item(repo: S3Repository, acquisition_key: str, update_collection_on_item: bool = True,
+                   collection_buffer: CollectionBuffer = None, item_index: ItemIndex = None,
+                   flush_collection: bool = False, journal: BackfillJournal = None):
     logger.info(
         f"S3 Repository: {repo}, acquisition_key: {acquisition_key}, update_collection_on_item: {update_collection_on_item}")
     STAC_IO.read_text_method = repo.stac_read_method
-    region = acquisition_key.split('/')[1]
     sensor_name = acquisition_key.split('/')[2]
 
     collection_key = f"{S3_STAC_PATH}/{sensor_name}/collection.json"
     logger.debug(f"[Item] Adding {acquisition_key} item to {sensor_name}...")
 
+    # Without a shared buffer the collection is written straight away
+    buffer = collection_buffer or CollectionBuffer(repo, bucket=S3_BUCKET,
+                                                   update_extent=update_collection_on_item, max_items=1)
+
     try:
-        collection_dict = repo.get_dict(bucket=S3_BUCKET, key=collection_key)
-        collection = SacCollection.from_dict(collection_dict)
+        collection = buffer.get_collection(collection_key)
 
         item_id = acquisition_key.split('/')[3]
         item_key = f"{S3_STAC_PATH}/{collection.id}/{item_id}/{item_id}.json"
-        try:
-            repo.get_dict(bucket=S3_BUCKET, key=item_key)
+        if item_exists(repo, item_key, item_index):
             logger.info(f"Item {item_id} already exists in {item_key}")
-        except Exception:
-            sensor_conf = [s for s in config.get('sensors') if s.get('id') == collection.id][0]
-            logger.debug(f"[Item] Creating {item_id} item...")
-            # Get date from acquisition name
-            date = obtain_date_from_filename(
-                file=acquisition_key,
-                regex=sensor_conf.get('formatting').get('date').get('regex'),
-                date_format=sensor_conf.get('formatting').get('date').get('format')
-            )
-
-            # Get sample product and extract geometry
-            try:
-                product_sample_key = repo.get_smallest_product_key(
-                    bucket=S3_BUCKET,
-                    products_prefix=acquisition_key
-                )
-                geometry, crs = get_geometry_from_cog(cog_key=product_sample_key, s3_repository=repo)
-            except Exception:
-                logger.error(f"No bands found on {acquisition_key} acquisition.")
-                raise
-
-            item = SacItem(
-                id=Path(acquisition_key).name,
-                datetime=date,
-                geometry=create_geom(geometry, crs),
-                bbox=list(geometry.bounds),
-                properties={}
-            )
-
-            item.ext.enable('projection')
-            item.ext.projection.epsg = GENERIC_EPSG
-
-            item.add_extensions(sensor_conf.get('extensions'))
-            item.add_common_metadata(sensor_conf.get('common_metadata'))
-            bands_metadata = sensor_conf.get('extensions').get('eo').get('bands')
-            product_keys = repo.get_product_keys(bucket=S3_BUCKET, products_prefix=acquisition_key)
-
-            for band_name, band_common_name in [(b.get('name'), b.get('common_name')) for b in bands_metadata]:
-                asset_href = ''
-                proj_shp = [0, 0]
-                proj_tran = [0, 0, 0, 0, 0, 0]
-
-                band_name_in_product_keys = [p for p in product_keys if re.search(band_name, p, re.IGNORECASE)]
-                # logging.info(f"Band name in product keys: {band_name_in_product_keys}")
-
-                if band_name_in_product_keys:
-                    product_key = band_name_in_product_keys[0]
-                    asset_href = f"{S3_HREF}/{product_key}"
-                    proj_shp, proj_tran = get_projection_from_cog(cog_key=product_key, s3_repository=repo)
-                else:
-                    logger.warning(f"No band matching \"{band_name}\" found on {collection.id}/{item.id} acquisition.")
-                    raise NoObjectError
-                    return
-
-                asset = Asset(
-                    href=asset_href,
-                    media_type="image/tiff; application=geotiff; profile=cloud-optimized",
-                )
-
-                # Set Projection
-                item.ext.projection.set_transform(proj_tran, asset)
-                item.ext.projection.set_shape(proj_shp, asset)
-
-                # Set bands
-                item.ext.eo.set_bands([Band.create(
-                    name=band_common_name, common_name=band_common_name)],
-                    asset
-                )
-                logger.debug(f"[Asset] Adding {asset_href} asset to {acquisition_key}...")
-                item.add_asset(key=band_common_name, asset=asset)
-
-            if sensor_conf.get('extensions').get('odc'):
-                item.ext.enable('odc')
-                item.ext.odc.region_code = get_iso(region)
-            
-            collection.add_item(item)
-
-            if update_collection_on_item:
-                collection.update_extent_from_items()
-                collection.normalize_hrefs(f"{S3_HREF}/{S3_STAC_PATH}/{collection.id}")
-
-            repo.add_json_from_dict(
-                bucket=S3_BUCKET,
-                key=collection_key,
-                stac_dict=collection.to_dict()
-            )
-            repo.add_json_from_dict(
-                bucket=S3_BUCKET,
-                key=item_key,
-                stac_dict=item.to_dict()
-            )
-            logger.info(f"{item.id} item added to {collection.id}")
-
+        else:
+            item = build_stac_item(repo, acquisition_key, sensor=get_sensor_config(collection.id))
+            if not commit_stac_item(repo, item, item_key=item_key, collection_key=collection_key,
+                                    collection_buffer=buffer, item_index=item_index,
+                                    flush_collection=flush_collection, journal=journal):
+                return 'item', None
 
         return 'item', item_key
 
@@ -231,15 +332,171 @@ def add_stac_item(repo: S3Repository, acquisition_key: str, update_collection_on
         return 'item', None
 
 
+def build_stac_item(repo: S3Repository, acquisition_key: str, sensor: SensorConfig) -> SacItem:
+    """
+    Build the item of an acquisition from its products, without writing anything.
+
+    :raises NoObjectError: when the acquisition lacks a band of the sensor
+    :return: the item, not linked to its collection yet.
+    """
+    item, (geometry, crs) = build_stac_item_with_footprint(repo, acquisition_key, sensor)
+    item.geometry = create_geom(geometry, crs)
+    return item
+
+
+def build_stac_item_with_footprint(repo: S3Repository, acquisition_key: str,
+                                   sensor: SensorConfig) -> Tuple[SacItem, tuple]:
+    """
+    Build the item of an acquisition as build_stac_item does, leaving its
+    geometry to be set, so the footprints of many items can be reprojected at once.
+
+    :raises NoObjectError: when the acquisition lacks a band of the sensor
+    :return: the item without a geometry, and the (geometry, crs) footprint of the acquisition.
+    """
+    region = acquisition_key.split('/')[1]
+    item_id = acquisition_key.split('/')[3]
+    sensor_conf = sensor.config
+    logger.debug(f"[Item] Creating {item_id} item...")
+    # Get date from acquisition name
+    date = obtain_date_from_filename(
+        file=acquisition_key,
+        regex=sensor.date_regex,
+        date_format=sensor.date_format
+    )
+
+    # COG headers read while building this item
+    probes = {}
+
+    # Get sample product and extract geometry
+    try:
+        manifest = repo.get_acquisition_manifest(bucket=S3_BUCKET, acquisition_prefix=acquisition_key)
+        product_sample_key = manifest.smallest_product_key()
+        geometry, crs = get_geometry_from_cog(cog_key=product_sample_key, s3_repository=repo,
+                                              cache=probes, etag=manifest.get(product_sample_key).etag)
+    except Exception:
+        logger.error(f"No bands found on {acquisition_key} acquisition.")
+        raise
+
+    item = SacItem(
+        id=Path(acquisition_key).name,
+        datetime=date,
+        geometry=None,
+        bbox=list(geometry.bounds),
+        properties={}
+    )
+
+    item.ext.enable('projection')
+    item.ext.projection.epsg = GENERIC_EPSG
+
+    item.add_extensions(sensor_conf.get('extensions'))
+    item.add_common_metadata(sensor_conf.get('common_metadata'))
+    band_products = manifest.assign_bands(sensor.band_pattern, [name for name, _ in sensor.bands])
+
+    for band_name, band_common_name in sensor.bands:
+        asset_href = ''
+        proj_shp = [0, 0]
+        proj_tran = [0, 0, 0, 0, 0, 0]
+
+        product_key = band_products.get(band_name)
+
+        if product_key:
+            asset_href = f"{S3_HREF}/{product_key}"
+            proj_shp, proj_tran = get_projection_from_cog(cog_key=product_key, s3_repository=repo,
+                                                         cache=probes, etag=manifest.get(product_key).etag)
+        else:
+            logger.warning(f"No band matching \"{band_name}\" found on {sensor.id}/{item.id} acquisition.")
+            raise NoObjectError
+
+        asset = Asset(
+            href=asset_href,
+            media_type="image/tiff; application=geotiff; profile=cloud-optimized",
+        )
+
+        # Set Projection
+        item.ext.projection.set_transform(proj_tran, asset)
+        item.ext.projection.set_shape(proj_shp, asset)
+
+        # Set bands
+        item.ext.eo.set_bands([Band.create(
+            name=band_common_name, common_name=band_common_name)],
+            asset
+        )
+        logger.debug(f"[Asset] Adding {asset_href} asset to {acquisition_key}...")
+        item.add_asset(key=band_common_name, asset=asset)
+
+    if sensor_conf.get('extensions').get('odc'):
+        item.ext.enable('odc')
+        item.ext.odc.region_code = get_iso(region)
+
+    return item, (geometry, crs)
+
+
+def commit_stac_item(repo: S3Repository, item: SacItem, item_key: str, collection_key: str,
+                     collection_buffer: CollectionBuffer, item_index: ItemIndex = None,
+                     flush_collection: bool = False, journal: BackfillJournal = None) -> bool:
+    """
+    Link the item to its collection through the buffer and write its JSON.
+
+    :param flush_collection: write the collection link before the item
+    :param journal: journal recording the item until its collection link is written
+    :return: whether the item was written.
+    """
+    collection_buffer.add_item(collection_key, item)
+    # Link the item before writing it, so a retried message finds it missing
+    if flush_collection and not collection_buffer.flush(collection_key):
+        logger.error(f"Could not write {collection_key}, could not add {item.id}.")
+        return False
+
+    if journal:
+        journal.item_started(collection_key, item.id, item_key)
+    repo.add_json_from_dict(
+        bucket=S3_BUCKET,
+        key=item_key,
+        stac_dict=item.to_dict()
+    )
+    if item_index is not None:
+        item_index.add(item_key)
+    logger.info(f"{item.id} item added to {collection_key}")
+    return True
+
+
+def replay_collection_commits(repo: S3Repository, journal: BackfillJournal,
+                              collection_buffer: CollectionBuffer) -> int:
+    """
+    Link the items a previous run wrote to their collections, when the run
+    stopped before writing the links. Items journaled but never written are
+    left to the acquisitions, which are not done either.
+
+    :return: number of items linked.
+    """
+    STAC_IO.read_text_method = repo.stac_read_method
+    linked = 0
+    for collection_key, item_keys in journal.pending_commits().items():
+        for item_key in item_keys:
+            try:
+                item = Item.from_dict(repo.get_dict(bucket=S3_BUCKET, key=item_key))
+            except NoObjectError:
+                logger.info(f"{item_key} was not written before the run stopped, not linking it")
+                continue
+            except Exception as e:
+                logger.warning(f"Could not read {item_key} to link it to {collection_key}: {e}")
+                continue
+            collection_buffer.add_item(collection_key, item)
+            linked += 1
+        collection_buffer.flush(collection_key)
+    logger.info(f"Replayed the collection links of {linked} items")
+    return linked
+
+
+def item_exists(repo: S3Repository, item_key: str, item_index: ItemIndex = None) -> bool:
+    if item_index is not None:
+        return item_key in item_index
+    try:
+        repo.get_dict(bucket=S3_BUCKET, key=item_key)
+        return True
+    except Exception:
+        return False
+
+
 def create_geom(geometry, crs):
-    if isinstance(geometry, Polygon):
-        poly = GeoSeries([geometry.exterior], crs=crs).to_crs(GENERIC_EPSG).to_json()
-        result = json.loads(poly)
-        geom = result.get('features')[0].get('geometry')
-        geom['type'] = 'Polygon'
-        geom["coordinates"] = [geom["coordinates"]]
-        return geom
-    else:
-        poly = GeoSeries([geometry], crs=crs).to_crs(GENERIC_EPSG).to_json()
-        result = json.loads(poly)
-        return result.get('features')[0].get('geometry')
+    return reproject_geometry(geometry, crs, target_epsg=GENERIC_EPSG)
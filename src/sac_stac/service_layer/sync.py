@@ -0,0 +1,286 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pystac import Extent, Item, STAC_IO
+
+from sac_stac.adapters.repository import S3Repository
+from sac_stac.domain.manifest import AcquisitionManifest
+from sac_stac.domain.model import compute_extent
+from sac_stac.domain.s3 import NoObjectError, ObjectRecord
+from sac_stac.load_config import get_collection_lease_configuration, get_max_workers, get_s3_configuration, \
+    get_sensor_config
+from sac_stac.service_layer import services
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.collection_lease import CollectionLease
+
+logger = logging.getLogger(__name__)
+
+s3_config = get_s3_configuration()
+
+S3_BUCKET = s3_config["bucket"]
+S3_STAC_PATH = s3_config["stac_path"]
+S3_IMAGERY_PATH = s3_config["imagery_path"]
+SYNC_STATE_KEY = f"{S3_STAC_PATH}/sync_state.json"
+
+
+class SyncPlan(NamedTuple):
+    """Delta between the imagery and the catalog."""
+    # Imagery objects and their fingerprint by acquisition key, for the sensors with a config
+    acquisitions: Dict[str, List[ObjectRecord]]
+    fingerprints: Dict[str, str]
+    # Acquisition keys without an item, with an item older than their imagery, and up to date
+    added: List[str]
+    changed: List[str]
+    unchanged: List[str]
+    # Item keys of the acquisitions synced last time under the imagery prefix, whose imagery is gone
+    removed: List[str]
+    # Item records, and catalog and collection records, by key
+    items: Dict[str, ObjectRecord]
+    documents: Dict[str, ObjectRecord]
+    # Prefix the acquisitions were listed under, and the fingerprints saved by the last sync of every prefix
+    imagery_prefix: str = ''
+    synced: Dict[str, str] = None
+
+
+def list_acquisitions(repo: S3Repository, bucket: str, imagery_prefix: str) -> Dict[str, List[ObjectRecord]]:
+    """List the imagery objects under imagery_prefix, by acquisition key, in one listing."""
+    acquisitions = {}
+    for record in repo.get_object_records(bucket=bucket, prefix=imagery_prefix):
+        parts = record.key[len(imagery_prefix):].split('/')
+        if len(parts) < 3 or not get_sensor_config(parts[0]):
+            continue
+        acquisitions.setdefault(f"{imagery_prefix}{parts[0]}/{parts[1]}/", []).append(record)
+    return acquisitions
+
+
+def list_catalog(repo: S3Repository, bucket: str,
+                 stac_prefix: str) -> Tuple[Dict[str, ObjectRecord], Dict[str, ObjectRecord]]:
+    """
+    List the JSON documents under stac_prefix in one listing.
+
+    :return: the item records, and the catalog and collection records, by key.
+    """
+    items, documents = {}, {}
+    for record in repo.get_object_records(bucket=bucket, prefix=f"{stac_prefix}/", suffix='.json'):
+        parts = record.key[len(stac_prefix) + 1:].split('/')
+        if len(parts) == 3 and parts[2] == f"{parts[1]}.json" and get_sensor_config(parts[0]):
+            items[record.key] = record
+        elif parts in (['catalog.json'], [parts[0], 'collection.json']):
+            documents[record.key] = record
+    return items, documents
+
+
+def get_sync_state(repo: S3Repository, bucket: str) -> Dict[str, str]:
+    """Return the fingerprints of the acquisitions by the last sync."""
+    try:
+        return repo.get_dict(bucket=bucket, key=SYNC_STATE_KEY).get('acquisitions', {})
+    except NoObjectError:
+        return {}
+
+
+def plan_sync(repo: S3Repository, bucket: str = None, imagery_prefix: str = None, use_state: bool = True) -> SyncPlan:
+    """
+    Compare the imagery with the catalog, from a listing of each done in parallel.
+
+    An acquisition changed when its fingerprint differs from the one saved by the
+    last sync or, before a first sync, when its imagery is newer than its item.
+
+    The catalog is shared by the imagery prefixes (regions) while item keys do
+    not hold the prefix, so the only items planned for removal are those of the
+    acquisitions the last sync saw under imagery_prefix. Nothing is planned for
+    removal when the listing finds no acquisition, as with a wrong prefix.
+
+    :param repo: S3 repository
+    :param bucket: bucket holding the imagery and the catalog, defaults to S3_BUCKET
+    :param imagery_prefix: prefix the sensor folders are under, defaults to S3_IMAGERY_PATH
+    :param use_state: compare with the fingerprints of the last sync, otherwise only the listings are read
+    """
+    bucket = bucket or S3_BUCKET
+    imagery_prefix = imagery_prefix or S3_IMAGERY_PATH
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        acquisitions = executor.submit(list_acquisitions, repo, bucket, imagery_prefix)
+        catalog = executor.submit(list_catalog, repo, bucket, S3_STAC_PATH)
+        state = executor.submit(get_sync_state, repo, bucket) if use_state else None
+        acquisitions, (items, documents) = acquisitions.result(), catalog.result()
+        state = state.result() if state else {}
+
+    manifests = {key: AcquisitionManifest(prefix=key, records=records) for key, records in acquisitions.items()}
+    fingerprints = {key: manifest.fingerprint for key, manifest in manifests.items()}
+    added, changed, unchanged = [], [], []
+    for acquisition_key, manifest in manifests.items():
+        item = items.get(services.get_item_key(acquisition_key))
+        if not item:
+            added.append(acquisition_key)
+        elif _is_changed(manifest, state.get(acquisition_key), item):
+            changed.append(acquisition_key)
+        else:
+            unchanged.append(acquisition_key)
+
+    removed = []
+    if acquisitions:
+        item_keys = {services.get_item_key(acquisition_key) for acquisition_key in acquisitions}
+        gone = {services.get_item_key(acquisition_key) for acquisition_key in state
+                if acquisition_key.startswith(imagery_prefix) and acquisition_key not in acquisitions}
+        removed = sorted(item_key for item_key in gone if item_key in items and item_key not in item_keys)
+    else:
+        logger.warning(f"No acquisition found under {imagery_prefix}, no item will be pruned")
+    return SyncPlan(acquisitions=acquisitions, fingerprints=fingerprints, added=added, changed=changed,
+                    unchanged=unchanged, removed=removed, items=items, documents=documents,
+                    imagery_prefix=imagery_prefix, synced=state)
+
+
+def sync(repo: S3Repository, max_workers: int = None, prune: bool = False, plan: SyncPlan = None) -> dict:
+    """
+    Bring the catalog up to date with the imagery: add the items of new
+    acquisitions, rebuild those of changed ones and, when asked to, prune those
+    whose imagery is gone. The fingerprints of the synced acquisitions are saved
+    for the next sync.
+
+    :param repo: S3 repository
+    :param max_workers: size of the worker pool, defaults to STAC_MAX_WORKERS
+    :param prune: remove the items whose imagery is gone, see plan_sync
+    :param plan: delta to apply, planned from the current listings by default
+
+    :return: dict with the 'added', 'changed' and 'failed' acquisition keys, and the 'removed' item keys.
+    """
+    STAC_IO.read_text_method = repo.stac_read_method
+    plan = plan or plan_sync(repo)
+    logger.info(f"Sync: {len(plan.added)} added, {len(plan.changed)} changed, {len(plan.removed)} removed "
+                f"and {len(plan.unchanged)} unchanged acquisitions")
+    summary = {'added': [], 'changed': [], 'removed': [], 'failed': []}
+
+    acquisition_keys = plan.added + plan.changed
+    collection_keys = {
+        sensor_name: services.create_stac_collection(repo, get_sensor_config(sensor_name))
+        for sensor_name in sorted({key.split('/')[2] for key in acquisition_keys})
+    }
+    added = set(plan.added)
+
+    def rebuild(acquisition_key: str) -> bool:
+        sensor_name = acquisition_key.split('/')[2]
+        item = services.build_stac_item(repo, acquisition_key, sensor=get_sensor_config(sensor_name))
+        # The link of a changed item is already in its collection, only its extent is extended
+        return services.commit_stac_item(repo, item, item_key=services.get_item_key(acquisition_key),
+                                         collection_key=collection_keys[sensor_name], collection_buffer=buffer)
+
+    buffer = CollectionBuffer(repo, bucket=S3_BUCKET).start()
+    executor = ThreadPoolExecutor(max_workers=max_workers or get_max_workers())
+    try:
+        futures = {executor.submit(rebuild, acquisition_key): acquisition_key for acquisition_key in acquisition_keys}
+        for future in as_completed(futures):
+            acquisition_key = futures[future]
+            try:
+                synced = future.result()
+            except Exception as e:
+                logger.warning(f"Could not sync {acquisition_key}: {e}")
+                synced = False
+            summary[('added' if acquisition_key in added else 'changed') if synced else 'failed'].append(
+                acquisition_key)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        buffer.close()
+
+    if prune and plan.removed:
+        summary['removed'] = prune_items(repo, plan.removed)
+
+    # Acquisitions left unsynced get an empty fingerprint, so the next sync retries them
+    failed = set(summary['failed']) if not buffer.pending() else set(acquisition_keys)
+    # The state is shared by the imagery prefixes, those of the others are kept, and so are
+    # the removed acquisitions whose items were not pruned, for a later sync to prune them.
+    # A prefix listing nothing tells nothing either, its acquisitions are kept as they were
+    kept = set(plan.removed) - set(summary['removed'])
+    state = {key: fingerprint for key, fingerprint in (plan.synced or {}).items()
+             if not key.startswith(plan.imagery_prefix) or not plan.acquisitions
+             or services.get_item_key(key) in kept}
+    state.update({key: '' if key in failed else fingerprint for key, fingerprint in plan.fingerprints.items()})
+    repo.add_json_from_dict(bucket=S3_BUCKET, key=SYNC_STATE_KEY, stac_dict={'acquisitions': state})
+
+    logger.info(f"Sync: {len(summary['added'])} items added, {len(summary['changed'])} rebuilt, "
+                f"{len(summary['removed'])} pruned, {len(summary['failed'])} failed")
+    return summary
+
+
+def prune_items(repo: S3Repository, item_keys: List[str]) -> List[str]:
+    """
+    Remove the items from their collections, shrinking the collection extents
+    to the items left, then delete them.
+
+    :return: the item keys removed.
+    """
+    item_keys_by_collection = {}
+    for item_key in item_keys:
+        collection_key = f"{item_key.rsplit('/', 2)[0]}/collection.json"
+        item_keys_by_collection.setdefault(collection_key, []).append(item_key)
+
+    pruned = []
+    for collection_key, collection_item_keys in item_keys_by_collection.items():
+        item_hrefs = tuple('/' + '/'.join(item_key.split('/')[-2:]) for item_key in collection_item_keys)
+        # Items left are read once, even when the update is retried
+        items: Dict[str, Optional[Item]] = {}
+
+        def remove_item_links(collection_dict: Optional[dict]) -> dict:
+            if collection_dict is None:
+                raise NoObjectError(f'Nothing found with {collection_key} in {S3_BUCKET} bucket')
+            collection_dict['links'] = [link for link in collection_dict.get('links', [])
+                                        if link.get('rel') != 'item' or not link.get('href', '').endswith(item_hrefs)]
+            extent = get_items_extent(repo, collection_key, collection_dict['links'], items)
+            if extent:
+                collection_dict['extent'] = extent.to_dict()
+            return collection_dict
+
+        try:
+            if get_collection_lease_configuration()["enabled"]:
+                with CollectionLease(repo, bucket=S3_BUCKET, collection_key=collection_key):
+                    repo.update_dict(bucket=S3_BUCKET, key=collection_key, update=remove_item_links)
+            else:
+                repo.update_dict(bucket=S3_BUCKET, key=collection_key, update=remove_item_links)
+        except Exception as e:
+            logger.error(f"Could not remove {len(collection_item_keys)} items from {collection_key}: {e}")
+            continue
+
+        # Unlinked first, so the catalog never links a deleted item
+        for item_key in collection_item_keys:
+            repo.delete_object(bucket=S3_BUCKET, key=item_key)
+            pruned.append(item_key)
+        logger.info(f"Pruned {len(collection_item_keys)} items from {collection_key}")
+    return pruned
+
+
+def get_items_extent(repo: S3Repository, collection_key: str, links: List[dict],
+                     items: Dict[str, Optional[Item]] = None) -> Optional[Extent]:
+    """
+    Return the extent covering the items linked from the collection.
+
+    :param links: links of the collection
+    :param items: items already read by key, completed with those read here
+    :return: Extent or None when no item could be read.
+    """
+    items = {} if items is None else items
+    collection_prefix = collection_key.rsplit('/', 1)[0]
+    item_keys = [f"{collection_prefix}/{'/'.join(link['href'].split('/')[-2:])}"
+                 for link in links if link.get('rel') == 'item']
+
+    def read_item(item_key: str) -> Optional[Item]:
+        try:
+            return Item.from_dict(repo.get_dict(bucket=S3_BUCKET, key=item_key))
+        except Exception as e:
+            logger.warning(f"Could not read {item_key} to compute the extent of {collection_key}: {e}")
+            return None
+
+    missing = [item_key for item_key in item_keys if item_key not in items]
+    if missing:
+        with ThreadPoolExecutor(max_workers=get_max_workers()) as executor:
+            items.update(zip(missing, executor.map(read_item, missing)))
+
+    linked = [items[item_key] for item_key in item_keys if items[item_key]]
+    return compute_extent([item.bbox for item in linked], [item.datetime for item in linked])
+
+
+def _is_changed(manifest: AcquisitionManifest, synced_fingerprint: Optional[str], item: ObjectRecord) -> bool:
+    if synced_fingerprint is not None:
+        return manifest.has_changed(synced_fingerprint)
+    # Not synced yet, the imagery changed if it was written after its item
+    modified = [record.last_modified for record in manifest.records if record.last_modified]
+    return bool(modified and item.last_modified and max(modified) > item.last_modified)
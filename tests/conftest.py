@@ -0,0 +1,25 @@
+import pytest
+
+BUCKET = 'public-eo-data'
+STAC_PATH = 'stac_catalogs/cs_stac'
+IMAGERY_PATH = 'common_sensing/fiji/'
+
+
+@pytest.fixture
+def s3_settings(monkeypatch):
+    """
+    Set the S3 constants the service modules read from the environment at import,
+    so tests writing through them do not depend on S3_BUCKET and S3_STAC_PATH being exported.
+    """
+    from sac_stac.adapters import repository
+    from sac_stac.domain import operations
+    from sac_stac.service_layer import services, sync
+
+    for module in (repository, operations, services, sync):
+        monkeypatch.setattr(module, 'S3_BUCKET', BUCKET)
+    for module in (services, sync):
+        monkeypatch.setattr(module, 'S3_STAC_PATH', STAC_PATH)
+    monkeypatch.setattr(services, 'S3_CATALOG_KEY', f"{STAC_PATH}/catalog.json")
+    monkeypatch.setattr(services, 'S3_HREF', f"https://{BUCKET}.{services.S3_ENDPOINT.replace('https://', '')}")
+    monkeypatch.setattr(sync, 'S3_IMAGERY_PATH', IMAGERY_PATH)
+    monkeypatch.setattr(sync, 'SYNC_STATE_KEY', f"{STAC_PATH}/sync_state.json")
@@ -127,3 +127,52 @@ def test_new_stac_item():
     finally:
         shutil.rmtree(f'tests/data/{acquisition_key}')
         os.environ.pop("TEST_ENV")
+
+
+async def client_jetstream(nc, acquisition_key):
+    future = asyncio.Future()
+
+    async def message_handler(msg):
+        data = msg.data.decode()
+        future.set_result(data)
+
+    await nc.subscribe("stac_indexer.*", cb=message_handler)
+    await nc.jetstream().publish("stac_creator.item", acquisition_key.encode())
+    return await asyncio.wait_for(future, 5)
+
+
+@mock_s3
+def test_new_stac_item_jetstream():
+    sensor_name = 'landsat_5'
+    sensor_key = f'common_sensing/fiji/{sensor_name}/'
+    acquisition_key = f'{sensor_key}LT05_L1TP_075073_19920125/'
+    bucket = 'public-eo-data'
+    try:
+        os.environ["TEST_ENV"] = "Yes"
+        os.environ["STAC_JETSTREAM"] = "true"
+
+        s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+
+        shutil.copytree(f'tests/data/test_add_stac_item/{acquisition_key}',
+                        f'tests/data/{acquisition_key}')
+
+        initialise_s3_bucket(sensor_key, s3.s3_resource, bucket)
+        add_stac_s3(sensor_name, s3.s3_resource, bucket)
+
+        repo = repository.S3Repository(s3)
+
+        event_loop = asyncio.new_event_loop()
+        nats_client = NATS()
+
+        event_loop.run_until_complete(run(nats_client, repo, event_loop))
+        item_key = event_loop.run_until_complete(client_jetstream(nats_client, acquisition_key))
+        event_loop.run_until_complete(close_nats(nats_client, event_loop))
+
+        assert item_key == 'stac_catalogs/cs_stac/landsat_5/LT05_L1TP_075073_19920125/LT05_L1TP_075073_19920125.json'
+        collection = repo.get_dict(bucket=bucket, key='stac_catalogs/cs_stac/landsat_5/collection.json')
+        assert any(link.get('href').endswith('LT05_L1TP_075073_19920125.json') for link in collection.get('links'))
+
+    finally:
+        shutil.rmtree(f'tests/data/{acquisition_key}')
+        os.environ.pop("TEST_ENV")
+        os.environ.pop("STAC_JETSTREAM")
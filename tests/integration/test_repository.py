@@ -1,9 +1,11 @@
 import json
+import re
 
 import pytest
 from moto import mock_s3
 from sac_stac.adapters import repository
 from sac_stac.domain.s3 import S3, NoObjectError
+from sac_stac.load_config import get_sensor_config
 from pathlib import Path
 
 from sac_stac.util import load_json
@@ -11,6 +13,10 @@ from sac_stac.util import load_json
 BUCKET = 'public-eo-data'
 
 
+def first_product_key(manifest, band_name):
+    return next((key for key in manifest.product_keys if re.search(band_name, key, re.IGNORECASE)), None)
+
+
 def initialise_cs_bucket(s3_resource, bucket_name):
     s3_resource.create_bucket(Bucket=bucket_name)
     for file in Path('tests/data/common_sensing/fiji/sentinel_2').glob('**/*.tif'):
@@ -158,3 +164,144 @@ def test_add_json_from_dict():
 
     assert resp == 200
     assert catalog == uploaded_catalog
+
+
+@mock_s3
+def test_get_acquisition_manifest():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_cs_bucket(s3_resource=s3.s3_resource, bucket_name=BUCKET)
+    acquisition_prefix = 'common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/'
+
+    repo = repository.S3Repository(s3)
+    manifest = repo.get_acquisition_manifest(bucket=BUCKET, acquisition_prefix=acquisition_prefix)
+
+    assert manifest.product_keys == repo.get_product_keys(bucket=BUCKET, products_prefix=acquisition_prefix)
+    assert manifest.smallest_product_key() == f'{acquisition_prefix}S2A_MSIL2A_20151022T222102_T01KBU_B02_10m.tif'
+
+    sensor = get_sensor_config('sentinel_2')
+    band_names = [name for name, _ in sensor.bands]
+    assigned = manifest.assign_bands(sensor.band_pattern, band_names)
+    assert assigned == {name: first_product_key(manifest, name) for name in band_names
+                        if first_product_key(manifest, name)}
+
+    record = manifest.get(manifest.smallest_product_key())
+    assert record.size > 1
+    assert record.etag
+
+    fingerprint = manifest.fingerprint
+    assert not manifest.has_changed(fingerprint)
+
+    s3.s3_resource.Bucket(BUCKET).put_object(Key=manifest.smallest_product_key(), Body=b'changed')
+    updated = repo.get_acquisition_manifest(bucket=BUCKET, acquisition_prefix=acquisition_prefix)
+    assert updated.has_changed(fingerprint)
+
+
+@mock_s3
+def test_get_acquisition_manifest_does_not_exist():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_cs_bucket(s3_resource=s3.s3_resource, bucket_name=BUCKET)
+
+    repo = repository.S3Repository(s3)
+
+    with pytest.raises(NoObjectError):
+        repo.get_acquisition_manifest(bucket=BUCKET, acquisition_prefix='common_sensing/fiji/sentinel_3/')
+
+
+@mock_s3
+def test_get_item_keys():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    for file in Path('tests/output/sentinel_2').glob('**/*.json'):
+        s3.s3_resource.Bucket(BUCKET).upload_file(
+            Filename=str(file),
+            Key=f"stac_catalogs/cs_stac/sentinel_2/{file.relative_to('tests/output/sentinel_2')}"
+        )
+
+    repo = repository.S3Repository(s3)
+    item_keys = repo.get_item_keys(bucket=BUCKET, collection_prefix='stac_catalogs/cs_stac/sentinel_2/')
+
+    assert item_keys == {
+        'stac_catalogs/cs_stac/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/S2A_MSIL2A_20151022T222102_T01KBU.json',
+        'stac_catalogs/cs_stac/sentinel_2/S2B_MSIL2A_20191023T220919_T01KBA/S2B_MSIL2A_20191023T220919_T01KBA.json',
+        'stac_catalogs/cs_stac/sentinel_2/S2B_MSIL2A_20191023T220919_T01KBB/S2B_MSIL2A_20191023T220919_T01KBB.json'
+    }
+
+
+@mock_s3
+def test_sign_file_reuses_urls():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_cs_bucket(s3_resource=s3.s3_resource, bucket_name=BUCKET)
+    product_key = 'common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/' \
+                  'S2A_MSIL2A_20151022T222102_T01KBU_B02_10m.tif'
+
+    repo = repository.S3Repository(s3)
+    url = repo.sign_file(bucket=BUCKET, key=product_key)
+
+    assert product_key in url
+    assert repo.sign_file(bucket=BUCKET, key=product_key) == url
+
+    # Urls close to their expiry are signed again
+    repo._signed_urls[(BUCKET, product_key)] = (url, 0)
+    repo.sign_file(bucket=BUCKET, key=product_key)
+    assert repo._signed_urls[(BUCKET, product_key)][1] > 0
+
+
+@mock_s3
+def test_update_dict_reapplies_update_on_conflict():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+    key = 'stac_catalogs/cs_stac/landsat_5/collection.json'
+    repo.add_json_from_dict(bucket=BUCKET, key=key, stac_dict={'links': ['a']})
+    calls = []
+
+    def add_link(stored):
+        calls.append(list(stored['links']))
+        if len(calls) == 1:
+            # Another writer gets in between the read and the write
+            repo.add_json_from_dict(bucket=BUCKET, key=key, stac_dict={'links': ['a', 'b']})
+        return {'links': stored['links'] + ['c']}
+
+    updated = repo.update_dict(bucket=BUCKET, key=key, update=add_link)
+
+    assert calls == [['a'], ['a', 'b']]
+    assert updated == {'links': ['a', 'b', 'c']}
+    assert repo.get_dict(bucket=BUCKET, key=key) == updated
+
+
+@mock_s3
+def test_update_dict_creates_document():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+
+    repo.update_dict(bucket=BUCKET, key='catalog.json', update=lambda stored: stored or {'id': 'new'})
+
+    assert repo.get_dict(bucket=BUCKET, key='catalog.json') == {'id': 'new'}
+
+
+@mock_s3
+def test_update_dict_gives_up():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+    repo.add_json_from_dict(bucket=BUCKET, key='catalog.json', stac_dict={'n': 0})
+
+    def always_conflict(stored):
+        repo.add_json_from_dict(bucket=BUCKET, key='catalog.json', stac_dict={'n': stored['n'] + 1})
+        return stored
+
+    with pytest.raises(repository.PreconditionFailedError):
+        repo.update_dict(bucket=BUCKET, key='catalog.json', update=always_conflict, retries=2)
+
+
+@mock_s3
+def test_update_dict_raises_when_not_written():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+    # S3.put_object logs the errors other than a failed condition and returns None
+    s3.put_object = lambda **kwargs: None
+
+    with pytest.raises(repository.WriteFailedError):
+        repo.update_dict(bucket=BUCKET, key='catalog.json', update=lambda stored: {'id': 'new'}, verify=False)
@@ -0,0 +1,78 @@
+import json
+
+from moto.s3 import mock_s3
+from pystac import Item
+from rasterio.crs import CRS
+from shapely.geometry import box
+from sac_stac.adapters import repository
+from sac_stac.domain.s3 import NoObjectError, S3
+from sac_stac.service_layer import backfill, services
+
+ITEM_PATH = 'tests/output/landsat_5/LT05_L1TP_075073_19911225/LT05_L1TP_075073_19911225.json'
+
+
+def fake_build_stac_item_with_footprint(repo, acquisition_key, sensor):
+    acquisition_name = acquisition_key.split('/')[-2]
+    if acquisition_name.endswith('bad'):
+        raise NoObjectError(f'{acquisition_name} misses a band')
+    with open(ITEM_PATH) as f:
+        item_dict = json.load(f)
+    item_dict['id'] = acquisition_name
+    item_dict['links'] = []
+    item_dict['geometry'] = None
+    return Item.from_dict(item_dict), (box(500000, 8000000, 600000, 8100000), CRS.from_epsg(32760))
+
+
+def test_shard_acquisitions():
+    acquisition_keys = [f'common_sensing/fiji/{sensor}/acquisition_{i}/'
+                        for sensor in ('landsat_5', 'sentinel_2') for i in range(100)]
+
+    sharded = backfill.shard_acquisitions(acquisition_keys, shards=4)
+
+    reversed_sharded = backfill.shard_acquisitions(list(reversed(acquisition_keys)), shards=4)
+    assert {shard: set(keys) for shard, keys in sharded.items()} == \
+           {shard: set(keys) for shard, keys in reversed_sharded.items()}
+    assert sorted(key for keys in sharded.values() for key in keys) == sorted(acquisition_keys)
+    assert {sensor for sensor, _ in sharded} == {'landsat_5', 'sentinel_2'}
+    assert len(sharded) == 8
+    for (sensor, shard), keys in sharded.items():
+        assert 0 <= shard < 4
+        assert all(key.split('/')[2] == sensor for key in keys)
+        assert backfill.get_shard(keys[0], shards=4) == (sensor, shard)
+
+
+@mock_s3
+def test_backfill(monkeypatch, s3_settings):
+    monkeypatch.setattr(services, 'build_stac_item_with_footprint', fake_build_stac_item_with_footprint)
+    bucket_name = 'public-eo-data'
+    sensor_key = 'common_sensing/fiji/landsat_5/'
+    acquisition_names = ['LT05_L1TP_075073_19911225'] + [f'LT05_L1TP_075073_1992012{i}' for i in range(6)] + \
+                        ['LT05_L1TP_075073_19920130_bad']
+
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=bucket_name)
+    bucket = s3.s3_resource.Bucket(bucket_name)
+    bucket.upload_file(Filename=ITEM_PATH, Key=services.get_item_key(f'{sensor_key}{acquisition_names[0]}/'))
+    for acquisition_name in acquisition_names:
+        bucket.put_object(Key=f'{sensor_key}{acquisition_name}/{acquisition_name}_B1.tif', Body=b'')
+    repo = repository.S3Repository(s3)
+
+    summary = backfill.backfill(repo, s3_credentials=dict(key=None, secret=None, s3_endpoint=None,
+                                                          region_name='us-east-1'),
+                                sensor_keys=[sensor_key, 'common_sensing/fiji/unknown_sensor/'],
+                                processes=2, shards=3, max_workers=2)
+
+    new_keys = [f'{sensor_key}{acquisition_name}/' for acquisition_name in acquisition_names[1:-1]]
+    assert sorted(summary['added']) == new_keys
+    assert summary['failed'] == [f'{sensor_key}{acquisition_names[-1]}/']
+
+    collection = repo.get_dict(bucket=bucket_name, key='stac_catalogs/cs_stac/landsat_5/collection.json')
+    item_hrefs = [link['href'] for link in collection['links'] if link['rel'] == 'item']
+    for acquisition_key in new_keys:
+        item = repo.get_dict(bucket=bucket_name, key=services.get_item_key(acquisition_key))
+        assert item['collection'] == 'landsat_5'
+        assert item['geometry']['type'] == 'Polygon'
+        # Reprojected from UTM 60S
+        assert all(170 < lon < 180 and -19 < lat < -17 for lon, lat in item['geometry']['coordinates'][0])
+        assert any(href.endswith(f"{item['id']}/{item['id']}.json") for href in item_hrefs)
+    assert len(item_hrefs) == len(set(item_hrefs))
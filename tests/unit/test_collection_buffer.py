@@ -0,0 +1,253 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from moto import mock_s3
+from pystac import STAC_IO
+from sac_stac.adapters import repository
+from sac_stac.domain.model import SacItem
+from sac_stac.domain.s3 import S3, NoObjectError
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.collection_lease import CollectionLease, LeaseTimeoutError
+from sac_stac.util import get_rel_links, parse_s3_url
+
+BUCKET = 'public-eo-data'
+COLLECTION_KEY = 'stac_catalogs/cs_stac/landsat_5/collection.json'
+
+
+def initialise_collection(s3_resource, bucket_name):
+    s3_resource.create_bucket(Bucket=bucket_name)
+    s3_resource.Bucket(bucket_name).upload_file(
+        Filename='tests/output/catalog.json',
+        Key='stac_catalogs/cs_stac/catalog.json'
+    )
+    s3_resource.Bucket(bucket_name).upload_file(
+        Filename='tests/output/landsat_5/collection.json',
+        Key=COLLECTION_KEY
+    )
+
+
+def stac_read_method(repo):
+    def read(uri):
+        bucket, key = parse_s3_url(uri)
+        return repo.s3.get_object_body(bucket_name=bucket, object_name=key).decode('utf-8')
+    return read
+
+
+def create_item(item_id):
+    return SacItem(id=item_id, datetime=datetime(1992, 1, 25), geometry=None, bbox=None, properties={})
+
+
+class CountingRepository(repository.S3Repository):
+    def __init__(self, s3):
+        super().__init__(s3)
+        self.puts = 0
+
+    def put_dict(self, bucket, key, stac_dict, **kwargs):
+        if not key.endswith('.lease'):
+            self.puts += 1
+        return super().put_dict(bucket, key, stac_dict, **kwargs)
+
+
+@mock_s3
+def test_collection_buffer_flushes_after_max_items():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = CountingRepository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+
+    buffer = CollectionBuffer(repo, bucket=BUCKET, max_items=2, max_age=60)
+    for i in range(3):
+        buffer.add_item(COLLECTION_KEY, create_item(f'item_{i}'))
+
+    assert repo.puts == 1
+    assert buffer.pending(COLLECTION_KEY) == 1
+
+    buffer.close()
+
+    assert repo.puts == 2
+    assert buffer.pending() == 0
+    item_links = get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item')
+    assert len(item_links) == 4
+    assert item_links[-1] == 'https://s3-uk-1.sa-catapult.co.uk/public-eo-data/stac_catalogs/cs_stac/landsat_5/' \
+                             'item_2/item_2.json'
+
+
+@mock_s3
+def test_collection_buffer_keeps_links_written_by_others():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+
+    buffer = CollectionBuffer(repo, bucket=BUCKET, max_items=10, max_age=60)
+    other = CollectionBuffer(repo, bucket=BUCKET, max_items=1, max_age=60)
+    buffer.add_item(COLLECTION_KEY, create_item('item_0'))
+    other.add_item(COLLECTION_KEY, create_item('item_1'))
+    buffer.close()
+
+    item_links = get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item')
+    assert [link.split('/')[-2] for link in item_links] == ['LT05_L1TP_075073_19911225', 'item_1', 'item_0']
+
+
+@mock_s3
+def test_collection_buffer_flushes_after_max_age():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+
+    with CollectionBuffer(repo, bucket=BUCKET, max_items=10, max_age=0.1) as buffer:
+        buffer.add_item(COLLECTION_KEY, create_item('item_0'))
+        for _ in range(50):
+            if not buffer.pending():
+                break
+            time.sleep(0.05)
+        assert buffer.pending() == 0
+
+
+@mock_s3
+def test_collection_buffer_extends_extent():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+
+    item = SacItem(id='item_0', datetime=datetime(1992, 1, 25), geometry=None,
+                   bbox=[280000.0, -1880000.0, 500000.0, -1600000.0], properties={})
+    buffer = CollectionBuffer(repo, bucket=BUCKET, max_items=1, max_age=60)
+    buffer.add_item(COLLECTION_KEY, item)
+
+    extent = repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY).get('extent')
+    assert extent['spatial']['bbox'] == [[280000.0, -1880000.0, 517515.0, -1600000.0]]
+    assert extent['temporal']['interval'] == [['1991-12-25T00:00:00Z', '1992-01-25T00:00:00Z']]
+
+
+@mock_s3
+def test_collection_lease_excludes_others():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+
+    with CollectionLease(repo, bucket=BUCKET, collection_key=COLLECTION_KEY, ttl=60) as lease:
+        assert repo.get_dict(bucket=BUCKET, key=lease.key)['owner'] == lease.owner
+        with pytest.raises(LeaseTimeoutError):
+            CollectionLease(repo, bucket=BUCKET, collection_key=COLLECTION_KEY, timeout=0.2).acquire()
+
+    with pytest.raises(NoObjectError):
+        repo.get_dict(bucket=BUCKET, key=f'{COLLECTION_KEY}.lease')
+
+
+@mock_s3
+def test_collection_lease_takes_over_expired_lease():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    repo = repository.S3Repository(s3)
+
+    dead = CollectionLease(repo, bucket=BUCKET, collection_key=COLLECTION_KEY, ttl=0.1)
+    dead.acquire()
+    time.sleep(0.2)
+
+    lease = CollectionLease(repo, bucket=BUCKET, collection_key=COLLECTION_KEY, timeout=1)
+    lease.acquire()
+    dead.release()
+
+    assert repo.get_dict(bucket=BUCKET, key=lease.key)['owner'] == lease.owner
+
+
+@mock_s3
+def test_collection_buffers_share_collection():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+    initial_links = len(get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item'))
+
+    # Two replicas, each with its own buffer, writing the same collection
+    buffers = [CollectionBuffer(repo, bucket=BUCKET, max_items=1, use_lease=True) for _ in range(2)]
+
+    def add_items(buffer, replica):
+        for i in range(5):
+            buffer.add_item(COLLECTION_KEY, create_item(f'item_{replica}_{i}'))
+
+    threads = [threading.Thread(target=add_items, args=(b, r)) for r, b in enumerate(buffers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for buffer in buffers:
+        buffer.close()
+
+    item_links = get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item')
+    assert len(item_links) == initial_links + 10
+
+
+@mock_s3
+def test_collection_buffers_share_collection_without_lease():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = stac_read_method(repo)
+    initial_links = len(get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item'))
+
+    buffers = [CollectionBuffer(repo, bucket=BUCKET, max_items=1, use_lease=False) for _ in range(4)]
+
+    def add_items(buffer, replica):
+        for i in range(5):
+            buffer.add_item(COLLECTION_KEY, create_item(f'item_{replica}_{i}'))
+
+    threads = [threading.Thread(target=add_items, args=(b, r)) for r, b in enumerate(buffers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for buffer in buffers:
+        buffer.close()
+
+    item_links = get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item')
+    assert len(item_links) == initial_links + 20
+
+
+class BlockingRepository(repository.S3Repository):
+    def __init__(self, s3):
+        super().__init__(s3)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.fail = False
+
+    def update_dict(self, bucket, key, update, **kwargs):
+        self.writing.set()
+        self.release.wait(5)
+        if self.fail:
+            raise repository.WriteFailedError(f'Could not write {key}')
+        return super().update_dict(bucket, key, update, **kwargs)
+
+
+@mock_s3
+def test_collection_buffer_adds_items_while_flushing():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    initialise_collection(s3.s3_resource, BUCKET)
+    repo = BlockingRepository(s3)
+    repo.fail = True
+    STAC_IO.read_text_method = stac_read_method(repo)
+
+    buffer = CollectionBuffer(repo, bucket=BUCKET, max_items=10, max_age=60)
+    buffer.add_item(COLLECTION_KEY, create_item('item_0'))
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    assert repo.writing.wait(5)
+
+    # The write is in flight, linking more items must not wait for it
+    buffer.add_item(COLLECTION_KEY, create_item('item_1'))
+    assert buffer.pending(COLLECTION_KEY) == 1
+
+    repo.release.set()
+    flusher.join()
+    # The failed links are merged back ahead of the ones queued meanwhile
+    assert [item.id for item in buffer._pending[COLLECTION_KEY]] == ['item_0', 'item_1']
+
+    repo.fail = False
+    assert buffer.flush()
+    item_links = get_rel_links(repo.get_dict(bucket=BUCKET, key=COLLECTION_KEY), 'item')
+    assert [link.split('/')[-2] for link in item_links][-2:] == ['item_0', 'item_1']
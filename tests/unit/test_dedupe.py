@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+from sac_stac.service_layer.dedupe import InFlight, RecentKeys
+
+
+def test_recent_keys_expire():
+    recent = RecentKeys(ttl=0.05, max_size=10)
+    recent.add('key', 'value')
+
+    assert recent.get('key') == 'value'
+    assert 'key' in recent
+    time.sleep(0.1)
+    assert 'key' not in recent
+    assert len(recent) == 0
+
+
+def test_recent_keys_bounded():
+    recent = RecentKeys(ttl=60, max_size=2)
+    for key in ['a', 'b', 'c']:
+        recent.add(key)
+
+    assert len(recent) == 2
+    assert 'a' not in recent
+    assert 'b' in recent and 'c' in recent
+
+    recent.add('b')
+    recent.add('d')
+    assert 'c' not in recent
+    recent.discard('b')
+    assert 'b' not in recent
+
+
+def test_in_flight_runs_once_per_key():
+    in_flight = InFlight()
+    calls = []
+    results = []
+    started = threading.Event()
+
+    def work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 'result'
+
+    def run():
+        results.append(in_flight.run('key', work))
+
+    threads = [threading.Thread(target=run)]
+    threads[0].start()
+    started.wait()
+    threads += [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['result'] * 4
+    assert 'key' not in in_flight
+    assert in_flight.run('key', work) == 'result'
+    assert len(calls) == 2
+
+
+def test_in_flight_shares_errors():
+    in_flight = InFlight()
+
+    def work():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        in_flight.run('key', work)
+    assert 'key' not in in_flight
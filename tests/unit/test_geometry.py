@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+from geopandas import GeoSeries
+from pytest import approx
+from rasterio.crs import CRS
+from shapely.geometry import box, MultiPolygon
+from sac_stac.domain.geometry import get_transformer, reproject_geometry, reproject_footprints
+
+
+def reproject_with_geopandas(geometry, crs):
+    return json.loads(GeoSeries([geometry.exterior], crs=crs).to_crs(4326).to_json())['features'][0]['geometry']
+
+
+def test_reproject_geometry():
+    crs = CRS.from_epsg(32630)
+    footprint = box(400000, 5600000, 500000, 5700000)
+
+    geometry = reproject_geometry(footprint, crs)
+
+    assert geometry['type'] == 'Polygon'
+    assert np.allclose(geometry['coordinates'][0], reproject_with_geopandas(footprint, crs)['coordinates'])
+    assert json.loads(json.dumps(geometry)) == geometry
+
+
+def test_reproject_multipolygon():
+    crs = CRS.from_epsg(32630)
+    footprint = MultiPolygon([box(400000, 5600000, 500000, 5700000), box(500000, 5600000, 600000, 5700000)])
+
+    geometry = reproject_geometry(footprint, crs)
+
+    assert geometry['type'] == 'MultiPolygon'
+    assert len(geometry['coordinates']) == 2
+    assert geometry['coordinates'][0][0][0] == approx([-3.0, 50.55193238270382])
+
+
+def test_reproject_footprints():
+    footprints = [
+        (box(400000, 5600000, 500000, 5700000), CRS.from_epsg(32630)),
+        (box(10, 20, 11, 21), CRS.from_epsg(4326)),
+        (box(500000, 5600000, 600000, 5700000), CRS.from_epsg(32630)),
+    ]
+
+    geometries = reproject_footprints(footprints)
+
+    for geometry, (footprint, crs) in zip(geometries, footprints):
+        assert np.allclose(geometry['coordinates'], reproject_geometry(footprint, crs)['coordinates'])
+    assert np.allclose(geometries[1]['coordinates'][0], box(10, 20, 11, 21).exterior.coords)
+
+
+def test_get_transformer_cached():
+    assert get_transformer(CRS.from_epsg(32630)) is get_transformer(CRS.from_epsg(32630))
+    assert get_transformer(CRS.from_epsg(32630)) is not get_transformer(CRS.from_epsg(32631))
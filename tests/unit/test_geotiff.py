@@ -0,0 +1,116 @@
+import struct
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from sac_stac.domain.geotiff import parse_geotiff_header, read_geotiff_header, UnsupportedTiffError
+
+
+def assert_same_as_rasterio(file):
+    header = parse_geotiff_header(Path(file).read_bytes())
+
+    with rasterio.open(file) as ds:
+        assert header.bounds == tuple(ds.bounds)
+        assert header.epsg == ds.crs.to_epsg()
+        assert header.shape == list(ds.shape)
+        assert header.transform == list(ds.transform)
+        assert header.dtype == ds.dtypes[0]
+        assert header.nodata == ds.nodata
+        assert header.overviews == ds.overviews(1)
+
+
+def write_tif(path, crs='EPSG:32701', **kwargs):
+    profile = dict(driver='GTiff', width=512, height=256, count=1, dtype='uint16', crs=crs,
+                   transform=from_origin(199980.0, 7900000.0, 60.0, 60.0), nodata=0)
+    profile.update(kwargs)
+    with rasterio.open(path, 'w', **profile) as ds:
+        ds.write(np.ones((1, profile['height'], profile['width']), dtype=profile['dtype']))
+        ds.build_overviews([2, 4])
+    return path
+
+
+def test_parse_geotiff_header_test_data():
+    files = [f for f in sorted(Path('tests/data/common_sensing').glob('**/*.tif')) if f.stat().st_size > 1]
+
+    assert files
+    for file in files:
+        assert_same_as_rasterio(file)
+
+
+@pytest.mark.parametrize('options', [
+    dict(),
+    dict(BIGTIFF='YES', dtype='float32', nodata=-9999.0),
+    dict(ENDIANNESS='BIG', dtype='int16'),
+    dict(crs='EPSG:4326', transform=from_origin(177.0, -17.0, 0.001, 0.001)),
+])
+def test_parse_geotiff_header_synthetic(tmp_path, options):
+    assert_same_as_rasterio(write_tif(tmp_path / 'test.tif', **options))
+
+
+def test_parse_geotiff_header_user_defined_crs(tmp_path):
+    file = write_tif(tmp_path / 'test.tif', crs='+proj=tmerc +lat_0=0 +lon_0=178.1 +k=0.9 +x_0=1 +y_0=2 +ellps=GRS80')
+
+    with pytest.raises(UnsupportedTiffError):
+        parse_geotiff_header(file.read_bytes())
+
+
+def test_parse_geotiff_header_malformed():
+    # A single IFD holding BitsPerSample only
+    ifd = struct.pack('<H', 1) + struct.pack('<HHIHH', 258, 3, 1, 16, 0) + struct.pack('<I', 0)
+    buffer = b'II' + struct.pack('<HI', 42, 8) + ifd + bytes(64)
+
+    with pytest.raises(UnsupportedTiffError):
+        parse_geotiff_header(buffer)
+
+
+def test_parse_geotiff_header_cyclic_ifds(tmp_path):
+    buffer = bytearray(write_tif(tmp_path / 'test.tif').read_bytes())
+    # Point the last IFD of the chain back to the first one
+    first_ifd = offset = struct.unpack_from('<I', buffer, 4)[0]
+    while offset:
+        next_offset_at = offset + 2 + struct.unpack_from('<H', buffer, offset)[0] * 12
+        offset = struct.unpack_from('<I', buffer, next_offset_at)[0]
+    struct.pack_into('<I', buffer, next_offset_at, first_ifd)
+
+    with pytest.raises(UnsupportedTiffError):
+        parse_geotiff_header(buffer)
+
+
+def test_parse_geotiff_header_not_tiff():
+
+    with pytest.raises(UnsupportedTiffError):
+        parse_geotiff_header(b'{"type": "Feature"}' * 10)
+
+
+def test_read_geotiff_header_grows_range(tmp_path):
+    data = write_tif(tmp_path / 'test.tif').read_bytes()
+    ranges = []
+
+    def read_range(start, end):
+        ranges.append((start, end))
+        return data[start:end + 1]
+
+    header = read_geotiff_header(read_range, header_size=64)
+
+    assert header.shape == [256, 512]
+    assert ranges[0] == (0, 63)
+    assert len(ranges) > 1
+    assert ranges == sorted(ranges)
+
+
+def test_read_geotiff_header_single_range():
+    data = Path('tests/data/common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/'
+                'S2A_MSIL2A_20151022T222102_T01KBU_B01_60m.tif').read_bytes()
+    ranges = []
+
+    def read_range(start, end):
+        ranges.append((start, end))
+        return data[start:end + 1]
+
+    header = read_geotiff_header(read_range)
+
+    assert header.overviews == [2, 4, 8, 16, 32]
+    assert ranges == [(0, 16383)]
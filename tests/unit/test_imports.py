@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+
+def test_consumer_imports_no_raster_or_aws_libraries():
+    script = ("import sys, sac_stac.entrypoints.nats_eventconsumer; "
+              "print(sorted(m for m in ('rasterio', 'pyproj', 'shapely', 'geopandas', 'boto3') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_configures_no_logging():
+    script = "import logging, sac_stac.service_layer.services; print(len(logging.getLogger().handlers))"
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == '0'
@@ -0,0 +1,119 @@
+import json
+
+from moto.s3 import mock_s3
+from pystac import Item
+from sac_stac.adapters import repository
+from sac_stac.domain.s3 import S3
+from sac_stac.load_config import get_sensor_config
+from sac_stac.service_layer import services
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+from sac_stac.service_layer.journal import BackfillJournal
+
+ITEM_PATH = 'tests/output/landsat_5/LT05_L1TP_075073_19911225/LT05_L1TP_075073_19911225.json'
+COLLECTION_KEY = 'stac_catalogs/cs_stac/landsat_5/collection.json'
+
+
+def get_item(item_id: str) -> Item:
+    with open(ITEM_PATH) as f:
+        item_dict = json.load(f)
+    item_dict['id'] = item_id
+    item_dict['links'] = []
+    return Item.from_dict(item_dict)
+
+
+def test_journal_resume(tmp_path):
+    path = str(tmp_path / 'backfill.journal')
+    with BackfillJournal(path, fsync_interval=0) as journal:
+        journal.item_started(COLLECTION_KEY, 'item_1', 'items/item_1.json')
+        journal.item_started(COLLECTION_KEY, 'item_2', 'items/item_2.json')
+        journal.collection_committed(COLLECTION_KEY, [get_item('item_1')])
+        journal.acquisition_done('common_sensing/fiji/landsat_5/item_1/')
+        journal.acquisition_done('common_sensing/fiji/landsat_5/item_2/')
+        journal.sensor_done('common_sensing/fiji/landsat_4/')
+        assert journal.pending_commits() == {COLLECTION_KEY: ['items/item_2.json']}
+
+    # The process died while writing a record
+    with open(path, 'a') as f:
+        f.write('{"op": "done", "acquisi')
+
+    with BackfillJournal(path, resume=True) as journal:
+        assert journal.is_done('common_sensing/fiji/landsat_5/item_2/')
+        assert not journal.is_done('common_sensing/fiji/landsat_5/item_3/')
+        assert journal.is_sensor_done('common_sensing/fiji/landsat_4/')
+        assert not journal.is_sensor_done('common_sensing/fiji/landsat_5/')
+        assert journal.pending_commits() == {COLLECTION_KEY: ['items/item_2.json']}
+        journal.collection_committed(COLLECTION_KEY, [get_item('item_2')])
+
+    with BackfillJournal(path, resume=True) as journal:
+        assert journal.pending_commits() == {}
+        assert journal.is_done('common_sensing/fiji/landsat_5/item_1/')
+
+    with BackfillJournal(path) as journal:
+        assert not journal.is_done('common_sensing/fiji/landsat_5/item_1/')
+
+
+def test_add_stac_items_skips_journaled_acquisitions(monkeypatch, tmp_path):
+    added = []
+
+    def fake_add_stac_item(repo, acquisition_key, **kwargs):
+        added.append(acquisition_key)
+        return 'item', f'{acquisition_key}item.json'
+
+    monkeypatch.setattr(services, 'add_stac_item', fake_add_stac_item)
+    acquisition_keys = [f'common_sensing/fiji/landsat_5/acquisition_{i}/' for i in range(4)]
+
+    with BackfillJournal(str(tmp_path / 'backfill.journal')) as journal:
+        journal.acquisition_done(acquisition_keys[0])
+        summary = services.add_stac_items(repo=None, acquisition_keys=acquisition_keys, journal=journal)
+
+        assert sorted(added) == acquisition_keys[1:]
+        assert sorted(summary['added']) == acquisition_keys[1:]
+        assert all(journal.is_done(key) for key in acquisition_keys)
+
+
+@mock_s3
+def test_replay_collection_commits(tmp_path, s3_settings):
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    repo = repository.S3Repository(s3)
+    services.create_stac_collection(repo, get_sensor_config('landsat_5'))
+
+    journal = BackfillJournal(str(tmp_path / 'backfill.journal'))
+    item_keys = []
+    for item_id in ('item_1', 'item_2'):
+        item_key = f'stac_catalogs/cs_stac/landsat_5/{item_id}/{item_id}.json'
+        repo.add_json_from_dict(bucket='public-eo-data', key=item_key, stac_dict=get_item(item_id).to_dict())
+        journal.item_started(COLLECTION_KEY, item_id, item_key)
+        item_keys.append(item_key)
+    # The previous run linked item_1 and stopped before writing item_3
+    journal.collection_committed(COLLECTION_KEY, [get_item('item_1')])
+    journal.item_started(COLLECTION_KEY, 'item_3', 'stac_catalogs/cs_stac/landsat_5/item_3/item_3.json')
+
+    with CollectionBuffer(repo, bucket='public-eo-data', on_flush=journal.collection_committed) as buffer:
+        assert services.replay_collection_commits(repo, journal, collection_buffer=buffer) == 1
+
+    collection = repo.get_dict(bucket='public-eo-data', key=COLLECTION_KEY)
+    item_hrefs = [link['href'] for link in collection['links'] if link['rel'] == 'item']
+    assert len(item_hrefs) == 1 and item_hrefs[0].endswith('item_2/item_2.json')
+    assert journal.pending_commits() == {COLLECTION_KEY: ['stac_catalogs/cs_stac/landsat_5/item_3/item_3.json']}
+    journal.close()
+
+
+def test_commit_stac_item_journals_before_writing(tmp_path, s3_settings):
+    class FakeBuffer:
+        def add_item(self, collection_key, item):
+            pass
+
+    class FailingRepo:
+        def add_json_from_dict(self, bucket, key, stac_dict):
+            # The process dies while the item is written
+            raise RuntimeError(key)
+
+    item_key = 'stac_catalogs/cs_stac/landsat_5/item_1/item_1.json'
+    with BackfillJournal(str(tmp_path / 'backfill.journal')) as journal:
+        try:
+            services.commit_stac_item(FailingRepo(), get_item('item_1'), item_key, COLLECTION_KEY,
+                                      collection_buffer=FakeBuffer(), journal=journal)
+        except RuntimeError:
+            pass
+        assert journal.pending_commits() == {COLLECTION_KEY: [item_key]}
@@ -0,0 +1,36 @@
+import pytest
+from sac_stac.domain.manifest import AcquisitionManifest
+from sac_stac.domain.s3 import ObjectRecord
+from sac_stac.load_config import config, get_sensor_config, sensor_index
+
+
+def test_sensor_index():
+    assert set(sensor_index) == {s['id'] for s in config['sensors']}
+    assert get_sensor_config('unknown') is None
+
+    sensor = get_sensor_config('landsat_8')
+    assert sensor.config is [s for s in config['sensors'] if s['id'] == 'landsat_8'][0]
+    assert sensor.date_regex.search('LC08_L1TP_075073_20190125').group(1) == '20190125'
+    assert sensor.date_format == '%Y%m%d'
+    assert len(sensor.bands) == len(sensor.config['extensions']['eo']['bands'])
+
+    with pytest.raises(TypeError):
+        sensor_index['landsat_8'] = sensor
+
+
+def test_assign_bands_first_match_per_band():
+    sensor = get_sensor_config('landsat_8')
+    band_names = [name for name, _ in sensor.bands]
+    prefix = 'common_sensing/fiji/landsat_8/LC08_L1TP_075073_20190125/'
+    keys = [f'{prefix}LC08_L1TP_075073_20190125_sr_band10.tif',
+            f'{prefix}LC08_L1TP_075073_20190125_sr_band1.tif',
+            f'{prefix}LC08_L1TP_075073_20190125_PIXEL_QA.tif',
+            f'{prefix}LC08_L1TP_075073_20190125.json']
+    manifest = AcquisitionManifest(prefix, [ObjectRecord(key=key, size=10, etag='etag') for key in keys])
+
+    assigned = manifest.assign_bands(sensor.band_pattern, band_names)
+
+    assert assigned['(t2|t1|sr|bt)_b(and)?1'] == keys[0]
+    assert assigned['(t2|t1|sr|bt)_b(and)?10'] == keys[0]
+    assert assigned['(pixel_qa|qa_pixel)'] == keys[2]
+    assert '(t2|t1|sr|bt)_b(and)?2' not in assigned
@@ -0,0 +1,334 @@
+import asyncio
+import threading
+import time
+
+from nats.errors import TimeoutError as FetchTimeoutError
+from sac_stac.entrypoints import nats_eventconsumer
+from sac_stac.entrypoints.nats_eventconsumer import pull_messages
+from sac_stac.service_layer.message_dispatcher import MessageDispatcher
+
+
+def test_dispatch_bounded_concurrency():
+    running = []
+    peak = []
+    published = []
+    lock = threading.Lock()
+
+    def add_item(data):
+        with lock:
+            running.append(data)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(data)
+        return 'item', f'{data}.json'
+
+    async def main():
+        loop_thread = threading.current_thread()
+
+        async def publish(subject, payload):
+            assert threading.current_thread() is loop_thread
+            published.append((subject, payload))
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, max_concurrency=2)
+        for i in range(6):
+            await dispatcher.dispatch('stac_creator.item', str(i))
+            assert dispatcher.in_flight <= 2
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert max(peak) == 2
+    assert sorted(published) == [('stac_indexer.item', f'{i}.json'.encode()) for i in range(6)]
+
+
+def test_dispatch_keeps_loop_responsive():
+    ticks = []
+
+    def add_item(data):
+        time.sleep(0.2)
+        return 'item', data
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, max_concurrency=1)
+        await dispatcher.dispatch('stac_creator.item', 'key')
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert ticks[-1] - ticks[0] < 0.2
+
+
+def test_dispatch_failures_release_slots():
+    published = []
+
+    def add_item(data):
+        if data == 'bad':
+            raise ValueError(data)
+        if data == 'missing':
+            return None
+        return 'item', data
+
+    async def main():
+        async def publish(subject, payload):
+            published.append(payload)
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, max_concurrency=1)
+        assert await dispatcher.dispatch('stac_creator.unknown', 'key') is None
+        for data in ('bad', 'missing', 'good'):
+            await dispatcher.dispatch('stac_creator.item', data)
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert published == [b'good']
+
+
+def test_dispatch_batches_messages():
+    batches = []
+    published = []
+    results = {}
+
+    def add_items(keys):
+        batches.append(sorted(keys))
+        return [('item', key) if 'bad' not in key else None for key in keys]
+
+    async def main():
+        async def publish(subject, payload):
+            published.append(payload)
+
+        def on_result(key):
+            async def report(processed):
+                results[key] = processed
+            return report
+
+        dispatcher = MessageDispatcher(handlers={}, batch_handlers={'item': add_items}, publish=publish,
+                                       batch_key=lambda key: key.split('/')[0], batch_window=0.05,
+                                       max_concurrency=10, max_batch=3)
+        for key in ['a/1', 'b/1', 'a/2', 'a/bad', 'b/2']:
+            await dispatcher.dispatch('stac_creator.item', key, on_result=on_result(key))
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert sorted(batches) == [['a/1', 'a/2', 'a/bad'], ['b/1', 'b/2']]
+    assert sorted(published) == [b'a/1', b'a/2', b'b/1', b'b/2']
+    assert results == {'a/1': True, 'a/2': True, 'a/bad': False, 'b/1': True, 'b/2': True}
+
+
+class FakeMsg:
+    class Metadata:
+        def __init__(self, num_delivered):
+            self.num_delivered = num_delivered
+
+    def __init__(self, subject, data, num_delivered=1):
+        self.subject = subject
+        self.data = data.encode()
+        self.metadata = self.Metadata(num_delivered)
+        self.settled = None
+        self.in_progress_count = 0
+
+    async def in_progress(self):
+        self.in_progress_count += 1
+
+    async def ack(self):
+        self.settled = 'ack'
+
+    async def nak(self, delay=None):
+        self.settled = ('nak', delay)
+
+
+class FakeSubscription:
+    def __init__(self, msgs):
+        self.msgs = msgs
+
+    async def fetch(self, batch, timeout):
+        if not self.msgs:
+            await asyncio.sleep(0.01)
+            raise FetchTimeoutError
+        fetched, self.msgs = self.msgs[:batch], self.msgs[batch:]
+        return fetched
+
+
+def test_dispatch_dedupes_messages():
+    calls = []
+    published = []
+    results = []
+
+    def add_item(data):
+        calls.append(data)
+        time.sleep(0.1)
+        return 'item', f'{data}.json'
+
+    async def main():
+        async def publish(subject, payload):
+            published.append(payload)
+
+        async def on_result(processed):
+            results.append(processed)
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, max_concurrency=4,
+                                       dedupe_ttl=60)
+        first = await dispatcher.dispatch('stac_creator.item', 'key', on_result=on_result)
+        duplicate = await dispatcher.dispatch('stac_creator.item', 'key', on_result=on_result)
+        assert duplicate is first
+        assert dispatcher.in_flight == 1
+        await dispatcher.drain()
+
+        await dispatcher.dispatch('stac_creator.item', 'key', on_result=on_result)
+        assert dispatcher.in_flight == 0
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert calls == ['key']
+    assert published == [b'key.json']
+    assert results == [True, True, True]
+
+
+def test_dispatch_runs_repeated_collection_messages_again():
+    calls = []
+    results = []
+
+    def add_collection(data):
+        calls.append(data)
+        time.sleep(0.1)
+        return 'collection', data
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        async def on_result(processed):
+            results.append(processed)
+
+        dispatcher = MessageDispatcher(handlers={'collection': add_collection}, publish=publish,
+                                       max_concurrency=4, dedupe_ttl=60)
+        first = await dispatcher.dispatch('stac_creator.collection', 'key', on_result=on_result)
+        follow_up = await dispatcher.dispatch('stac_creator.collection', 'key', on_result=on_result)
+        assert follow_up is not first
+        # Until the follow-up starts, further duplicates share it
+        assert await dispatcher.dispatch('stac_creator.collection', 'key', on_result=on_result) is follow_up
+        await dispatcher.drain()
+
+        # Not skipped as recently processed, new acquisitions may have arrived since
+        await dispatcher.dispatch('stac_creator.collection', 'key', on_result=on_result)
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert calls == ['key', 'key', 'key']
+    assert results == [True, True, True, True]
+
+
+def test_dispatch_retries_failed_messages():
+    calls = []
+
+    def add_item(data):
+        calls.append(data)
+        return None
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, dedupe_ttl=60)
+        for _ in range(2):
+            await dispatcher.dispatch('stac_creator.item', 'key')
+            await dispatcher.drain()
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert calls == ['key', 'key']
+
+
+def test_pull_messages_acks_processed_messages():
+    msgs = [FakeMsg('stac_creator.item', 'good'), FakeMsg('stac_creator.item', 'bad', num_delivered=2),
+            FakeMsg('stac_creator.unknown', 'key')]
+
+    def add_item(data):
+        return ('item', data) if data == 'good' else None
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        dispatcher = MessageDispatcher(handlers={'item': add_item}, publish=publish, max_concurrency=2)
+        consumer = asyncio.ensure_future(pull_messages(FakeSubscription(msgs), dispatcher, backoff=[1, 5]))
+        while any(msg.settled is None for msg in msgs):
+            await asyncio.sleep(0.01)
+        consumer.cancel()
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert [msg.settled for msg in msgs] == ['ack', ('nak', 5), 'ack']
+
+
+def test_pull_messages_keeps_fetching_after_errors(monkeypatch):
+    class FailingSubscription(FakeSubscription):
+        def __init__(self, msgs, failures):
+            super().__init__(msgs)
+            self.failures = failures
+
+        async def fetch(self, batch, timeout):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('Connection to NATS lost')
+            return await super().fetch(batch, timeout)
+
+    monkeypatch.setattr(nats_eventconsumer, 'FETCH_ERROR_DELAYS', [0.01])
+    msgs = [FakeMsg('stac_creator.item', 'key')]
+    subscription = FailingSubscription(msgs, failures=3)
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        dispatcher = MessageDispatcher(handlers={'item': lambda data: ('item', data)}, publish=publish)
+        consumer = asyncio.ensure_future(pull_messages(subscription, dispatcher, backoff=[1]))
+        for _ in range(100):
+            if msgs[0].settled:
+                break
+            await asyncio.sleep(0.01)
+        assert not consumer.done()
+        consumer.cancel()
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert subscription.failures == 0
+    assert msgs[0].settled == 'ack'
+
+
+def test_pull_messages_marks_long_messages_in_progress():
+    msgs = [FakeMsg('stac_creator.collection', 'slow'), FakeMsg('stac_creator.collection', 'fast')]
+
+    def add_collection(data):
+        time.sleep(0.2 if data == 'slow' else 0)
+        return 'collection', data
+
+    async def main():
+        async def publish(subject, payload):
+            pass
+
+        dispatcher = MessageDispatcher(handlers={'collection': add_collection}, publish=publish, max_concurrency=2)
+        consumer = asyncio.ensure_future(pull_messages(FakeSubscription(msgs), dispatcher, backoff=[1],
+                                                       heartbeat=0.05))
+        while any(msg.settled is None for msg in msgs):
+            await asyncio.sleep(0.01)
+        consumer.cancel()
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+    assert [msg.settled for msg in msgs] == ['ack', 'ack']
+    assert msgs[0].in_progress_count >= 2
+    assert msgs[1].in_progress_count == 0
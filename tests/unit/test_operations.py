@@ -3,8 +3,9 @@ import os
 from shapely.geometry import Polygon
 from datetime import datetime
 
+from sac_stac.domain.gdal import get_cog_path
 from sac_stac.domain.operations import obtain_date_from_filename, \
-    get_geometry_from_cog, get_projection_from_cog
+    get_geometry_from_cog, get_projection_from_cog, probe_cog
 
 
 def test_obtain_date_from_filename_sentinel():
@@ -126,3 +127,62 @@ def test_get_projection_from_cog_from_tests():
 
     finally:
         os.environ.pop("TEST_ENV")
+
+
+def test_probe_cog():
+
+    file = 'tests/data/common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/' \
+           'S2A_MSIL2A_20151022T222102_T01KBU_B01_60m.tif'
+    cache = {}
+
+    probe = probe_cog(file, cache=cache)
+
+    assert probe.bounds == (199980.0, 7790200.0, 309780.0, 7900000.0)
+    assert probe.crs.to_epsg() == 32701
+    assert probe.shape == [1830, 1830]
+    assert probe.transform == [60.0, 0.0, 199980.0, 0.0, -60.0, 7900000.0, 0.0, 0.0, 1.0]
+    assert probe.dtype
+    assert isinstance(probe.overviews, list)
+    assert cache == {file: probe}
+
+    geometry, crs = get_geometry_from_cog(file, cache=cache)
+    proj_shp, proj_tran = get_projection_from_cog(file, cache=cache)
+    assert geometry.bounds == probe.bounds
+    assert proj_shp == probe.shape
+
+
+def test_probe_cog_offline():
+
+    assert probe_cog('fake/url/nothing/here') is None
+
+
+def test_get_cog_path(monkeypatch):
+
+    class FakeRepository:
+        def sign_file(self, bucket, key):
+            return f'https://signed/{bucket}/{key}'
+
+    monkeypatch.setenv('STAC_GDAL_VSIS3', 'false')
+    assert get_cog_path('bucket', 'a/b.tif', FakeRepository()) == 'https://signed/bucket/a/b.tif'
+
+    monkeypatch.setenv('STAC_GDAL_VSIS3', 'true')
+    assert get_cog_path('bucket', 'a/b.tif', FakeRepository()) == '/vsis3/bucket/a/b.tif'
+
+
+def test_probe_cog_header(monkeypatch):
+    file = 'tests/data/common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/' \
+           'S2A_MSIL2A_20151022T222102_T01KBU_B01_60m.tif'
+
+    class FakeRepository:
+        def get_product_range(self, bucket, product_key, start, end):
+            with open(file, 'rb') as f:
+                f.seek(start)
+                return f.read(end - start + 1)
+
+        def sign_file(self, bucket, key):
+            raise AssertionError('GDAL should not be used')
+
+    monkeypatch.delenv('TEST_ENV', raising=False)
+    probe = probe_cog(cog_key='a/b.tif', s3_repository=FakeRepository())
+
+    assert probe == probe_cog(file)
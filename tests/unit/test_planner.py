@@ -0,0 +1,117 @@
+import pytest
+from moto.s3 import mock_s3
+from sac_stac.adapters import repository
+from sac_stac.domain.s3 import ObjectRecord, S3
+from sac_stac.load_config import get_sensor_config
+from sac_stac.service_layer import planner, services, sync
+
+IMAGERY_PATH = 'common_sensing/fiji/'
+BANDS = [name for name, _ in get_sensor_config('landsat_5').bands]
+
+
+def get_acquisition_records(acquisition_name: str) -> list:
+    prefix = f'{IMAGERY_PATH}landsat_5/{acquisition_name}/'
+    return [ObjectRecord(key=f'{prefix}{acquisition_name}_{band}.tif', size=1000 + i, etag=str(i))
+            for i, band in enumerate(BANDS)] + \
+        [ObjectRecord(key=f'{prefix}{acquisition_name}_MTL.xml', size=10, etag='')]
+
+
+def get_plan() -> sync.SyncPlan:
+    acquisitions = {f'{IMAGERY_PATH}landsat_5/{name}/': get_acquisition_records(name)
+                    for name in ('new_1', 'new_2', 'present', 'changed')}
+    items = {services.get_item_key(f'{IMAGERY_PATH}landsat_5/{name}/'): ObjectRecord(key='', size=3000, etag='')
+             for name in ('present', 'changed', 'gone')}
+    documents = {f'{services.S3_STAC_PATH}/landsat_5/collection.json': ObjectRecord(key='', size=2000, etag=''),
+                 services.S3_CATALOG_KEY: ObjectRecord(key='', size=1000, etag='')}
+    return sync.SyncPlan(acquisitions=acquisitions, fingerprints={key: 'f' for key in acquisitions},
+                         added=[f'{IMAGERY_PATH}landsat_5/new_1/', f'{IMAGERY_PATH}landsat_5/new_2/'],
+                         changed=[f'{IMAGERY_PATH}landsat_5/changed/'],
+                         unchanged=[f'{IMAGERY_PATH}landsat_5/present/'],
+                         removed=[services.get_item_key(f'{IMAGERY_PATH}landsat_5/gone/')],
+                         items=items, documents=documents)
+
+
+def test_estimate_backfill(monkeypatch):
+    monkeypatch.setenv('STAC_COLLECTION_LEASE', 'true')
+    monkeypatch.setenv('STAC_S3_VERIFY_WRITES', 'true')
+    monkeypatch.setenv('STAC_COG_HEADER_SIZE', '16384')
+
+    estimate = planner.estimate_run(get_plan(), command='backfill')
+    report = estimate['sensors']['landsat_5']
+
+    assert (report['acquisitions'], report['new'], report['present'], report['changed']) == (4, 2, 2, 1)
+    # Two manifests, then the acquisition and item index listings
+    assert report['requests']['list'] == 4
+    assert report['requests']['ranged_get'] == 2 * len(BANDS)
+    assert report['bytes']['ranged_read'] == 2 * len(BANDS) * 16384
+    # Two items, then one collection flush under the lease
+    assert report['requests']['put'] == 2 + 2
+    assert report['requests']['get'] == 2 + 5
+    assert report['requests']['head'] == 1
+    assert report['requests']['delete'] == 1
+    link_sizes = sum(planner._get_link_size(services.get_item_key(key)) for key in get_plan().added)
+    assert report['bytes']['json_written'] == 2 * 3000 + 2000 + link_sizes
+    assert estimate['total'] == report
+
+    # Without conditional writes, the collection and lease writes each check the ETag first
+    estimate = planner.estimate_run(get_plan(), command='backfill', conditional_writes=False)
+    assert estimate['total']['requests']['head'] == 1 + 2
+    assert estimate['total']['requests']['put'] == report['requests']['put']
+
+
+def test_estimate_sync(monkeypatch):
+    monkeypatch.setenv('STAC_COLLECTION_LEASE', 'false')
+    monkeypatch.setenv('STAC_S3_VERIFY_WRITES', 'false')
+
+    estimate = planner.estimate_run(get_plan(), command='sync', prune=True)
+    report = estimate['sensors']['landsat_5']
+
+    assert report['removed'] == 1
+    assert report['requests']['list'] == 3
+    assert report['requests']['ranged_get'] == 3 * len(BANDS)
+    # Three items, a flush of their links and a flush pruning the removed one
+    assert report['requests']['put'] == 3 + 2
+    assert report['requests']['get'] == 2 + 2
+    assert report['requests']['head'] == 0
+    assert report['requests']['delete'] == 1
+    # Plus the imagery and catalog listings and the sync state
+    assert estimate['total']['requests']['list'] == 3 + 2
+    assert estimate['total']['requests']['put'] == report['requests']['put'] + 1
+    assert planner.estimate_run(get_plan(), command='sync', prune=True,
+                                conditional_writes=False)['total']['requests']['head'] == 2
+    # Without pruning the removed item stays
+    assert planner.estimate_run(get_plan(), command='sync')['sensors']['landsat_5']['requests']['delete'] == 0
+
+
+@mock_s3
+@pytest.mark.parametrize('command', ['backfill', 'sync'])
+def test_plan_run_only_lists(command, s3_settings):
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    bucket = s3.s3_resource.Bucket('public-eo-data')
+    for name in ('new', 'present'):
+        for record in get_acquisition_records(name):
+            bucket.put_object(Key=record.key, Body=b'12')
+    bucket.put_object(Key=services.get_item_key(f'{IMAGERY_PATH}landsat_5/present/'), Body=b'{}')
+    repo = repository.S3Repository(s3)
+    objects = {obj.key: obj.e_tag for obj in bucket.objects.all()}
+
+    get_dict = repo.get_dict
+
+    def get_sync_state(bucket, key):
+        assert command == 'sync' and key == sync.SYNC_STATE_KEY, 'a plan only lists, and reads the sync state'
+        return get_dict(bucket=bucket, key=key)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('a plan only lists')
+
+    repo.get_dict = get_sync_state
+    for method in ('get_dict_with_etag', 'put_dict', 'update_dict', 'add_json_from_dict', 'delete_object',
+                   'get_product_range'):
+        setattr(repo, method, fail)
+
+    estimate = planner.plan_run(repo, command=command, imagery_prefix=IMAGERY_PATH)
+
+    assert (estimate['total']['new'], estimate['total']['present']) == (1, 1)
+    assert estimate['total']['requests']['put'] > 0
+    assert {obj.key: obj.e_tag for obj in bucket.objects.all()} == objects
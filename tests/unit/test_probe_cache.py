@@ -0,0 +1,60 @@
+from sac_stac.domain.operations import probe_cog, CogProbe
+from sac_stac.domain.probe_cache import ProbeCache
+
+FILE = 'tests/data/common_sensing/fiji/sentinel_2/S2A_MSIL2A_20151022T222102_T01KBU/' \
+       'S2A_MSIL2A_20151022T222102_T01KBU_B01_60m.tif'
+
+
+class FakeRepository:
+    def __init__(self):
+        self.reads = 0
+
+    def get_product_range(self, bucket, product_key, start, end):
+        self.reads += 1
+        with open(FILE, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+
+def test_probe_cache_round_trip(tmp_path):
+    probe = probe_cog(FILE)
+    cache = ProbeCache(path=str(tmp_path / 'probes.db'), max_size=1024 * 1024)
+
+    assert cache.get('bucket', 'a/b.tif', 'etag') is None
+    cache.put('bucket', 'a/b.tif', 'etag', probe)
+
+    assert CogProbe(**cache.get('bucket', 'a/b.tif', 'etag')) == probe
+    assert cache.get('bucket', 'a/b.tif', 'other') is None
+    assert cache.stats() == dict(hits=1, misses=2, evictions=0)
+
+    cache.close()
+    reopened = ProbeCache(path=str(tmp_path / 'probes.db'), max_size=1024 * 1024)
+    assert CogProbe(**reopened.get('bucket', 'a/b.tif', 'etag')) == probe
+
+
+def test_probe_cache_eviction(tmp_path):
+    probe = probe_cog(FILE)
+    cache = ProbeCache(path=str(tmp_path / 'probes.db'), max_size=2000)
+
+    for i in range(20):
+        cache.put('bucket', f'{i}.tif', 'etag', probe)
+    cache.get('bucket', '0.tif', 'etag')
+
+    assert cache.size() <= 2000
+    assert cache.stats()['evictions']
+    assert cache.get('bucket', '19.tif', 'etag')
+
+
+def test_probe_cog_uses_probe_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('TEST_ENV', raising=False)
+    cache = ProbeCache(path=str(tmp_path / 'probes.db'), max_size=1024 * 1024)
+    repo = FakeRepository()
+
+    probe = probe_cog(cog_key='a/b.tif', s3_repository=repo, etag='v1', probe_cache=cache)
+    reads = repo.reads
+
+    assert probe_cog(cog_key='a/b.tif', s3_repository=repo, etag='v1', probe_cache=cache) == probe
+    assert repo.reads == reads
+    assert probe_cog(cog_key='a/b.tif', s3_repository=repo, etag='v2', probe_cache=cache) == probe
+    assert repo.reads > reads
+    assert cache.stats() == dict(hits=1, misses=2, evictions=0)
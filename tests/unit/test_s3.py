@@ -1,9 +1,10 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
 from moto import mock_s3
-from sac_stac.domain.s3 import S3, NoObjectError
+from sac_stac.domain.s3 import S3, NoObjectError, PreconditionFailedError, get_s3_client
 
 BUCKET = 'test'
 
@@ -40,6 +41,19 @@ def test_get_object_body_non_exist():
                            object_name='nothing')
 
 
+@mock_s3
+def test_get_object_range():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    s3.put_object(bucket_name=BUCKET, key='key/test/file.txt', body='hello world')
+
+    obj = s3.get_object_range(bucket_name=BUCKET, object_name='key/test/file.txt', start=0, end=4)
+
+    assert obj == b'hello'
+    with pytest.raises(NoObjectError):
+        s3.get_object_range(bucket_name=BUCKET, object_name='nothing', start=0, end=4)
+
+
 @mock_s3
 def test_list_common_prefixes():
     s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
@@ -81,6 +95,25 @@ def test_put_object():
     assert object_body == obj_body_decoded
 
 
+@mock_s3
+def test_put_object_conditions_without_conditional_writes():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket=BUCKET)
+    # As with a botocore release not modelling If-Match and If-None-Match
+    s3.conditional_writes = False
+    object_key = 'key/test/file.txt'
+
+    s3.put_object(bucket_name=BUCKET, key=object_key, body='first', if_none_match='*')
+    etag = s3.get_object_etag(bucket_name=BUCKET, object_name=object_key)
+    with pytest.raises(PreconditionFailedError):
+        s3.put_object(bucket_name=BUCKET, key=object_key, body='second', if_none_match='*')
+    with pytest.raises(PreconditionFailedError):
+        s3.put_object(bucket_name=BUCKET, key=object_key, body='second', if_match='stale')
+    s3.put_object(bucket_name=BUCKET, key=object_key, body='second', if_match=etag)
+
+    assert s3.get_object_body(bucket_name=BUCKET, object_name=object_key).decode('utf-8') == 'second'
+
+
 @mock_s3
 def test_put_object_json():
     s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
@@ -101,3 +134,62 @@ def test_put_object_json():
     assert resp.get('ResponseMetadata').get('HTTPStatusCode') == 200
     assert object_body == obj_body
     assert object_dict == obj_dict
+
+
+@mock_s3
+def test_shared_client():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    other = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+
+    assert s3.client is other.client
+    assert s3.client is get_s3_client(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    assert s3.client is not get_s3_client(key=None, secret=None, s3_endpoint=None, region_name='eu-west-2')
+    assert s3.client.meta.config.max_pool_connections == 64
+    assert s3.client.meta.config.retries['mode'] == 'adaptive'
+
+
+@mock_s3
+def test_shared_client_from_threads():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.client.create_bucket(Bucket=BUCKET)
+
+    def put_and_get(i):
+        s3.put_object(bucket_name=BUCKET, key=f'objects/{i}', body=str(i))
+        return s3.get_object_body(bucket_name=BUCKET, object_name=f'objects/{i}')
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        bodies = list(executor.map(put_and_get, range(64)))
+
+    assert bodies == [str(i).encode() for i in range(64)]
+    assert len(s3.list_object_records(bucket_name=BUCKET, prefix='objects/')) == 64
+
+
+@mock_s3
+def test_iter_objects():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.client.create_bucket(Bucket=BUCKET)
+    for i in range(10):
+        s3.put_object(bucket_name=BUCKET, key=f'objects/{i}.json', body='{}')
+        s3.put_object(bucket_name=BUCKET, key=f'objects/{i}.tif', body='raster')
+    requests = []
+    s3.client.meta.events.register('before-call.s3.ListObjectsV2', lambda **kwargs: requests.append(1))
+
+    records = list(s3.iter_objects(bucket_name=BUCKET, prefix='objects/', suffix='.tif', page_size=4))
+    assert [r.key for r in records] == [f'objects/{i}.tif' for i in range(10)]
+    assert all(r.size == len('raster') and r.etag for r in records)
+    assert len(requests) == 5
+
+    requests.clear()
+    records = list(s3.iter_objects(bucket_name=BUCKET, prefix='objects/', suffix='.json', limit=2, page_size=4))
+    assert [r.key for r in records] == ['objects/0.json', 'objects/1.json']
+    assert len(requests) == 1
+
+
+@mock_s3
+def test_list_objects_not_exist():
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.client.create_bucket(Bucket=BUCKET)
+
+    assert list(s3.iter_objects(bucket_name=BUCKET, prefix='nothing/')) == []
+    with pytest.raises(NoObjectError):
+        s3.list_objects(bucket_name=BUCKET, prefix='nothing/')
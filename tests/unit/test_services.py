@@ -4,9 +4,13 @@ import json
 from pathlib import Path
 
 from moto.s3 import mock_s3
+from pystac import STAC_IO
 from sac_stac.adapters import repository
 from sac_stac.domain.s3 import S3
 from sac_stac.service_layer import services
+from sac_stac.service_layer.item_index import ItemIndex
+from sac_stac.load_config import get_sensor_config
+from sac_stac.util import get_rel_links
 
 
 def initialise_s3_bucket(sensor_key, s3_resource, bucket_name):
@@ -112,3 +116,172 @@ def test_add_stac_item_with_empty_bands():
         assert not item_key
     finally:
         os.environ.pop("TEST_ENV")
+
+
+@mock_s3
+def test_create_stac_collection_links_collection_already_in_catalog(monkeypatch, s3_settings):
+    class RacingRepository(repository.S3Repository):
+        """Another replica writes the collection right after it is found missing."""
+        def __init__(self, s3):
+            super().__init__(s3)
+            self.racing = False
+            self.written = {}
+
+        def get_dict(self, bucket, key):
+            if key == collection_key and self.racing:
+                self.racing = False
+                raise repository.NoObjectError(key)
+            return super().get_dict(bucket, key)
+
+        def put_dict(self, bucket, key, stac_dict, **kwargs):
+            self.written[key] = stac_dict
+            return super().put_dict(bucket, key, stac_dict, **kwargs)
+
+    collection_key = 'stac_catalogs/cs_stac/landsat_5/collection.json'
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    repo = RacingRepository(s3)
+    monkeypatch.setattr(STAC_IO, 'read_text_method', repo.stac_read_method)
+    services.create_stac_collection(repo, get_sensor_config('landsat_5'))
+    repo.racing = True
+    repo.written = {}
+
+    assert services.create_stac_collection(repo, get_sensor_config('landsat_5')) == collection_key
+
+    self_links = get_rel_links(repo.written[collection_key], 'self')
+    assert len(self_links) == 1 and self_links[0].endswith(collection_key)
+    assert len(get_rel_links(repo.written[services.S3_CATALOG_KEY], 'child')) == 1
+
+
+def test_add_stac_collection_fails_when_links_not_written(monkeypatch):
+    class FailingBuffer:
+        def start(self):
+            return self
+
+        def flush(self, collection_key):
+            return False
+
+    class FakeRepo:
+        stac_read_method = None
+
+        def get_acquisition_keys(self, bucket, acquisition_prefix):
+            return [f'{acquisition_prefix}acquisition/']
+
+    monkeypatch.setattr(STAC_IO, 'read_text_method', STAC_IO.read_text_method)
+    monkeypatch.setattr(services, 'create_stac_collection', lambda repo, sensor: 'landsat_5/collection.json')
+    monkeypatch.setattr(services, 'add_stac_items', lambda **kwargs: {'added': kwargs['acquisition_keys'],
+                                                                      'failed': []})
+
+    result = services.add_stac_collection(repo=FakeRepo(), sensor_key='common_sensing/fiji/landsat_5/',
+                                          collection_buffer=FailingBuffer(), item_index=object())
+
+    assert result == ('collection', None)
+
+
+def test_add_stac_items_isolates_failures(monkeypatch):
+    def fake_add_stac_item(repo, acquisition_key, **kwargs):
+        if 'bad' in acquisition_key:
+            raise ValueError('broken acquisition')
+        if 'empty' in acquisition_key:
+            return 'item', None
+        return 'item', f'{acquisition_key}item.json'
+
+    monkeypatch.setattr(services, 'add_stac_item', fake_add_stac_item)
+    acquisition_keys = [f'common_sensing/fiji/landsat_5/good_{i}/' for i in range(10)] + \
+                       ['common_sensing/fiji/landsat_5/bad/', 'common_sensing/fiji/landsat_5/empty/']
+
+    summary = services.add_stac_items(repo=None, acquisition_keys=acquisition_keys, max_workers=4)
+
+    assert sorted(summary['added']) == sorted(acquisition_keys[:10])
+    assert sorted(summary['failed']) == ['common_sensing/fiji/landsat_5/bad/', 'common_sensing/fiji/landsat_5/empty/']
+
+
+def test_add_stac_item_batch_links_items_before_writing_them(monkeypatch):
+    events = []
+
+    class FakeItem:
+        def __init__(self, item_id):
+            self.id = item_id
+
+        def to_dict(self):
+            return {'id': self.id}
+
+    class FakeCollection:
+        id = 'landsat_5'
+
+    class FakeBuffer:
+        flushes = True
+
+        def get_collection(self, collection_key):
+            return FakeCollection()
+
+        def add_item(self, collection_key, item):
+            events.append(('link', item.id))
+
+        def flush(self, collection_key):
+            events.append(('flush', collection_key))
+            return self.flushes
+
+    class FakeRepo:
+        stac_read_method = None
+
+        def get_item_keys(self, bucket, collection_prefix):
+            return set()
+
+        def add_json_from_dict(self, bucket, key, stac_dict):
+            events.append(('write', stac_dict['id']))
+
+    def fake_build_stac_item(repo, acquisition_key, sensor):
+        if 'bad' in acquisition_key:
+            raise ValueError('broken acquisition')
+        return FakeItem(acquisition_key.split('/')[3])
+
+    monkeypatch.setattr(STAC_IO, 'read_text_method', STAC_IO.read_text_method)
+    monkeypatch.setattr(services, 'build_stac_item', fake_build_stac_item)
+    acquisition_keys = [f'common_sensing/fiji/landsat_5/good_{i}/' for i in range(5)] + \
+                       ['common_sensing/fiji/landsat_5/bad/']
+    buffer = FakeBuffer()
+    collection_key = f'{services.S3_STAC_PATH}/landsat_5/collection.json'
+
+    results = services.add_stac_item_batch(repo=FakeRepo(), acquisition_keys=acquisition_keys,
+                                           collection_buffer=buffer,
+                                           item_index=ItemIndex(FakeRepo(), bucket=services.S3_BUCKET, prefix=''))
+
+    item_keys = [f'{services.S3_STAC_PATH}/landsat_5/good_{i}/good_{i}.json' for i in range(5)]
+    assert results == [('item', item_key) for item_key in item_keys] + [None]
+    assert [event for event in events if event[0] == 'flush'] == [('flush', collection_key)]
+    flush_at = events.index(('flush', collection_key))
+    assert sorted(events[:flush_at]) == [('link', f'good_{i}') for i in range(5)]
+    assert sorted(events[flush_at + 1:]) == [('write', f'good_{i}') for i in range(5)]
+
+    # Nothing is written when the links are not
+    events.clear()
+    buffer.flushes = False
+    assert services.add_stac_item_batch(
+        repo=FakeRepo(), acquisition_keys=acquisition_keys, collection_buffer=buffer,
+        item_index=ItemIndex(FakeRepo(), bucket=services.S3_BUCKET, prefix='')
+    ) == [None] * 6
+    assert not [event for event in events if event[0] == 'write']
+
+
+@mock_s3
+def test_item_exists_with_item_index(s3_settings):
+    sensor_name = 'landsat_5'
+    item_key = 'stac_catalogs/cs_stac/landsat_5/LT05_L1TP_075073_19911225/LT05_L1TP_075073_19911225.json'
+    new_item_key = 'stac_catalogs/cs_stac/landsat_5/LT05_L1TP_075073_19920125/LT05_L1TP_075073_19920125.json'
+
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    add_stac_s3(sensor_name, s3.s3_resource, 'public-eo-data')
+    repo = repository.S3Repository(s3)
+
+    item_index = ItemIndex(repo, bucket='public-eo-data', prefix=f'stac_catalogs/cs_stac/{sensor_name}/')
+
+    assert services.item_exists(repo, item_key, item_index)
+    assert not services.item_exists(repo, new_item_key, item_index)
+    assert services.item_exists(repo, item_key)
+
+    s3.s3_resource.Bucket('public-eo-data').put_object(Key=new_item_key, Body=b'{}')
+    assert not services.item_exists(repo, new_item_key, item_index)
+    item_index.refresh()
+    assert services.item_exists(repo, new_item_key, item_index)
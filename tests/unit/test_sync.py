@@ -0,0 +1,147 @@
+import json
+
+from moto.s3 import mock_s3
+from pystac import Item, STAC_IO
+from sac_stac.adapters import repository
+from sac_stac.domain.s3 import NoObjectError, S3
+from sac_stac.load_config import get_sensor_config
+from sac_stac.service_layer import services, sync
+from sac_stac.service_layer.collection_buffer import CollectionBuffer
+
+ITEM_PATH = 'tests/output/landsat_5/LT05_L1TP_075073_19911225/LT05_L1TP_075073_19911225.json'
+IMAGERY_PATH = 'common_sensing/fiji/'
+OTHER_IMAGERY_PATH = 'common_sensing/vanuatu/'
+COLLECTION_KEY = 'stac_catalogs/cs_stac/landsat_5/collection.json'
+
+
+def fake_build_stac_item(repo, acquisition_key, sensor):
+    with open(ITEM_PATH) as f:
+        item_dict = json.load(f)
+    item_dict['id'] = acquisition_key.split('/')[-2]
+    item_dict['links'] = []
+    return Item.from_dict(item_dict)
+
+
+def get_item_hrefs(repo) -> list:
+    collection = repo.get_dict(bucket='public-eo-data', key=COLLECTION_KEY)
+    return sorted(link['href'].split('/')[-2] for link in collection['links'] if link['rel'] == 'item')
+
+
+def item_exists(repo, item_key) -> bool:
+    try:
+        repo.get_dict(bucket='public-eo-data', key=item_key)
+        return True
+    except NoObjectError:
+        return False
+
+
+@mock_s3
+def test_sync(monkeypatch, s3_settings):
+    monkeypatch.setattr(services, 'build_stac_item', fake_build_stac_item)
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    bucket = s3.s3_resource.Bucket('public-eo-data')
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = repo.stac_read_method
+
+    for acquisition_name in ('kept', 'new', 'changed', 'gone'):
+        bucket.put_object(Key=f'{IMAGERY_PATH}landsat_5/{acquisition_name}/{acquisition_name}_B1.tif', Body=b'1')
+    bucket.put_object(Key=f'{IMAGERY_PATH}unknown_sensor/acquisition/acquisition_B1.tif', Body=b'1')
+
+    # Catalog of a previous backfill, with the item of another region synced from its own imagery
+    services.create_stac_collection(repo, get_sensor_config('landsat_5'))
+    with CollectionBuffer(repo, bucket='public-eo-data') as buffer:
+        for acquisition_key in [f'{IMAGERY_PATH}landsat_5/{name}/' for name in ('kept', 'changed', 'gone')] + \
+                               [f'{OTHER_IMAGERY_PATH}landsat_5/other/']:
+            services.commit_stac_item(repo, fake_build_stac_item(repo, acquisition_key, None),
+                                      item_key=services.get_item_key(acquisition_key),
+                                      collection_key=COLLECTION_KEY, collection_buffer=buffer)
+    other_state = {f'{OTHER_IMAGERY_PATH}landsat_5/other/': 'fingerprint'}
+    repo.add_json_from_dict(bucket='public-eo-data', key=sync.SYNC_STATE_KEY, stac_dict={'acquisitions': other_state})
+
+    plan = sync.plan_sync(repo, imagery_prefix=IMAGERY_PATH)
+
+    assert plan.added == [f'{IMAGERY_PATH}landsat_5/new/']
+    assert plan.changed == []
+    assert sorted(plan.unchanged) == [f'{IMAGERY_PATH}landsat_5/{name}/' for name in ('changed', 'gone', 'kept')]
+    # The item of the other region has no imagery here, but was not synced from here either
+    assert plan.removed == []
+
+    summary = sync.sync(repo, plan=plan, prune=True)
+
+    assert summary['added'] == plan.added
+    assert summary['removed'] == []
+    assert summary['failed'] == []
+    assert get_item_hrefs(repo) == ['changed', 'gone', 'kept', 'new', 'other']
+    assert sync.get_sync_state(repo, 'public-eo-data').items() >= other_state.items()
+
+    bucket.put_object(Key=f'{IMAGERY_PATH}landsat_5/changed/changed_B1.tif', Body=b'2')
+    bucket.Object(f'{IMAGERY_PATH}landsat_5/gone/gone_B1.tif').delete()
+    gone_item_key = services.get_item_key(f'{IMAGERY_PATH}landsat_5/gone/')
+    plan = sync.plan_sync(repo, imagery_prefix=IMAGERY_PATH)
+
+    assert (plan.added, plan.changed, plan.removed) == ([], [f'{IMAGERY_PATH}landsat_5/changed/'], [gone_item_key])
+
+    # Pruning is opt-in, the removed acquisition is kept in the state for a later sync to prune
+    summary = sync.sync(repo, plan=plan)
+
+    assert (summary['changed'], summary['removed']) == (plan.changed, [])
+    assert item_exists(repo, gone_item_key)
+
+    plan = sync.plan_sync(repo, imagery_prefix=IMAGERY_PATH)
+    assert (plan.added, plan.changed, plan.removed) == ([], [], [gone_item_key])
+    assert sync.sync(repo, plan=plan, prune=True)['removed'] == [gone_item_key]
+    assert not item_exists(repo, gone_item_key)
+    assert get_item_hrefs(repo) == ['changed', 'kept', 'new', 'other']
+
+    plan = sync.plan_sync(repo, imagery_prefix=IMAGERY_PATH)
+    assert (plan.added, plan.changed, plan.removed) == ([], [], [])
+    assert sync.get_sync_state(repo, 'public-eo-data').items() >= other_state.items()
+
+
+@mock_s3
+def test_sync_does_not_prune_without_acquisitions(s3_settings):
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    repo = repository.S3Repository(s3)
+    item_key = services.get_item_key(f'{IMAGERY_PATH}landsat_5/synced/')
+    repo.add_json_from_dict(bucket='public-eo-data', key=item_key, stac_dict={})
+    repo.add_json_from_dict(bucket='public-eo-data', key=sync.SYNC_STATE_KEY,
+                            stac_dict={'acquisitions': {f'{IMAGERY_PATH}landsat_5/synced/': 'fingerprint'}})
+
+    # Nothing is listed under a prefix missing its trailing slash
+    plan = sync.plan_sync(repo, imagery_prefix=IMAGERY_PATH.rstrip('/'))
+
+    assert plan.acquisitions == {}
+    assert plan.removed == []
+    assert sync.sync(repo, plan=plan, prune=True)['removed'] == []
+    assert item_exists(repo, item_key)
+    # The state is written, still holding the acquisition for a later sync to prune
+    assert sync.get_sync_state(repo, 'public-eo-data') == {f'{IMAGERY_PATH}landsat_5/synced/': 'fingerprint'}
+
+
+@mock_s3
+def test_prune_items_shrinks_extent(s3_settings):
+    s3 = S3(key=None, secret=None, s3_endpoint=None, region_name='us-east-1')
+    s3.s3_resource.create_bucket(Bucket='public-eo-data')
+    repo = repository.S3Repository(s3)
+    STAC_IO.read_text_method = repo.stac_read_method
+
+    services.create_stac_collection(repo, get_sensor_config('landsat_5'))
+    item_keys = []
+    with CollectionBuffer(repo, bucket='public-eo-data') as buffer:
+        for name, bbox, year in (('kept', [1.0, 2.0, 3.0, 4.0], 1992), ('gone', [0.0, 0.0, 10.0, 10.0], 1995)):
+            acquisition_key = f'{IMAGERY_PATH}landsat_5/{name}/'
+            item = fake_build_stac_item(repo, acquisition_key, None)
+            item.bbox = bbox
+            item.datetime = item.datetime.replace(year=year)
+            item_keys.append(services.get_item_key(acquisition_key))
+            services.commit_stac_item(repo, item, item_key=item_keys[-1], collection_key=COLLECTION_KEY,
+                                      collection_buffer=buffer)
+
+    assert sync.prune_items(repo, item_keys[1:]) == item_keys[1:]
+
+    extent = repo.get_dict(bucket='public-eo-data', key=COLLECTION_KEY)['extent']
+    assert get_item_hrefs(repo) == ['kept']
+    assert extent['spatial']['bbox'] == [[1.0, 2.0, 3.0, 4.0]]
+    assert [interval[0][:4] for interval in extent['temporal']['interval']] == ['1992']